@@ -1,58 +1,635 @@
 import os
-from flask import Flask, render_template, request, jsonify
-from FlagEmbedding import FlagReranker
-from tenacity import retry, stop_after_attempt, wait_exponential
+import argparse
+import json
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 from flask_caching import Cache
 import time
-from functools import wraps
-from collections import defaultdict
+from functools import partial, wraps
+from collections import defaultdict, namedtuple
+import random
 import threading
-import multiprocessing
 from flask_cors import CORS
 import signal
 from statistics import mean
+import numpy as np
+from inference_scheduler import InferenceScheduler
+from intent_cache import intent_cache_key
+from error_rate import SlidingWindowErrorRate
+from access_history import AccessHistory, TimestampFormatter, decode_cursor, encode_cursor, query_accesses
+from model_registry import ModelRegistry, fork_context, memory_usage_mb
+from latency import LatencyRecorder
+from metrics import MetricsRegistry
+from resilience import ResilientCaller, RetryBudget
+from admission import AdmissionController
+from bulk_classify import classify_file
+from content_filter import ContentFilterLoader
+from health_board import HealthBoard
+from pair_encoding import LENGTH_BUCKETS, PairEncoder, length_bucket, run_reranker
+from semantic_cache import HashingVectorizer, SemanticCache
+
+# Résultat de classification d'un message : tag gagnant, score de chaque tag
+# et nom du modèle qui a produit ces scores
+IntentResult = namedtuple('IntentResult', ['tag', 'scores', 'tier'])
+
+
+def load_reranker(model_name, use_fp16=True):
+    # Import différé : FlagEmbedding (et torch) ne sont importés qu'au premier modèle chargé
+    from FlagEmbedding import FlagReranker
+    return FlagReranker(model_name, use_fp16=use_fp16)
+
+
+def load_embedder(model_name, use_fp16=True):
+    from FlagEmbedding import FlagModel
+    return FlagModel(model_name, use_fp16=use_fp16)
+
+
+# Registre des modèles du processus, partagé par toutes les instances de ChatbotAPI
+model_registry = ModelRegistry(loader=lambda model_name, use_fp16: load_reranker(model_name, use_fp16))
+embedding_registry = ModelRegistry(loader=lambda model_name, use_fp16: load_embedder(model_name, use_fp16))
 
 class App1:
-    def __init__(self):
+    port = 8080
+    primary_model_name = 'BAAI/bge-reranker-large'
+    secondary_model_name = 'BAAI/bge-reranker-base'
+    # Cascade : le modèle secondaire score d'abord, le primaire n'intervient que si
+    # l'écart entre les deux meilleurs tags est inférieur à cascade_margin
+    cascade_enabled = False
+    cascade_margin = 0.1
+    # Backend de classification : 'reranker' (cross-encoder) ou 'embedding'
+    classifier_backend = 'reranker'
+    embedding_model_name = 'BAAI/bge-small-en-v1.5'
+    # Micro-batching des requêtes /chat concurrentes (voir InferenceScheduler)
+    max_batch_size = 32
+    max_batch_wait = 0.005
+    # Entrées du reranker : budget de tokens d'un message, décalage des fenêtres pour les
+    # messages plus longs (None : troncature) et nombre maximal de paires par passage
+    message_token_budget = 256
+    message_window_stride = None
+    max_pairs_per_forward = 64
+    # Le budget s'applique aussi à compute_score (max_length) ; les fenêtres et le regroupement
+    # par passage ne s'appliquent qu'avec tokenized_scoring : le modèle est alors appelé
+    # directement (hors compute_score), à n'activer qu'après vérification de la parité
+    # des scores sur le modèle déployé (voir test_tokenized_scoring_matches_compute_score)
+    tokenized_scoring = False
+    # Cache de similarité devant chatbot_response : nombre de messages indexés (None pour
+    # le désactiver), seuil de similarité, fraction des succès vérifiés par le modèle et
+    # vecteur utilisé ('hashing' ou 'embedding')
+    semantic_cache_size = None
+    semantic_cache_threshold = 0.9
+    semantic_cache_audit_rate = 0.05
+    semantic_cache_vectorizer = 'hashing'
+    # Threads d'inférence par processus : borne le nombre de passages simultanés du modèle
+    inference_threads = 1
+    # Cache des intentions : durée de vie (secondes) et nombre maximal d'entrées (LRU)
+    intent_cache_ttl = 300
+    intent_cache_size = 1024
+    # Fenêtre glissante du taux d'erreur de /chat (secondes) et taille des buckets
+    error_rate_window = 60
+    error_rate_bucket = 1
+    # Appels au modèle : échéance par requête (secondes), tentatives, attente avant
+    # le premier rejeu et fraction du trafic qui peut être rejouée
+    inference_deadline = 5.0
+    max_inference_attempts = 3
+    retry_backoff = 0.05
+    retry_budget_ratio = 0.1
+    # Couverture : si le primaire dépasse ce percentile de latence, secondary_llm est interrogé
+    hedging_enabled = False
+    hedge_percentile = 95
+    # Contrôle d'admission devant l'inférence : limite de concurrence initiale (ajustée
+    # pour garder la latence d'inférence sous admission_latency_target secondes), ses
+    # bornes, places et attente maximale (secondes) en file
+    admission_initial_limit = 32
+    admission_min_limit = 1
+    admission_max_limit = 256
+    admission_queue_size = 64
+    admission_queue_timeout = 0.1
+    admission_latency_target = 0.5
+    # Rétention de l'historique d'accès : nombre d'entrées par route et âge maximal (secondes)
+    access_history_max_entries = 100_000
+    access_history_max_age = None
+    # Liste de modération (un terme par ligne, voir content_filter.py), relue à chaud :
+    # au plus une vérification du fichier toutes les content_filter_reload_interval secondes
+    content_filter_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'moderation_terms.txt')
+    content_filter_reload_interval = 5.0
+    content_filter_casefold = True
+    # Correspondance par sous-chaîne, comme l'ancienne vérification ; True pour ne bloquer que des mots entiers
+    content_filter_whole_words = False
+    # Ligne de l'instance dans le HealthBoard partagé, intervalle de publication de son
+    # état (secondes, par un thread de fond, hors du chemin des requêtes) et âge au-delà
+    # duquel l'état d'une autre instance est ignoré
+    health_slot = 0
+    health_publish_interval = 0.25
+    health_stale_after = 3.0
+    # Message classé au démarrage pour chauffer les modèles avant de se déclarer prêt (/readyz)
+    warm_up_message = 'Hello, where is my order?'
+    # Nombre maximal de messages acceptés par un appel à /chat/batch
+    batch_max_messages = 10_000
+
+    def __init__(self, health_board=None):
         """
         Initialise l'application Flask et configure le cache, l'historique des accès,
         et les modèles de chatbot pour le traitement des requêtes.
+
+        :param health_board: HealthBoard partagé avec l'autre instance, le cas échéant.
         """
         self.app = Flask(__name__)
-        self.cache = Cache(self.app, config={'CACHE_TYPE': 'flask_caching.backends.SimpleCache'})
-        self.access_history = defaultdict(list)
-        self.primary_llm = self.ChatbotAPI(model_name='BAAI/bge-reranker-large')
-        self.secondary_llm = self.ChatbotAPI(model_name='BAAI/bge-reranker-base')
+        self.health_board = health_board
+        self.cache = Cache(self.app, config={
+            'CACHE_TYPE': 'intent_cache.LRUCache',
+            'CACHE_DEFAULT_TIMEOUT': self.intent_cache_ttl,
+            'CACHE_THRESHOLD': self.intent_cache_size,
+        })
+        self.metrics = MetricsRegistry()
+        self.content_filter = ContentFilterLoader(self.content_filter_path,
+                                                  reload_interval=self.content_filter_reload_interval,
+                                                  casefold=self.content_filter_casefold,
+                                                  whole_words=self.content_filter_whole_words)
+        self.access_history = AccessHistory(max_entries_per_route=self.access_history_max_entries,
+                                            max_age=self.access_history_max_age)
+        self.error_rate_tracker = SlidingWindowErrorRate(window_seconds=self.error_rate_window,
+                                                         bucket_seconds=self.error_rate_bucket)
+        # Les poids ne sont chargés qu'au premier appel du modèle (voir ModelRegistry)
+        self.primary_llm = self.ChatbotAPI(model_name=self.primary_model_name,
+                                           max_batch_size=self.max_batch_size,
+                                           max_batch_wait=self.max_batch_wait,
+                                           inference_threads=self.inference_threads,
+                                           cascade_model_name=self.secondary_model_name if self.cascade_enabled else None,
+                                           cascade_margin=self.cascade_margin,
+                                           backend=self.classifier_backend,
+                                           embedding_model_name=self.embedding_model_name,
+                                           metrics=self.metrics,
+                                           message_token_budget=self.message_token_budget,
+                                           window_stride=self.message_window_stride,
+                                           max_pairs_per_forward=self.max_pairs_per_forward,
+                                           tokenized_scoring=self.tokenized_scoring,
+                                           semantic_cache_size=self.semantic_cache_size,
+                                           semantic_cache_threshold=self.semantic_cache_threshold,
+                                           semantic_cache_audit_rate=self.semantic_cache_audit_rate,
+                                           semantic_cache_vectorizer=self.semantic_cache_vectorizer)
+        # Avec la couverture, le secondaire a son propre scheduler : ses passes dans le
+        # modèle restent bornées à inference_threads, comme celles du primaire
+        self.secondary_llm = self.ChatbotAPI(model_name=self.secondary_model_name, metrics=self.metrics,
+                                             max_batch_size=self.max_batch_size if self.hedging_enabled else None,
+                                             max_batch_wait=self.max_batch_wait,
+                                             inference_threads=self.inference_threads,
+                                             message_token_budget=self.message_token_budget,
+                                             window_stride=self.message_window_stride,
+                                             max_pairs_per_forward=self.max_pairs_per_forward,
+                                             tokenized_scoring=self.tokenized_scoring)
         self.current_llm = self.primary_llm
+        self.setup_metrics()
+        # Échéance, rejeux bornés par un budget commun et couverture vers secondary_llm ;
+        # un thread par requête admise (deux avec la couverture) pour ne pas attendre en file
+        self.inference = ResilientCaller(deadline=self.inference_deadline,
+                                         max_attempts=self.max_inference_attempts,
+                                         backoff=self.retry_backoff,
+                                         retry_budget=RetryBudget(ratio=self.retry_budget_ratio),
+                                         hedge_percentile=self.hedge_percentile,
+                                         pool_size=self.admission_max_limit * (2 if self.hedging_enabled else 1))
+        self.admission = AdmissionController(initial_limit=self.admission_initial_limit,
+                                             min_limit=self.admission_min_limit,
+                                             max_limit=self.admission_max_limit,
+                                             queue_size=self.admission_queue_size,
+                                             queue_timeout=self.admission_queue_timeout,
+                                             latency_target=self.admission_latency_target)
+        # Durée de chaque étape du traitement de /chat (voir record_stage)
+        self.stage_latency = defaultdict(LatencyRecorder)
+        # Passe à True lorsque l'application est servie par gunicorn (voir wsgi.py)
+        self.production = False
+        # Positionné par warm_up une fois les modèles chargés et chauffés (voir /readyz)
+        self.ready = threading.Event()
+        self.warm_up_seconds = None
+        self.warm_up_error = None
+        self._warm_up_thread = None
         CORS(self.app)
 
     class ChatbotAPI:
-        def __init__(self, model_name, use_fp16=True):
+        def __init__(self, model_name, use_fp16=True, max_batch_size=None, max_batch_wait=0.005, inference_threads=1,
+                     cascade_model_name=None, cascade_margin=0.1, backend='reranker',
+                     embedding_model_name='BAAI/bge-small-en-v1.5', metrics=None,
+                     message_token_budget=256, window_stride=None, max_pairs_per_forward=64,
+                     tokenized_scoring=False, semantic_cache_size=None, semantic_cache_threshold=0.9,
+                     semantic_cache_audit_rate=0.05, semantic_cache_vectorizer='hashing'):
             """
             Initialise le modèle de chatbot avec le nom du modèle spécifié.
 
             :param model_name: Le nom du modèle à utiliser pour la classification.
             :param use_fp16: Booléen indiquant si le modèle doit utiliser la précision flottante 16.
+            :param max_batch_size: Si renseigné, les messages de requêtes concurrentes sont
+                                   regroupés par un InferenceScheduler jusqu'à cette taille.
+            :param max_batch_wait: Attente maximale (en secondes) pour compléter un batch.
+            :param inference_threads: Nombre de threads d'inférence du scheduler.
+            :param cascade_model_name: Si renseigné, modèle plus léger qui score d'abord chaque
+                                       message ; model_name n'est utilisé qu'en cas de doute.
+            :param cascade_margin: Écart minimal entre les deux meilleurs scores du modèle léger
+                                   en dessous duquel le message est rescoré par model_name.
+            :param backend: 'reranker' pour scorer chaque paire (tag, message) avec le
+                            cross-encoder, 'embedding' pour comparer l'embedding du message
+                            à ceux des descriptions de tags, calculés une seule fois.
+            :param embedding_model_name: Le modèle d'embedding utilisé par le backend 'embedding'.
+            :param metrics: Le MetricsRegistry où publier les métriques d'inférence
+                            (un registre propre au modèle si non renseigné).
+            :param message_token_budget: Nombre maximal de tokens d'un message dans une paire
+                                         (voir PairEncoder).
+            :param window_stride: Si renseigné, les messages trop longs sont découpés en fenêtres
+                                  décalées de window_stride tokens au lieu d'être tronqués.
+            :param max_pairs_per_forward: Nombre maximal de paires par passage dans le modèle.
+            :param tokenized_scoring: Si True, les paires sont préparées par un PairEncoder et le
+                                      modèle du reranker est appelé directement ; sinon les scores
+                                      viennent de compute_score.
+            :param semantic_cache_size: Si renseigné, nombre de messages indexés par le cache
+                                        de similarité de chatbot_response (voir SemanticCache).
+            :param semantic_cache_threshold: Similarité cosinus minimale pour réutiliser une intention.
+            :param semantic_cache_audit_rate: Fraction des succès du cache rescorés par le modèle
+                                              pour mesurer le taux d'accord.
+            :param semantic_cache_vectorizer: 'hashing' (mots et trigrammes hachés, sans modèle) ou
+                                              'embedding' (embedding_model_name).
             """
-            self.reranker = FlagReranker(model_name, use_fp16=use_fp16)
+            if backend not in self.backends:
+                raise ValueError(f"Unknown classifier backend: {backend!r}")
+            self.model_name = model_name
+            self.use_fp16 = use_fp16
+            self._reranker = None
+            self.cascade_model_name = cascade_model_name
+            self.cascade_margin = cascade_margin
+            self._cascade_reranker = None
+            self.backend = backend
+            self.embedding_model_name = embedding_model_name
+            self._embedder = None
+            self._tag_embeddings = None
             self.tag_list = ['complaint', 'refund', 'query', 'inventory', 'satisfaction']
+            # Texte embarqué pour chaque tag par le backend 'embedding' (le tag lui-même par défaut)
+            self.tag_descriptions = {
+                'complaint': 'The customer complains about a problem with a product or service',
+                'refund': 'The customer wants a refund or their money back',
+                'query': 'The customer asks a question or requests information',
+                'inventory': 'The customer asks whether a product is in stock or available',
+                'satisfaction': 'The customer is happy and thanks the support team',
+            }
+            self.message_token_budget = message_token_budget
+            self.window_stride = window_stride
+            self.max_pairs_per_forward = max_pairs_per_forward
+            self.tokenized_scoring = tokenized_scoring
+            self._pair_encoders = {}
+            self._stats_lock = threading.Lock()
+            # Par tranche de longueur : [messages, secondes d'inférence, tokens, messages tronqués]
+            self.length_cost = defaultdict(lambda: [0, 0.0, 0, 0])
+            self.cascade_messages = 0
+            self.cascade_escalations = 0
+            self.tier_latency = defaultdict(LatencyRecorder)
+            self.metrics = MetricsRegistry() if metrics is None else metrics
+            self.reranker_duration = self.metrics.histogram(
+                'chatbot_reranker_call_duration_seconds', "Durée d'un appel batché au modèle de scoring.",
+                ('model',))
+            self.reranker_tag_seconds = self.metrics.counter(
+                'chatbot_reranker_tag_seconds_total',
+                "Temps de reranker attribué à chaque tag, au prorata de la longueur de ses paires.",
+                ('model', 'tag'))
+            self.reranker_pairs = self.metrics.counter(
+                'chatbot_reranker_pairs_total', "Paires (tag, message) scorées.", ('model', 'tag'))
+            self.response_duration = self.metrics.histogram(
+                'chatbot_response_duration_seconds', "Durée de chatbot_response (par tentative).", ('model',))
+            self.message_duration = self.metrics.histogram(
+                'chatbot_inference_seconds_per_message', "Temps d'inférence par message, par tranche de longueur.",
+                ('length',))
+            self.intents = self.metrics.counter(
+                'chatbot_intent_total', "Intentions détectées.", ('model', 'tag'))
+            if semantic_cache_vectorizer not in self.semantic_cache_vectorizers:
+                raise ValueError(f"Unknown semantic cache vectorizer: {semantic_cache_vectorizer!r}")
+            self.semantic_cache = None
+            if semantic_cache_size:
+                self.semantic_cache = SemanticCache(capacity=semantic_cache_size, threshold=semantic_cache_threshold)
+            self.semantic_cache_audit_rate = semantic_cache_audit_rate
+            self.semantic_cache_vectorizer = semantic_cache_vectorizer
+            self._hashing_vectorizer = HashingVectorizer()
+            self.scheduler = None
+            if max_batch_size:
+                self.scheduler = InferenceScheduler(self, max_batch_size=max_batch_size,
+                                                    max_wait=max_batch_wait,
+                                                    num_workers=inference_threads)
+
+        backends = ('reranker', 'embedding')
+        semantic_cache_vectorizers = ('hashing', 'embedding')
+        response_template = 'intent: "{tag}"'
+        tier_template = ' (tier: "{tier}")'
+
+        @property
+        def reranker(self):
+            """Le reranker du modèle, chargé via le registre au premier accès."""
+            if self._reranker is None:
+                self._reranker = model_registry.get(self.model_name, use_fp16=self.use_fp16)
+            return self._reranker
+
+        @property
+        def cascade_reranker(self):
+            """Le reranker léger de la cascade, chargé via le registre au premier accès."""
+            if self._cascade_reranker is None:
+                self._cascade_reranker = model_registry.get(self.cascade_model_name, use_fp16=self.use_fp16)
+            return self._cascade_reranker
+
+        @property
+        def embedder(self):
+            """Le modèle d'embedding du backend 'embedding', chargé via le registre au premier accès."""
+            if self._embedder is None:
+                self._embedder = embedding_registry.get(self.embedding_model_name, use_fp16=self.use_fp16)
+            return self._embedder
+
+        @property
+        def scoring_model_name(self):
+            """Le nom du modèle qui produit les scores du backend configuré."""
+            return self.embedding_model_name if self.backend == 'embedding' else self.model_name
+
+        @property
+        def cache_model_name(self):
+            """Le modèle dont les réponses sont mises en cache : le modèle léger en mode cascade."""
+            return self.cascade_model_name or self.scoring_model_name
+
+        def is_cacheable(self, response):
+            """
+            :param response: Une réponse renvoyée par chatbot_response.
+            :return: True si la réponse vient de cache_model_name ; en mode cascade, une
+                     réponse après escalade (ou servie par le cache sémantique) porte un
+                     autre tier et n'est pas mise en cache.
+            """
+            if self.cascade_model_name is None:
+                return True
+            return response.endswith(self.tier_template.format(tier=self.cascade_model_name))
+
+        def _embed(self, texts):
+            embeddings = np.asarray(self.embedder.encode(list(texts)), dtype=float)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            return embeddings / np.where(norms == 0, 1, norms)
+
+        @property
+        def tag_embeddings(self):
+            """
+            Embeddings normalisés des descriptions de tags, calculés une seule fois.
+            Recalculés si tag_list change.
+            """
+            tags = tuple(self.tag_list)
+            if self._tag_embeddings is None or self._tag_embeddings[0] != tags:
+                descriptions = [self.tag_descriptions.get(tag, tag) for tag in tags]
+                self._tag_embeddings = (tags, self._embed(descriptions))
+            return self._tag_embeddings[1]
+
+        def score_messages(self, messages, reranker=None):
+            """
+            Calcule les scores de toutes les paires (tag, message) en un seul appel au reranker.
+
+            Avec le backend 'embedding', chaque message est embarqué une seule fois et
+            comparé à tous les tags par un produit matriciel (similarité cosinus).
+
+            :param messages: La liste des messages à classer.
+            :param reranker: Le reranker à utiliser ; par défaut, le backend configuré.
+            :return: Une matrice numpy de forme (len(messages), len(tag_list)).
+            """
+            if reranker is None and self.backend == 'embedding':
+                tag_embeddings = self.tag_embeddings
+                return self._embed(messages) @ tag_embeddings.T
+            reranker = self.reranker if reranker is None else reranker
+            if self.tokenized_scoring and getattr(reranker, 'tokenizer', None) is not None \
+                    and getattr(reranker, 'model', None) is not None:
+                return self._score_tokenized(messages, reranker)
+            pairs = [[tag, message] for message in messages for tag in self.tag_list]
+            options, lengths = {}, None
+            if getattr(reranker, 'tokenizer', None) is not None:
+                # Même budget de tokens que le chemin tokenisé : compute_score tronque les paires
+                encoder = self.pair_encoder(reranker)
+                options['max_length'] = encoder.max_pair_length
+                lengths = encoder.message_lengths(messages)
+            start = time.perf_counter()
+            scores = reranker.compute_score(pairs, normalize=True, **options)
+            elapsed = time.perf_counter() - start
+            if lengths is not None:
+                # compute_score ne donne qu'une durée totale : répartie selon les tokens gardés
+                kept = np.minimum(lengths, encoder.budget)
+                self.record_length_cost(lengths, elapsed * kept / max(1, kept.sum()), encoder.budget)
+            # compute_score renvoie un float seul lorsqu'il ne reçoit qu'une paire
+            scores = np.atleast_1d(np.asarray(scores, dtype=float))
+            return scores.reshape(len(messages), len(self.tag_list))
+
+        def pair_encoder(self, reranker):
+            """
+            :return: Le PairEncoder du reranker pour les tags courants : les tags ne sont
+                     tokenisés qu'une fois par reranker (et de nouveau si tag_list change).
+            """
+            key = (id(reranker), tuple(self.tag_list))
+            encoder = self._pair_encoders.get(key)
+            if encoder is None:
+                encoder = self._pair_encoders[key] = PairEncoder(
+                    reranker.tokenizer, self.tag_list, message_token_budget=self.message_token_budget,
+                    window_stride=self.window_stride)
+            return encoder
+
+        def _score_tokenized(self, messages, reranker):
+            # Équivalent de compute_score(pairs, normalize=True), avec tags tokenisés une fois,
+            # messages tokenisés une fois, tronqués ou fenêtrés, et batchs triés par longueur
+            encoder = self.pair_encoder(reranker)
+            pairs, lengths = encoder.encode(messages)
+            logits = np.full((len(messages), len(self.tag_list)), -np.inf)
+            message_seconds = np.zeros(len(messages))
+            for batch, input_ids, attention_mask in encoder.batches(pairs, self.max_pairs_per_forward):
+                start = time.perf_counter()
+                batch_logits = run_reranker(reranker, input_ids, attention_mask)
+                elapsed = time.perf_counter() - start
+                rows = np.fromiter((row for row, _, _ in batch), dtype=np.intp, count=len(batch))
+                columns = np.fromiter((column for _, column, _ in batch), dtype=np.intp, count=len(batch))
+                # Message fenêtré : le score d'un tag est le meilleur score de ses fenêtres
+                np.maximum.at(logits, (rows, columns), batch_logits)
+                # Dans un batch complété au même nombre de tokens, chaque paire coûte autant
+                np.add.at(message_seconds, rows, elapsed / len(batch))
+            self.record_length_cost(lengths, message_seconds, encoder.budget)
+            return 1 / (1 + np.exp(-logits))
+
+        def record_length_cost(self, lengths, message_seconds, budget):
+            """
+            Enregistre le temps d'inférence de chaque message selon sa longueur en tokens.
+
+            :param lengths: Le nombre de tokens de chaque message.
+            :param message_seconds: Le temps d'inférence attribué à chaque message.
+            :param budget: Le budget de tokens au-delà duquel un message est tronqué ou fenêtré.
+            """
+            with self._stats_lock:
+                for tokens, seconds in zip(lengths, message_seconds):
+                    bucket = length_bucket(tokens)
+                    cost = self.length_cost[bucket]
+                    cost[0] += 1
+                    cost[1] += seconds
+                    cost[2] += tokens
+                    cost[3] += tokens > budget
+            for tokens, seconds in zip(lengths, message_seconds):
+                self.message_duration.observe(float(seconds), length_bucket(tokens))
+
+        def length_stats(self):
+            """
+            Coût d'inférence par message en fonction de sa longueur en tokens.
+
+            :return: Un dictionnaire {tranche de longueur: statistiques}, des plus courts aux plus longs.
+            """
+            order = [length_bucket(bound) for bound in LENGTH_BUCKETS] + [length_bucket(LENGTH_BUCKETS[-1] + 1)]
+            with self._stats_lock:
+                costs = {bucket: list(cost) for bucket, cost in self.length_cost.items()}
+            return {bucket: {'messages': cost[0],
+                             'mean_ms_per_message': cost[1] / cost[0] * 1000,
+                             'mean_tokens': cost[2] / cost[0],
+                             'over_budget': cost[3]}
+                    for bucket, cost in sorted(costs.items(), key=lambda item: order.index(item[0]))}
+
+        def _timed_scores(self, tier, messages, reranker=None):
+            start = time.perf_counter()
+            score_matrix = self.score_messages(messages, reranker)
+            elapsed = time.perf_counter() - start
+            self.tier_latency[tier].record(elapsed)
+            self.reranker_duration.observe(elapsed, tier)
+            if reranker is not None or self.backend == 'reranker':
+                # Tous les tags passent dans le même appel : le temps est réparti au prorata
+                # de la longueur des paires, approximation du nombre de tokens
+                message_chars = sum(len(message) for message in messages)
+                pair_chars = [len(tag) * len(messages) + message_chars for tag in self.tag_list]
+                total_chars = sum(pair_chars) or 1
+                for tag, chars in zip(self.tag_list, pair_chars):
+                    self.reranker_tag_seconds.inc(tier, tag, amount=elapsed * chars / total_chars)
+                    self.reranker_pairs.inc(tier, tag, amount=len(messages))
+            return score_matrix
+
+        def pick_winners(self, score_matrix):
+            """
+            Sélectionne le tag gagnant de chaque ligne de la matrice de scores.
+
+            :param score_matrix: La matrice renvoyée par score_messages.
+            :return: La liste des tags gagnants, un par message.
+            """
+            # argmax sur les colonnes inversées : en cas d'égalité on garde le dernier tag,
+            # comme le faisait l'ancien tri stable suivi de sorted_data[-1]
+            last = score_matrix.shape[1] - 1
+            indices = last - np.argmax(score_matrix[:, ::-1], axis=1)
+            return [self.tag_list[i] for i in indices]
+
+        def classify_batch(self, messages):
+            """
+            Classe une liste de messages. En mode cascade, seuls les messages pour
+            lesquels le modèle léger hésite sont rescorés par le modèle principal.
+
+            :param messages: La liste des messages à classer.
+            :return: Une liste d'IntentResult, un par message.
+            """
+            if self.cascade_model_name is None:
+                score_matrix = self._timed_scores(self.scoring_model_name, messages)
+                tiers = [self.scoring_model_name] * len(messages)
+            else:
+                score_matrix = self._timed_scores(self.cascade_model_name, messages, self.cascade_reranker)
+                tiers = [self.cascade_model_name] * len(messages)
+                uncertain = np.empty(0, dtype=int)
+                if len(self.tag_list) > 1:
+                    top_two = np.sort(score_matrix, axis=1)[:, -2:]
+                    uncertain = np.flatnonzero(top_two[:, 1] - top_two[:, 0] < self.cascade_margin)
+                if uncertain.size:
+                    score_matrix[uncertain] = self._timed_scores(self.scoring_model_name,
+                                                                 [messages[i] for i in uncertain])
+                    for i in uncertain:
+                        tiers[i] = self.scoring_model_name
+                with self._stats_lock:
+                    self.cascade_messages += len(messages)
+                    self.cascade_escalations += uncertain.size
+
+            winners = self.pick_winners(score_matrix)
+            return [IntentResult(winner, dict(zip(self.tag_list, row.tolist())), tier)
+                    for winner, row, tier in zip(winners, score_matrix, tiers)]
+
+        def classify(self, message):
+            """
+            Classe un message et renvoie le score de chaque tag.
+
+            :param message: Le message envoyé par l'utilisateur.
+            :return: Un IntentResult (tag gagnant, dictionnaire {tag: score}, modèle ayant répondu).
+            """
+            if self.scheduler is not None:
+                return self.scheduler.classify(message)
+            return self.classify_batch([message])[0]
+
+        def classify_many(self, messages):
+            """
+            Classe une liste de messages, via le scheduler s'il existe : les messages
+            rejoignent alors les batchs des requêtes /chat et restent soumis à la
+            limite de threads d'inférence.
+
+            :param messages: La liste des messages.
+            :return: La liste des IntentResult, dans l'ordre des messages.
+            """
+            if not messages:
+                return []
+            if self.scheduler is not None:
+                futures = [self.scheduler.submit(message) for message in messages]
+                return [future.result() for future in futures]
+            return self.classify_batch(messages)
+
+        def cascade_stats(self):
+            """
+            Taux d'escalade vers le modèle principal et latence de chaque étage.
+
+            :return: Un dictionnaire sérialisable en JSON.
+            """
+            with self._stats_lock:
+                messages, escalations = self.cascade_messages, self.cascade_escalations
+            return {
+                'enabled': self.cascade_model_name is not None,
+                'margin': self.cascade_margin,
+                'messages': messages,
+                'escalations': escalations,
+                'escalation_rate': escalations / messages if messages else 0,
+                'tiers': {tier: recorder.snapshot() for tier, recorder in list(self.tier_latency.items())},
+            }
 
-        @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1.5, min=4, max=10))
         def chatbot_response(self, message):
             """
             Génère une réponse du chatbot basée sur le message utilisateur.
 
             :param message: Le message envoyé par l'utilisateur.
-            :return: Un json indiquant l'intention détectée du message.
+            :return: Un json indiquant l'intention détectée du message
+                     (et, en mode cascade, le modèle qui a répondu).
+            """
+            start = time.perf_counter()
+            cache = self.semantic_cache
+            if cache is not None:
+                vector = self.message_vector(message)
+                cached_tag = cache.lookup(vector)
+                if cached_tag is not None and random.random() < self.semantic_cache_audit_rate:
+                    # Sur un échantillon des succès, le modèle vérifie l'intention réutilisée ;
+                    # en cas de désaccord, sa réponse est servie et l'entrée du cache corrigée
+                    result = self.classify(message)
+                    cache.record_audit(result.tag == cached_tag)
+                    if result.tag != cached_tag:
+                        cache.correct(vector, result.tag)
+                    self.response_duration.observe(time.perf_counter() - start, result.tier)
+                    return self.format_response(result)
+                if cached_tag is not None:
+                    result = IntentResult(cached_tag, {}, 'semantic_cache')
+                    self.response_duration.observe(time.perf_counter() - start, result.tier)
+                    return self.format_response(result)
+            result = self.classify(message)
+            if cache is not None:
+                cache.add(vector, result.tag)
+            self.response_duration.observe(time.perf_counter() - start, result.tier)
+            return self.format_response(result)
+
+        def message_vector(self, message):
+            """:return: Le vecteur normalisé du message utilisé par le cache de similarité."""
+            if self.semantic_cache_vectorizer == 'embedding':
+                return self._embed([message])[0].astype(np.float32)
+            return self._hashing_vectorizer(message)
+
+        def format_response(self, result):
             """
-            scores = []
-            for e in self.tag_list:
-                score = self.reranker.compute_score([[e, message]], normalize=True)
-                scores.append([e, score])
+            Met en forme la réponse renvoyée au client pour un message classé.
 
-            sorted_data = sorted(scores, key=lambda x: x[1][0])
-            winner_tag = sorted_data[-1][0]
-            return f"intent: \"{winner_tag}\""
+            :param result: L'IntentResult du message.
+            :return: La réponse (et, en mode cascade, le modèle qui a répondu).
+            """
+            self.intents.inc(result.tier, result.tag)
+            response = self.response_template.format(tag=result.tag)
+            if self.cascade_model_name is not None:
+                response += self.tier_template.format(tier=result.tier)
+            return response
 
     def log_status(self, f):
         """
@@ -63,19 +640,41 @@ class App1:
         """
         @wraps(f)
         def wrapper(*args, **kwargs):
+            start = time.perf_counter()
             response = f(*args, **kwargs)
+            elapsed = time.perf_counter() - start
             status_code = response[1] if isinstance(response, tuple) else 200
             timestamp = time.time()
             
             key = request.path
-            self.access_history[key].append({
-                'status_code': status_code,
-                'timestamp': timestamp
-            })
+            self.access_history.record(key, status_code, timestamp)
+            if key == '/chat':
+                self.error_rate_tracker.record(status_code, timestamp)
+            self.http_requests.inc(key, status_code)
+            self.http_duration.observe(elapsed, key)
             
             return response
         return wrapper
 
+    def moderate_message(self, message):
+        """
+        Cherche la règle qui refuse un message, le cas échéant.
+
+        :param message: Le message à vérifier.
+        :return: None si le message est valide, sinon la règle déclenchée : 'empty',
+                 'digits_only' ou le terme de la liste de modération.
+        """
+        stripped = message.strip()
+        if not stripped:
+            return 'empty'
+        if stripped.isdigit():
+            return 'digits_only'
+        match = self.content_filter.find(message)
+        if match is not None:
+            self.content_filter_matches.inc(match.rule)
+            return match.rule
+        return None
+
     def check_user_message(self, message):
         """
         Vérifie si le message de l'utilisateur est valide selon plusieurs critères.
@@ -83,58 +682,258 @@ class App1:
         :param message: Le message à vérifier.
         :return: True si le message est valide, sinon False.
         """
-        message_is_correct = False
-        conditions = (
-            'racist' not in message.lower() and  # Vérifie l'absence du mot "racist" (insensible à la casse)
-            len(message.strip()) > 0 and  # Vérifie que le message n'est pas vide après suppression des espaces
-            not message.strip().isdigit()  # Vérifie que le message ne contient pas que des chiffres
-        )
-        message_is_correct = conditions
-        return message_is_correct
+        return self.moderate_message(message) is None
+
+    def classify_messages(self, messages, chunk_size=None, admission=None):
+        """
+        Classe une liste de messages par paquets : chaque message passe par
+        moderate_message, les messages valides d'un paquet sont scorés ensemble.
+        Si le modèle échoue sur un paquet, ses messages valides sont rapportés en
+        erreur 500 et le paquet suivant est tout de même traité.
+
+        :param messages: La liste des messages.
+        :param chunk_size: Nombre de messages envoyés au modèle à la fois (max_batch_size par défaut).
+        :param admission: Si renseigné, l'AdmissionController qui doit admettre chaque paquet
+                          avant son passage dans le modèle (attente d'au plus inference_deadline).
+        :return: Un générateur de dictionnaires, dans l'ordre des messages :
+                 {'status': 200, 'intent': ..., 'response': ...},
+                 {'status': 403, 'error': 'Message check failed', 'rule': <règle déclenchée>},
+                 {'status': 500, 'error': 'LLM failed'} ou
+                 {'status': 503, 'error': 'Server overloaded'}.
+        """
+        chunk_size = chunk_size or self.max_batch_size
+        llm = self.current_llm
+        for chunk_start in range(0, len(messages), chunk_size):
+            chunk = messages[chunk_start:chunk_start + chunk_size]
+            rules = [self.moderate_message(message) if isinstance(message, str) else 'not_a_string'
+                     for message in chunk]
+            valid = [message for message, rule in zip(chunk, rules) if rule is None]
+            results, failure = [], None
+            if valid:
+                if admission is not None and not admission.acquire(timeout=self.inference_deadline):
+                    failure = {'status': 503, 'error': 'Server overloaded'}
+                else:
+                    try:
+                        results = llm.classify_many(valid)
+                    except Exception as e:
+                        print(f"Current LLM failed: {str(e)}")
+                        failure = {'status': 500, 'error': 'LLM failed'}
+                    finally:
+                        if admission is not None:
+                            # Pas de durée : un paquet n'a pas la latence cible d'un message de /chat
+                            admission.release()
+            results = iter(results)
+            for rule in rules:
+                if rule is not None:
+                    yield {'status': 403, 'error': 'Message check failed', 'rule': rule}
+                elif failure is not None:
+                    yield dict(failure)
+                else:
+                    result = next(results)
+                    yield {'status': 200, 'intent': result.tag, 'response': llm.format_response(result)}
+
+    def iter_status_cache(self, route=None, status_code=None, since=None, until=None,
+                          cursor_path=None, cursor_seq=0):
+        """
+        Parcourt l'historique d'accès, route par route, sans construire de liste.
+
+        :param route: Ne parcourt que cette route si renseignée.
+        :param status_code: Ne renvoie que les accès avec ce code de statut.
+        :param since: Timestamp minimal (inclus).
+        :param until: Timestamp maximal (inclus).
+        :param cursor_path: Route à laquelle reprendre la pagination.
+        :param cursor_seq: Numéro de séquence auquel reprendre dans cursor_path.
+        :return: Un générateur de tuples (route, séquence, code de statut, timestamp).
+        """
+        started = cursor_path is None
+        for path, accesses in self.access_history.items():
+            if route is not None and path != route:
+                continue
+            start_seq = 0
+            if not started:
+                if path != cursor_path:
+                    continue
+                started, start_seq = True, cursor_seq
+            for seq, code, timestamp in query_accesses(accesses, since, until, status_code, start_seq):
+                yield path, seq, code, timestamp
 
     def count_server_error_rate_in_chat_cache(self):
         """
-        Obtient les statistiques des erreurs du backend en comptant les réponses 
-        réussies et les erreurs dans l'historique d'accès.
+        Obtient le taux d'erreur du backend sur la fenêtre glissante de /chat
+        (error_rate_window secondes), sans parcourir l'historique d'accès.
 
         :return: Le taux d'erreur du backend en pourcentage.
                  Retourne 0 si aucune donnée n'est disponible.
         """
+        return self.error_rate_tracker.error_rate()
 
-        count_200, count_error = 0, 0
-        server_error_list = [404, 403, 410, 500, 503]
-        chat_cache = dict(self.access_history.items()).get('/chat', [])
+    @classmethod
+    def models_to_preload(cls):
+        """:return: Les rerankers utilisés dès la première requête, à charger avant le fork."""
+        # Avec le backend 'embedding', le modèle principal n'est pas un reranker
+        models = [cls.primary_model_name] if cls.classifier_backend == 'reranker' else []
+        if cls.cascade_enabled or cls.hedging_enabled:
+            models.append(cls.secondary_model_name)
+        return models
 
-        for access in chat_cache:
-            if access['status_code'] == 200:
-                count_200 += 1
-            elif access['status_code'] in server_error_list:
-                count_error += 1
+    @classmethod
+    def preload_models(cls):
+        """
+        Charge les modèles de l'application (rerankers et modèle d'embedding selon le
+        backend) dans le processus courant, avant le fork des processus qui les partagent.
+        """
+        model_registry.preload(*cls.models_to_preload())
+        if cls.classifier_backend == 'embedding':
+            embedding_registry.preload(cls.embedding_model_name)
 
-        return 100*(count_error)/(count_200+count_error) if count_200+count_error > 0 else 0
+    def setup_metrics(self):
+        """
+        Déclare les métriques de l'application, exportées sur /metrics au format Prometheus.
+        Les compteurs sont mis à jour par log_status, les jauges sont lues à l'export.
+        """
+        self.http_requests = self.metrics.counter(
+            'chatbot_http_requests_total', "Requêtes traitées, par route et code de statut.", ('route', 'status'))
+        self.http_duration = self.metrics.histogram(
+            'chatbot_http_request_duration_seconds', "Durée de traitement des requêtes, par route.", ('route',))
+        self.metrics.callback(
+            'chatbot_chat_error_rate_percent', "Taux d'erreur de /chat sur la fenêtre glissante.",
+            self.count_server_error_rate_in_chat_cache)
+        self.metrics.callback(
+            'chatbot_inference_queue_depth', "Messages en attente dans la file d'inférence.",
+            lambda: self.current_llm.scheduler.stats()['queue_depth'] if self.current_llm.scheduler else None)
+        self.metrics.callback(
+            'chatbot_admission_limit', "Limite de concurrence courante devant l'inférence.",
+            lambda: self.admission.limit)
+        self.metrics.callback(
+            'chatbot_admission_in_flight', "Requêtes /chat en cours d'inférence.",
+            lambda: self.admission.stats()['in_flight'])
+        self.metrics.callback(
+            'chatbot_admission_rejected_total', "Requêtes /chat refusées (503) par le contrôle d'admission.",
+            lambda: self.admission.rejected, type='counter')
+        self.content_filter_matches = self.metrics.counter(
+            'chatbot_content_filter_matches_total', "Messages refusés par la liste de modération, par règle.",
+            ('rule',))
+        for counter in ('lookups', 'hits', 'audits', 'agreements'):
+            self.metrics.callback(
+                f'chatbot_semantic_cache_{counter}_total', f"Cache de similarité : {counter}.",
+                lambda counter=counter: getattr(self.current_llm.semantic_cache, counter, None), type='counter')
+        for counter in ('hits', 'misses', 'evictions'):
+            self.metrics.callback(
+                f'chatbot_intent_cache_{counter}_total', f"Cache des intentions : {counter}.",
+                lambda counter=counter: getattr(self.cache.cache, counter), type='counter')
 
-    def background_error_rate_counter(self, interval=3):
+    def start_background_tasks(self):
+        """
+        Démarre les tâches d'arrière-plan : les threads d'inférence sont lancés
+        dès le démarrage plutôt qu'à la première requête. Le taux d'erreur
+        n'est plus affiché en boucle, il est exporté sur /metrics.
+        """
+        for llm in (self.primary_llm, self.secondary_llm):
+            if llm.scheduler is not None:
+                llm.scheduler.start()
+        if self.health_board is not None:
+            health_thread = threading.Thread(target=self.background_publish_health, name='health-board')
+            health_thread.daemon = True
+            health_thread.start()
+
+    def warm_up(self):
+        """
+        Charge les modèles utilisés par l'application et exécute une inférence de
+        chauffe sur chacun, puis déclare l'application prête.
         """
-        Compte en arrière-plan le taux d'erreur du serveur à intervalles réguliers.
+        start = time.perf_counter()
+        messages = [self.warm_up_message]
+        try:
+            self.primary_llm.score_messages(messages)
+            if self.primary_llm.cascade_model_name is not None:
+                self.primary_llm.score_messages(messages, reranker=self.primary_llm.cascade_reranker)
+            if self.hedging_enabled:
+                self.secondary_llm.score_messages(messages)
+        except Exception as e:
+            self.warm_up_error = str(e)
+            print(f"Warm-up failed: {str(e)}")
+            return
+        self.warm_up_seconds = time.perf_counter() - start
+        self.ready.set()
 
-        :param interval: Intervalle en secondes entre chaque comptage d'erreur.
-                         Par défaut, je le fixe à 3 secondes.
+    def start_warm_up(self):
         """
+        Lance warm_up dans un thread, pour que le port soit ouvert (et /healthz
+        disponible) pendant le chargement des modèles.
+        """
+        if self._warm_up_thread is None or not self._warm_up_thread.is_alive():
+            self.warm_up_error = None
+            self._warm_up_thread = threading.Thread(target=self.warm_up, name='warm-up', daemon=True)
+            self._warm_up_thread.start()
+
+    def publish_health(self):
+        """Publie l'état de l'instance sur le HealthBoard partagé, s'il y en a un."""
+        if self.health_board is None:
+            return
+        admission = self.admission.stats()
+        self.health_board.publish(self.health_slot,
+                                  pid=os.getpid(),
+                                  heartbeat=time.time(),
+                                  ready=self.ready.is_set(),
+                                  in_flight=admission['in_flight'],
+                                  limit=admission['limit'],
+                                  error_rate=self.count_server_error_rate_in_chat_cache(),
+                                  latency_ms=admission['service_time_ms'] or 0,
+                                  admitted=admission['admitted'],
+                                  shed=admission['rejected'])
+
+    def background_publish_health(self):
+        # Sans trafic, l'état est republié périodiquement : les autres instances le savent vivant
         while True:
-            error_rate = self.count_server_error_rate_in_chat_cache()
-            print(f"||| Server 8080 error rate: {error_rate}% |||")
-            time.sleep(interval)
+            self.publish_health()
+            time.sleep(self.health_publish_interval)
 
+    def peer_states(self):
+        """
+        :return: L'état publié par chacune des autres instances, s'il est récent.
+        """
+        if self.health_board is None:
+            return []
+        now = time.time()
+        return [state for slot, state in enumerate(self.health_board.snapshot())
+                if slot != self.health_slot and state is not None
+                and now - state['heartbeat'] <= self.health_stale_after]
 
+    def peer_available(self):
+        """
+        Indique si une autre instance peut absorber le trafic refusé par celle-ci :
+        prête, sous sa limite de concurrence et sous 50 % d'erreurs.
+        Sans HealthBoard, l'autre instance est supposée disponible (le frontend
+        bascule de lui-même, comme auparavant).
+        """
+        if self.health_board is None:
+            return True
+        return any(state['ready'] and state['in_flight'] < state['limit'] and state['error_rate'] <= 50.0
+                   for state in self.peer_states())
 
-    def start_background_tasks(self):
+    def record_stage(self, stage, stage_start):
         """
-        Démarre les tâches d'arrière-plan pour surveiller le taux d'erreur du serveur.
+        Enregistre la durée d'une étape du traitement de /chat.
+
+        :param stage: Le nom de l'étape ('validation', 'cache_lookup', 'error_rate_check',
+                      'admission', 'scoring').
+        :param stage_start: L'instant (time.perf_counter) où l'étape a commencé.
+        :return: L'instant courant, début de l'étape suivante.
+        """
+        now = time.perf_counter()
+        self.stage_latency[stage].record(now - stage_start)
+        return now
+
+    def shutdown(self, timeout=None):
         """
-        error_rate_thread = threading.Thread(target=self.background_error_rate_counter)
-        error_rate_thread.daemon = True
-        error_rate_thread.start()
+        Arrêt propre : les messages déjà en file d'inférence sont traités
+        avant l'arrêt des threads d'inférence.
 
+        :param timeout: Attente maximale (en secondes) par thread.
+        """
+        for llm in (self.primary_llm, self.secondary_llm):
+            if llm.scheduler is not None:
+                llm.scheduler.stop(timeout)
 
     def setup_routes(self):
         """
@@ -145,41 +944,217 @@ class App1:
         def home():
             return render_template('index.html')
 
+        @self.app.route('/healthz')
+        def healthz():
+            # Vivacité : le processus répond, que les modèles soient chargés ou non
+            return jsonify({'status': 'ok'})
+
+        @self.app.route('/readyz')
+        def readyz():
+            # Disponibilité : modèles chargés et chauffés, l'instance peut recevoir du trafic
+            if self.ready.is_set():
+                return jsonify({'status': 'ready', 'warm_up_seconds': self.warm_up_seconds,
+                                'models': model_registry.loaded_models() + embedding_registry.loaded_models()})
+            if self.warm_up_error is not None:
+                return jsonify({'status': 'failed', 'error': self.warm_up_error}), 503
+            return jsonify({'status': 'loading'}), 503
+
         @self.app.route('/chat', methods=['POST'])
         @self.log_status
         def chat():
+            stage_start = time.perf_counter()
             if  request.json =='' or not request.json:
                 return jsonify({'error': 'No message provided'}), 400
 
             user_message = request.json['message']
-            
-            if not self.check_user_message(user_message):
+            message_is_valid = self.check_user_message(user_message)
+            stage_start = self.record_stage('validation', stage_start)
+            if not message_is_valid:
                 return jsonify({'error': 'Message check failed'}), 403
-            
-            if self.count_server_error_rate_in_chat_cache() > 50.0:
+
+            # Un message déjà classé est servi depuis le cache, sans passer par le modèle
+            llm, secondary_llm = self.current_llm, self.secondary_llm
+            cache_key = intent_cache_key(llm.cache_model_name, user_message)
+            bot_response = self.cache.get(cache_key)
+            stage_start = self.record_stage('cache_lookup', stage_start)
+            if bot_response is not None:
+                return jsonify({'response': bot_response})
+
+            # Redirection vers l'autre instance seulement si elle est en état de répondre
+            error_rate_exceeded = self.count_server_error_rate_in_chat_cache() > 50.0 and self.peer_available()
+            stage_start = self.record_stage('error_rate_check', stage_start)
+            if error_rate_exceeded:
                 return jsonify({'error': 'Server error rate limit exceeded'}), 404  #Temporary redirect
 
+            # Au-delà de la limite de concurrence, refus immédiat plutôt qu'une file sans fin,
+            # sauf si l'autre instance est saturée elle aussi : refuser ne ferait que
+            # renvoyer le client d'une instance saturée à l'autre. Le HealthBoard n'est lu
+            # qu'une fois la limite atteinte
+            admitted = self.admission.try_acquire() or self.admission.acquire(
+                timeout=None if self.peer_available() else self.inference_deadline)
+            stage_start = self.record_stage('admission', stage_start)
+            if not admitted:
+                return (jsonify({'error': 'Server overloaded'}), 503,
+                        {'Retry-After': str(self.admission.retry_after())})
+
+            # La place n'est libérée qu'à la fin de tous les appels au modèle : après une
+            # échéance, un modèle bloqué continue d'occuper la place qu'il consomme
+            admitted_at = stage_start
             try:
-                bot_response = self.current_llm.chatbot_response(user_message)
+                # Chaque modèle renvoie aussi son identité : seule une réponse du modèle
+                # de la clé de cache y est enregistrée, pas celle d'une couverture gagnante
+                answered_by, bot_response = self.inference.call(
+                    lambda message: (llm, llm.chatbot_response(message)), user_message,
+                    secondary=((lambda message: (secondary_llm, secondary_llm.chatbot_response(message)))
+                               if self.hedging_enabled else None),
+                    on_settled=lambda: self.admission.release(time.perf_counter() - admitted_at))
             except Exception as e:
                 print(f"Current LLM failed: {str(e)}")
                 return jsonify({'error': 'LLM failed'}), 500
+            finally:
+                self.record_stage('scoring', stage_start)
 
+            if answered_by is llm and llm.is_cacheable(bot_response):
+                self.cache.set(cache_key, bot_response)
             return jsonify({'response': bot_response})
 
+        @self.app.route('/chat/batch', methods=['POST'])
+        @self.log_status
+        def chat_batch():
+            # {"messages": [...]} -> une ligne JSON par message, dans l'ordre, dès qu'elle est prête
+            payload = request.get_json(silent=True)
+            messages = payload.get('messages') if isinstance(payload, dict) else None
+            if not isinstance(messages, list) or not messages:
+                return jsonify({'error': 'No messages provided'}), 400
+            if len(messages) > self.batch_max_messages:
+                return jsonify({'error': f'At most {self.batch_max_messages} messages per batch'}), 413
+            if self.count_server_error_rate_in_chat_cache() > 50.0 and self.peer_available():
+                return jsonify({'error': 'Server error rate limit exceeded'}), 404  #Temporary redirect
+
+            # Chaque paquet passe par le contrôle d'admission de /chat : un gros batch
+            # occupe une place d'inférence à la fois et attend son tour sous charge
+            def generate():
+                for index, outcome in enumerate(self.classify_messages(messages, admission=self.admission)):
+                    yield json.dumps({'index': index, **outcome}) + '\n'
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
         @self.app.route('/consulter-status-cache')
         def consulter_status_cache():
-            formatted_history = {}
-            for path, accesses in self.access_history.items():
-                formatted_history[path] = [
-                    {
-                        'status_code': access['status_code'],
-                        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(access['timestamp']))
-                    }
-                    for access in accesses
-                ]
-            return jsonify(formatted_history)
-        
+            # Filtres : ?route=/chat&status=500&since=<epoch>&until=<epoch>
+            # Pagination : ?limit=100&cursor=<next_cursor>, flux : ?format=ndjson,
+            # timestamps bruts : ?timestamps=epoch
+            args = request.args
+            route = args.get('route')
+            limit = args.get('limit', type=int)
+            cursor = args.get('cursor')
+            cursor_path, cursor_seq = None, 0
+            if cursor:
+                try:
+                    cursor_path, cursor_seq = decode_cursor(cursor)
+                except ValueError:
+                    return jsonify({'error': 'Invalid cursor'}), 400
+
+            format_timestamp = TimestampFormatter(epoch=args.get('timestamps') == 'epoch')
+            entries = self.iter_status_cache(route=route,
+                                             status_code=args.get('status', type=int),
+                                             since=args.get('since', type=float),
+                                             until=args.get('until', type=float),
+                                             cursor_path=cursor_path, cursor_seq=cursor_seq)
+
+            if args.get('format') == 'ndjson':
+                def generate():
+                    for count, (path, seq, status_code, timestamp) in enumerate(entries):
+                        if limit is not None and count >= limit:
+                            yield json.dumps({'next_cursor': encode_cursor(path, seq)}) + '\n'
+                            return
+                        yield json.dumps({
+                            'path': path,
+                            'status_code': status_code,
+                            'timestamp': format_timestamp(timestamp)
+                        }) + '\n'
+                return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+            paginated = limit is not None or cursor_path is not None
+            formatted_history = {} if paginated else {
+                path: [] for path in self.access_history.keys() if route is None or path == route
+            }
+            next_cursor = None
+            for count, (path, seq, status_code, timestamp) in enumerate(entries):
+                if limit is not None and count >= limit:
+                    next_cursor = encode_cursor(path, seq)
+                    break
+                formatted_history.setdefault(path, []).append({
+                    'status_code': status_code,
+                    'timestamp': format_timestamp(timestamp)
+                })
+            if not paginated:
+                return jsonify(formatted_history)
+            return jsonify({'history': formatted_history, 'next_cursor': next_cursor})
+
+        @self.app.route('/length-stats')
+        def length_stats():
+            return jsonify(self.current_llm.length_stats())
+
+        @self.app.route('/semantic-cache-stats')
+        def semantic_cache_stats():
+            cache = self.current_llm.semantic_cache
+            if cache is None:
+                return jsonify({'error': 'Semantic cache disabled'}), 404
+            return jsonify(cache.stats())
+
+        @self.app.route('/inference-stats')
+        def inference_stats():
+            scheduler = self.current_llm.scheduler
+            if scheduler is None:
+                return jsonify({'error': 'Batching disabled'}), 404
+            return jsonify(scheduler.stats())
+
+        @self.app.route('/metrics')
+        def metrics():
+            return Response(self.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+        @self.app.route('/resilience-stats')
+        def resilience_stats():
+            return jsonify(self.inference.stats())
+
+        @self.app.route('/content-filter-stats')
+        def content_filter_stats():
+            return jsonify(self.content_filter.stats())
+
+        @self.app.route('/reload-content-filter', methods=['POST'])
+        def reload_content_filter():
+            # Recompile la liste de modération sans attendre la vérification périodique
+            if not self.content_filter.reload():
+                # L'ancienne liste reste en service ; l'erreur est renvoyée à l'appelant
+                return jsonify({'error': 'Content filter reload failed', **self.content_filter.stats()}), 500
+            return jsonify(self.content_filter.stats())
+
+        @self.app.route('/health-board')
+        def health_board():
+            # État de toutes les instances, lu en mémoire partagée (sans appel HTTP à l'autre instance)
+            if self.health_board is None:
+                return jsonify({'error': 'No shared health board'}), 404
+            now = time.time()
+            instances = [dict(state, slot=slot, stale=now - state['heartbeat'] > self.health_stale_after)
+                         for slot, state in enumerate(self.health_board.snapshot()) if state is not None]
+            return jsonify({'slot': self.health_slot, 'instances': instances})
+
+        @self.app.route('/admission-stats')
+        def admission_stats():
+            return jsonify(self.admission.stats())
+
+        @self.app.route('/stage-stats')
+        def stage_stats():
+            return jsonify({stage: recorder.snapshot() for stage, recorder in list(self.stage_latency.items())})
+
+        @self.app.route('/cascade-stats')
+        def cascade_stats():
+            return jsonify(self.current_llm.cascade_stats())
+
+        @self.app.route('/intent-cache-stats')
+        def intent_cache_stats():
+            return jsonify(self.cache.cache.stats())
+
         @self.app.route('/add-success-entries')
         @self.log_status
         def add_success_entries():
@@ -187,10 +1162,8 @@ class App1:
             
             # Ajouter 10 entrées de succès dans le cache
             for _ in range(10):
-                self.access_history['/chat'].append({
-                    'status_code': 200,
-                    'timestamp': current_time
-                })
+                self.access_history.record('/chat', 200, current_time)
+                self.error_rate_tracker.record(200, current_time)
                 current_time += 0.01  # Ajouter un petit décalage entre chaque entrée
             
             return jsonify({
@@ -205,10 +1178,8 @@ class App1:
             
             # Ajouter 10 entrées d'erreur dans le cache
             for _ in range(10):
-                self.access_history['/chat'].append({
-                    'status_code': 403,
-                    'timestamp': current_time
-                })
+                self.access_history.record('/chat', 500, current_time)
+                self.error_rate_tracker.record(500, current_time)
                 current_time += 0.01  # Ajouter un petit décalage entre chaque entrée
             
             return jsonify({
@@ -218,16 +1189,27 @@ class App1:
 
         @self.app.route('/stop')
         def stop():
-            os.kill(os.getpid(), signal.SIGINT)
+            if self.production:
+                # Sous gunicorn, SIGTERM au master : arrêt gracieux, les workers
+                # terminent leurs requêtes en cours avant de s'arrêter
+                os.kill(os.getppid(), signal.SIGTERM)
+            else:
+                os.kill(os.getpid(), signal.SIGINT)
             return "L'application s'arrête..."
                     
         
 
     def run(self):
-        """Démarre l'application Flask et les tâches d'arrière-plan."""
+        """
+        Démarre l'application Flask et les tâches d'arrière-plan. Le port est ouvert
+        avant le chargement des modèles, qui se fait en arrière-plan (voir /readyz).
+        """
+        from werkzeug.serving import make_server
         self.setup_routes()
         self.start_background_tasks()
-        self.app.run(host='0.0.0.0', port=8080)
+        server = make_server('0.0.0.0', self.port, self.app, threaded=True)
+        self.start_warm_up()
+        server.serve_forever()
         #self.app.run(host='0.0.0.0', port=8080, debug=True)
 
 # On crée une 2e classe App, qui correspond à l'appli de backup
@@ -236,200 +1218,106 @@ class App1:
 # #          le port est 8090 (au lieu de 8080 pour l'appli 1)
 
 
-class App2:
-    def __init__(self):
-        self.app = Flask(__name__)
-        self.cache = Cache(self.app, config={'CACHE_TYPE': 'flask_caching.backends.SimpleCache'})
-        self.access_history = defaultdict(list)
-        self.primary_llm = self.ChatbotAPI(model_name='BAAI/bge-reranker-large')
-        self.secondary_llm = self.ChatbotAPI(model_name='BAAI/bge-reranker-base')
-        self.current_llm = self.primary_llm
-        CORS(self.app)
-
-    class ChatbotAPI:
-        def __init__(self, model_name, use_fp16=True):
-            self.reranker = FlagReranker(model_name, use_fp16=use_fp16)
-            self.tag_list = ['complaint', 'refund', 'query', 'inventory', 'satisfaction']
+class App2(App1):
+    # Hérite de toute la logique de l'appli 1 (routes, historique, tâches de fond)
+    port = 8090
+    health_slot = 1
 
-        @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1.5, min=4, max=10))
-        def chatbot_response(self, message):
-            scores = []
-            for e in self.tag_list:
-                score = self.reranker.compute_score([[e, message]], normalize=True)
-                scores.append([e, score])
+    class ChatbotAPI(App1.ChatbotAPI):
+        # Même scoring batché que l'appli 1, seul le format de réponse change
+        response_template = 'Intent of the message : "{tag}"'
 
-            sorted_data = sorted(scores, key=lambda x: x[1][0])
-            winner_tag = sorted_data[-1][0]
-            return f"Intent of the message : \"{winner_tag}\""
 
-    def log_status(self, f):
-        @wraps(f)
-        def wrapper(*args, **kwargs):
-            response = f(*args, **kwargs)
-            status_code = response[1] if isinstance(response, tuple) else 200
-            timestamp = time.time()
-            
-            key = request.path
-            self.access_history[key].append({
-                'status_code': status_code,
-                'timestamp': timestamp
-            })
-            
-            return response
-        return wrapper
+def run_app1(health_board=None):
+    app1 = App1(health_board=health_board)
+    app1.run()
 
-    def check_user_message(self, message):
-        message_is_correct = False
-        conditions = (
-            'racist' not in message.lower() and  # Vérifie l'absence du mot "racist" (insensible à la casse)
-            len(message.strip()) > 0 and  # Vérifie que le message n'est pas vide après suppression des espaces
-            not message.strip().isdigit()  # Vérifie que le message ne contient pas que des chiffres
-        )
-        message_is_correct = conditions
-        return message_is_correct
+def run_app2(health_board=None):
+    app2 = App2(health_board=health_board)
+    app2.run()
 
-    def count_server_error_rate_in_chat_cache(self):
-        #Permet d'obtenir les statistiques des erreurs du backend
-        # Récupère les données en cache
-        # Compte le nombre de 200 et les erreurs
-        # Retourne le taux d'erreur du backend (en pourcentage)
 
-        # count_200 = 2
-        # count_error = 2
+# Application du processus courant pour la classification hors ligne (voir classify_messages_file)
+_batch_app = None
 
-        count_200, count_error = 0, 0
-        server_error_list = [404, 403, 410, 500, 503]
-        chat_cache = dict(self.access_history.items()).get('/chat', [])
+def _init_batch_worker(app_name):
+    global _batch_app
+    _batch_app = globals()[app_name]()
 
-        for access in chat_cache:
-            if access['status_code'] == 200:
-                count_200 += 1
-            elif access['status_code'] in server_error_list:
-                count_error += 1
+def _classify_chunk(messages):
+    return list(_batch_app.classify_messages(messages))
 
-        return 100*(count_error)/(count_200+count_error) if count_200+count_error > 0 else 0
 
-    def background_error_rate_counter(self, interval=3):
-        while True:
-            error_rate = self.count_server_error_rate_in_chat_cache()
-            print(f"||| Server 8090 error rate: {error_rate}% |||")
-            time.sleep(interval)
+def classify_messages_file(input_path, output_path, app_name='App1', workers=1, chunk_size=256, resume=True):
+    """
+    Classe un fichier JSONL/CSV de messages (historique de tickets) hors ligne.
 
-    def start_background_tasks(self):
-        error_rate_thread = threading.Thread(target=self.background_error_rate_counter)
-        error_rate_thread.daemon = True
-        error_rate_thread.start()
+    :param input_path: Le fichier des messages.
+    :param output_path: Le fichier JSONL des résultats, écrit dans l'ordre et repris s'il existe.
+    :param app_name: L'application dont le modèle est utilisé ('App1' ou 'App2').
+    :param workers: Nombre de processus de classification.
+    :param chunk_size: Nombre de messages par paquet envoyé à un processus.
+    :param resume: Reprend après les résultats déjà présents dans output_path.
+    :return: Le résumé de classify_file (dont le débit en messages/s).
+    """
+    app = globals()[app_name]
+    # Poids chargés avant le fork : partagés par tous les processus
+    app.preload_models()
+    return classify_file(input_path, output_path, _classify_chunk,
+                         initializer=partial(_init_batch_worker, app_name),
+                         workers=workers, chunk_size=chunk_size, resume=resume)
 
 
-    def setup_routes(self):
-        @self.app.route('/')
-        @self.log_status
-        def home():
-            return render_template('index.html')
+def run_servers(preload=True):
+    """
+    Lance App1 et App2 dans deux processus.
 
-        @self.app.route('/chat', methods=['POST'])
-        @self.log_status
-        def chat():
-            if  request.json =='' or not request.json:
-                return jsonify({'error': 'No message provided'}), 400
-
-            user_message = request.json['message']
-            
-            if not self.check_user_message(user_message):
-                return jsonify({'error': 'Message check failed'}), 403
-            
-            if self.count_server_error_rate_in_chat_cache() > 50.0:
-                return jsonify({'error': 'Server error rate limit exceeded'}), 404  #Temporary redirect
+    :param preload: Charge les poids dans le processus parent, avant le fork : les deux
+                    applications partagent ainsi les mêmes pages mémoire (copy-on-write).
+                    Sans préchargement, chaque application ouvre son port immédiatement
+                    et charge ses modèles en arrière-plan (démarrage plus rapide).
+    """
+    if preload:
+        print(f"Mémoire avant chargement des modèles : {memory_usage_mb()}")
+        for app in (App1, App2):
+            app.preload_models()
+        print(f"Mémoire après chargement des modèles : {memory_usage_mb()}")
 
-            try:
-                bot_response = self.current_llm.chatbot_response(user_message)
-            except Exception as e:
-                print(f"Current LLM failed: {str(e)}")
-                return jsonify({'error': 'LLM failed'}), 500
-
-            return jsonify({'response': bot_response})
-
-        @self.app.route('/consulter-status-cache')
-        def consulter_status_cache():
-            formatted_history = {}
-            for path, accesses in self.access_history.items():
-                formatted_history[path] = [
-                    {
-                        'status_code': access['status_code'],
-                        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(access['timestamp']))
-                    }
-                    for access in accesses
-                ]
-            return jsonify(formatted_history)
-        
-        @self.app.route('/add-success-entries')
-        @self.log_status
-        def add_success_entries():
-            current_time = time.time()
-            
-            # Ajouter 10 entrées de succès dans le cache
-            for _ in range(10):
-                self.access_history['/chat'].append({
-                    'status_code': 200,
-                    'timestamp': current_time
-                })
-                current_time += 0.01  # Ajouter un petit décalage entre chaque entrée
-            
-            return jsonify({
-                "message": "10 entrées de succès ajoutées au cache",
-                "total_entries": len(self.access_history['/chat'])
-            }), 200
-        
-        
-        
-        @self.app.route('/add-error-entries')
-        @self.log_status
-        def add_error_entries():
-            current_time = time.time()
-            
-            # Ajouter 10 entrées d'erreur dans le cache
-            for _ in range(10):
-                self.access_history['/chat'].append({
-                    'status_code': 403,
-                    'timestamp': current_time
-                })
-                current_time += 0.01  # Ajouter un petit décalage entre chaque entrée
-            
-            return jsonify({
-                "message": "10 entrées d'erreur ajoutées au cache",
-                "total_entries": len(self.access_history['/chat'])
-            }), 403
-    
-        @self.app.route('/stop')
-        def stop():
-            os.kill(os.getpid(), signal.SIGINT)
-            return "L'application s'arrête..."
-        
-    def run(self):
-        self.setup_routes()
-        self.start_background_tasks()
-        self.app.run(host='0.0.0.0', port=8090)
-        #self.app.run(host='0.0.0.0', port=8080, debug=True)
-
-def run_app1():
-    app1 = App1()
-    app1.run()
-
-def run_app2():
-    app2 = App2()
-    app2.run()
-
-
-
-if __name__ == '__main__':
     # Création des processus pour chaque application
-    process1 = multiprocessing.Process(target=run_app1)
-    process2 = multiprocessing.Process(target=run_app2)
+    context = fork_context()
+    # État partagé des deux instances (taux d'erreur, requêtes en cours, latence)
+    health_board = HealthBoard(slots=2)
+    process1 = context.Process(target=run_app1, args=(health_board,))
+    process2 = context.Process(target=run_app2, args=(health_board,))
     
     # Démarrage des processus
     process1.start()
     process2.start()
     
     # Attente de la fin des processus
-    process1.join()
-    process2.join()
+    try:
+        process1.join()
+        process2.join()
+    finally:
+        health_board.close()
+        health_board.unlink()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Lance App1 et App2, ou classe un fichier de messages.")
+    subparsers = parser.add_subparsers(dest='command')
+    classify_parser = subparsers.add_parser('classify', help="classe un fichier JSONL/CSV de messages")
+    classify_parser.add_argument('input')
+    classify_parser.add_argument('output')
+    classify_parser.add_argument('--app', default='App1', choices=['App1', 'App2'])
+    classify_parser.add_argument('--workers', type=int, default=os.cpu_count())
+    classify_parser.add_argument('--chunk-size', type=int, default=256)
+    classify_parser.add_argument('--no-resume', dest='resume', action='store_false')
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        help="ouvre les ports sans attendre le chargement des modèles")
+    args = parser.parse_args()
+    if args.command == 'classify':
+        print(json.dumps(classify_messages_file(args.input, args.output, app_name=args.app, workers=args.workers,
+                                                chunk_size=args.chunk_size, resume=args.resume)))
+    else:
+        run_servers(preload=args.preload)
@@ -0,0 +1,252 @@
+import base64
+import json
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class RouteHistory:
+    """
+    Historique d'accès d'une route, stocké en colonnes compactes :
+    un array('d') pour les timestamps et un array('H') pour les codes de statut,
+    soit 10 octets par entrée au lieu d'un dictionnaire par requête.
+
+    Les plus anciennes entrées sont supprimées par blocs dès que la limite
+    max_entries (ou l'âge max_age) est dépassée.
+    """
+
+    def __init__(self, max_entries=100_000, max_age=None):
+        """
+        :param max_entries: Nombre maximal d'entrées conservées pour la route.
+        :param max_age: Âge maximal (en secondes) d'une entrée, None pour ne pas limiter.
+        """
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.timestamps = array('d')
+        self.status_codes = array('H')
+        self._lock = threading.Lock()
+        # Marge avant de purger : on supprime par blocs pour que la purge reste en O(1) amorti
+        self._slack = max(1, max_entries // 4)
+        self._appends_since_prune = 0
+        # Nombre total d'entrées purgées : sert à numéroter les entrées de façon stable
+        self._dropped = 0
+
+    def append(self, status_code, timestamp=None):
+        """
+        Enregistre un accès à la route.
+
+        Les recherches par dichotomie (query, purge par âge) supposent les
+        timestamps croissants : l'heure d'un accès en direct est prise sous le
+        verrou, et une entrée horodatée avant la dernière enregistrée (entrées
+        datées explicitement) est insérée à sa place, en décalant la numérotation
+        des entrées suivantes.
+        """
+        with self._lock:
+            if timestamp is None:
+                timestamp = time.time()
+            if self.timestamps and timestamp < self.timestamps[-1]:
+                index = bisect_right(self.timestamps, timestamp)
+                self.timestamps.insert(index, timestamp)
+                self.status_codes.insert(index, status_code)
+            else:
+                self.timestamps.append(timestamp)
+                self.status_codes.append(status_code)
+            self._appends_since_prune += 1
+            if (len(self.timestamps) > self.max_entries + self._slack
+                    or (self.max_age is not None and self._appends_since_prune >= self._slack)):
+                self._prune()
+
+    def _prune(self):
+        # À appeler avec le verrou
+        drop = max(0, len(self.timestamps) - self.max_entries)
+        if self.max_age is not None:
+            drop = max(drop, bisect_left(self.timestamps, time.time() - self.max_age))
+        if drop:
+            del self.timestamps[:drop]
+            del self.status_codes[:drop]
+            self._dropped += drop
+        self._appends_since_prune = 0
+
+    def _visible_range(self):
+        # Indices des entrées visibles : les max_entries plus récentes, encore assez jeunes
+        start = max(0, len(self.timestamps) - self.max_entries)
+        if self.max_age is not None:
+            start = max(start, bisect_left(self.timestamps, time.time() - self.max_age))
+        return start, len(self.timestamps)
+
+    def __len__(self):
+        with self._lock:
+            start, stop = self._visible_range()
+        return stop - start
+
+    def __iter__(self):
+        with self._lock:
+            start, stop = self._visible_range()
+            timestamps = self.timestamps[start:stop]
+            status_codes = self.status_codes[start:stop]
+        for timestamp, status_code in zip(timestamps, status_codes):
+            yield {'status_code': status_code, 'timestamp': timestamp}
+
+    def query(self, since=None, until=None, status_code=None, start_seq=0):
+        """
+        Parcourt les entrées de la route qui correspondent aux filtres.
+
+        Les timestamps étant croissants (voir append), la plage [since, until]
+        est localisée par dichotomie avant le filtrage fin.
+        Seule la plage retenue est copiée, puis les entrées sont produites
+        à la demande.
+
+        :param since: Timestamp minimal (inclus), None pour ne pas filtrer.
+        :param until: Timestamp maximal (inclus), None pour ne pas filtrer.
+        :param status_code: Code de statut recherché, None pour tous.
+        :param start_seq: Numéro de séquence de la première entrée à renvoyer.
+        :return: Un générateur de tuples (séquence, code de statut, timestamp).
+        """
+        with self._lock:
+            start, stop = self._visible_range()
+            start = max(start, start_seq - self._dropped)
+            if since is not None:
+                start = max(start, bisect_left(self.timestamps, since, start, max(start, stop)))
+            if until is not None:
+                stop = min(stop, bisect_right(self.timestamps, until, start, max(start, stop)))
+            first_seq = self._dropped + start
+            timestamps = self.timestamps[start:stop]
+            status_codes = self.status_codes[start:stop]
+        for offset, (timestamp, code) in enumerate(zip(timestamps, status_codes)):
+            if since is not None and timestamp < since:
+                continue
+            if until is not None and timestamp > until:
+                continue
+            if status_code is not None and code != status_code:
+                continue
+            yield first_seq + offset, code, timestamp
+
+    def nbytes(self):
+        """Mémoire occupée par les colonnes de la route, en octets."""
+        return sys.getsizeof(self.timestamps) + sys.getsizeof(self.status_codes)
+
+
+class AccessHistory:
+    """
+    Historique d'accès de l'application, une RouteHistory par route.
+
+    S'utilise comme l'ancien defaultdict(list) en lecture (items(), [path],
+    len(...)), les écritures passant par record().
+    """
+
+    def __init__(self, max_entries_per_route=100_000, max_age=None):
+        """
+        :param max_entries_per_route: Nombre maximal d'entrées conservées par route.
+        :param max_age: Âge maximal (en secondes) d'une entrée, None pour ne pas limiter.
+        """
+        self.max_entries_per_route = max_entries_per_route
+        self.max_age = max_age
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def _route(self, path):
+        route = self._routes.get(path)
+        if route is None:
+            with self._lock:
+                route = self._routes.setdefault(
+                    path, RouteHistory(self.max_entries_per_route, self.max_age))
+        return route
+
+    def record(self, path, status_code, timestamp=None):
+        """
+        Enregistre un accès.
+
+        :param path: La route appelée.
+        :param status_code: Le code HTTP renvoyé.
+        :param timestamp: L'heure de l'accès (time.time() par défaut).
+        """
+        self._route(path).append(status_code, timestamp)
+
+    def __getitem__(self, path):
+        return self._route(path)
+
+    def __contains__(self, path):
+        return path in self._routes
+
+    def __len__(self):
+        return len(self._routes)
+
+    def keys(self):
+        return list(self._routes.keys())
+
+    def items(self):
+        return list(self._routes.items())
+
+    def nbytes(self):
+        """Mémoire occupée par l'ensemble des colonnes, en octets."""
+        return sum(route.nbytes() for route in list(self._routes.values()))
+
+
+def query_accesses(accesses, since=None, until=None, status_code=None, start_seq=0):
+    """
+    Même contrat que RouteHistory.query, pour une RouteHistory ou une simple
+    liste de dictionnaires {'status_code', 'timestamp'}.
+    """
+    if isinstance(accesses, RouteHistory):
+        yield from accesses.query(since, until, status_code, start_seq)
+        return
+    for seq, access in enumerate(accesses):
+        if seq < start_seq:
+            continue
+        timestamp, code = access['timestamp'], access['status_code']
+        if since is not None and timestamp < since:
+            continue
+        if until is not None and timestamp > until:
+            continue
+        if status_code is not None and code != status_code:
+            continue
+        yield seq, code, timestamp
+
+
+def encode_cursor(path, seq):
+    """Construit le curseur de pagination désignant l'entrée seq de la route path."""
+    raw = json.dumps([path, seq]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    :return: Le tuple (route, séquence) encodé par encode_cursor.
+    :raises ValueError: Si le curseur est invalide.
+    """
+    try:
+        path, seq = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    if not isinstance(path, str) or not isinstance(seq, int):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return path, seq
+
+
+class TimestampFormatter:
+    """
+    Formate les timestamps à la demande, en réutilisant la dernière chaîne
+    produite tant que la seconde ne change pas (les entrées consécutives
+    tombent souvent dans la même seconde).
+    """
+
+    def __init__(self, epoch=False, fmt='%Y-%m-%d %H:%M:%S'):
+        """
+        :param epoch: Si True, les timestamps sont renvoyés tels quels (secondes epoch).
+        :param fmt: Format passé à time.strftime.
+        """
+        self.epoch = epoch
+        self.fmt = fmt
+        self._last_second = None
+        self._last_text = None
+
+    def __call__(self, timestamp):
+        if self.epoch:
+            return timestamp
+        second = int(timestamp)
+        if second != self._last_second:
+            self._last_second = second
+            self._last_text = time.strftime(self.fmt, time.localtime(timestamp))
+        return self._last_text
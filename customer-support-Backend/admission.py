@@ -0,0 +1,171 @@
+import math
+import threading
+import time
+
+
+class AdmissionController:
+    """
+    Limiteur de concurrence placé devant l'inférence de /chat.
+
+    Au plus `limit` requêtes sont dans le modèle en même temps ; les suivantes
+    attendent dans une file courte (queue_size places, queue_timeout secondes)
+    puis sont refusées. La limite s'adapte à la latence observée : tant que la
+    latence moyenne d'une fenêtre reste sous latency_tolerance fois la latence
+    de référence (la plus faible mesurée), la limite augmente d'une unité ;
+    au-delà, elle est multipliée par backoff_ratio. Avec un micro-batching, la
+    latence croît naturellement avec la concurrence : un objectif absolu
+    (latency_target) remplace alors la référence. La file ne peut donc pas
+    grossir sans fin quand le modèle sature.
+    """
+
+    def __init__(self, initial_limit=32, min_limit=1, max_limit=256, queue_size=64, queue_timeout=0.1,
+                 latency_target=None, latency_tolerance=2.0, backoff_ratio=0.9, window=20, baseline_window=1000):
+        """
+        :param initial_limit: Nombre de requêtes admises simultanément au démarrage.
+        :param min_limit: Limite plancher.
+        :param max_limit: Limite plafond.
+        :param queue_size: Nombre de requêtes qui peuvent attendre une place.
+        :param queue_timeout: Attente maximale (en secondes) dans la file avant refus.
+        :param latency_target: Latence moyenne (en secondes) au-delà de laquelle la limite
+                               baisse. Si None, latency_tolerance fois la latence de référence.
+        :param latency_tolerance: Rapport latence moyenne / latence de référence toléré.
+        :param backoff_ratio: Facteur appliqué à la limite quand la latence se dégrade.
+        :param window: Nombre de mesures entre deux ajustements de la limite.
+        :param baseline_window: Nombre de mesures après lequel la latence de référence est
+                                recalculée (elle peut ainsi remonter si le modèle change).
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.latency_target = latency_target
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.window = window
+        self.baseline_window = baseline_window
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        # Fenêtre courante : somme des latences, nombre de mesures, pic de concurrence
+        self._window_total = 0.0
+        self._window_count = 0
+        self._window_peak = 0
+        self._baseline = None
+        self._next_baseline = None
+        self._baseline_count = 0
+        self._service_time = None
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def try_acquire(self):
+        """
+        Réserve une place seulement si elle est libre tout de suite, sans attendre
+        ni compter de refus.
+
+        :return: True si la requête est admise (release doit alors être appelé).
+        """
+        with self._condition:
+            if self._in_flight < self.limit:
+                return self._admit()
+            return False
+
+    def acquire(self, timeout=None):
+        """
+        Réserve une place d'inférence, en attendant au plus queue_timeout secondes.
+
+        :param timeout: Attente maximale (en secondes) à la place de queue_timeout.
+        :return: True si la requête est admise (release doit alors être appelé),
+                 False si la file est pleine ou si l'attente a expiré.
+        """
+        with self._condition:
+            if self._in_flight < self.limit:
+                return self._admit()
+            if self._waiting >= self.queue_size:
+                self.rejected += 1
+                return False
+            self._waiting += 1
+            deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+            try:
+                while self._in_flight >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        self.timeouts += 1
+                        return False
+                    self._condition.wait(remaining)
+                return self._admit()
+            finally:
+                self._waiting -= 1
+
+    def _admit(self):
+        self._in_flight += 1
+        self._window_peak = max(self._window_peak, self._in_flight)
+        self.admitted += 1
+        return True
+
+    def release(self, latency=None):
+        """
+        Libère une place et, si renseignée, prend en compte la durée de l'inférence.
+
+        :param latency: Durée (en secondes) passée dans le modèle par la requête.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if latency is not None:
+                self._observe(latency)
+            self._condition.notify()
+
+    def _observe(self, latency):
+        self._service_time = latency if self._service_time is None else 0.8 * self._service_time + 0.2 * latency
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        self._next_baseline = latency if self._next_baseline is None else min(self._next_baseline, latency)
+        self._baseline_count += 1
+        if self._baseline_count >= self.baseline_window:
+            self._baseline, self._next_baseline, self._baseline_count = self._next_baseline, None, 0
+
+        self._window_total += latency
+        self._window_count += 1
+        if self._window_count < self.window:
+            return
+        mean_latency = self._window_total / self._window_count
+        target = self.latency_target or self.latency_tolerance * self._baseline
+        if mean_latency > target:
+            self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+        elif self._window_peak >= self.limit:
+            # On n'augmente la limite que si elle a réellement été atteinte
+            self._limit = min(self.max_limit, self._limit + 1)
+        self._window_total, self._window_count, self._window_peak = 0.0, 0, self._in_flight
+        # Des places ont pu se libérer : les requêtes en file réévaluent la limite
+        self._condition.notify_all()
+
+    def retry_after(self):
+        """
+        :return: Délai (en secondes entières, au moins 1) conseillé au client refusé :
+                 temps nécessaire pour écouler la file et les requêtes en cours.
+        """
+        with self._condition:
+            if self._service_time is None:
+                return 1
+            backlog = self._waiting + self._in_flight
+            return max(1, math.ceil(backlog * self._service_time / max(1, self.limit)))
+
+    def stats(self):
+        with self._condition:
+            return {
+                'limit': self.limit,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'queue_size': self.queue_size,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'service_time_ms': None if self._service_time is None else self._service_time * 1000,
+                'baseline_latency_ms': None if self._baseline is None else self._baseline * 1000,
+            }
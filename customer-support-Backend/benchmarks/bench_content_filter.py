@@ -0,0 +1,76 @@
+"""
+Compare le coût par message du filtrage de modération : parcours naïf de la
+liste (un test de sous-chaîne ou une regex par terme) vs automate d'Aho-Corasick.
+
+Usage : python benchmarks/bench_content_filter.py [nombre_de_termes]
+"""
+import os
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from content_filter import ContentFilter
+
+WORDS = ['my', 'order', 'is', 'late', 'where', 'refund', 'the', 'product', 'broken', 'thanks',
+         'please', 'help', 'password', 'stock', 'delivery', 'account', 'invoice', 'again']
+
+
+def make_terms(count, seed=0):
+    rng = random.Random(seed)
+    terms = set()
+    while len(terms) < count:
+        terms.add(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12))))
+    return sorted(terms)
+
+
+def make_messages(count, terms, seed=1):
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        words = rng.choices(WORDS, k=rng.randint(5, 30))
+        if i % 20 == 0:  # 5 % de messages refusés
+            words.insert(rng.randrange(len(words)), rng.choice(terms))
+        messages.append(' '.join(words).capitalize())
+    return messages
+
+
+def per_message_us(check, messages):
+    start = time.perf_counter()
+    blocked = sum(check(message) is not None for message in messages)
+    return (time.perf_counter() - start) / len(messages) * 1e6, blocked
+
+
+def main(term_count=10_000, message_count=2_000):
+    terms = make_terms(term_count)
+    messages = make_messages(message_count, terms)
+
+    def naive_substring(message):
+        # Équivalent de l'ancien `'racist' in message.lower()`, terme par terme
+        lowered = message.lower()
+        return next((term for term in terms if term in lowered), None)
+
+    patterns = [re.compile(r'\b' + re.escape(term) + r'\b', re.IGNORECASE) for term in terms]
+
+    def naive_word_regex(message):
+        return next((pattern.pattern for pattern in patterns if pattern.search(message)), None)
+
+    start = time.perf_counter()
+    substring_filter = ContentFilter(terms, whole_words=False)
+    word_filter = ContentFilter(terms, whole_words=True)
+    build_ms = (time.perf_counter() - start) / 2 * 1000
+
+    print(f"{term_count} termes, {message_count} messages, compilation de l'automate : {build_ms:.0f} ms")
+    print(f"{'méthode':<32} | {'µs / message':>12} | {'refusés':>7}")
+    for name, check in [('naïf : sous-chaînes', naive_substring),
+                        ('aho-corasick : sous-chaînes', substring_filter.find),
+                        ('naïf : regex \\b par terme', naive_word_regex),
+                        ('aho-corasick : mots entiers', word_filter.find)]:
+        us, blocked = per_message_us(check, messages)
+        print(f"{name:<32} | {us:>12.1f} | {blocked:>7}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
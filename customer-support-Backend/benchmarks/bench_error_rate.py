@@ -0,0 +1,61 @@
+"""
+Compare le coût par requête du calcul du taux d'erreur de /chat :
+ancien parcours complet de l'historique vs fenêtre glissante à buckets.
+
+Usage : python benchmarks/bench_error_rate.py [nombre_total_d_accès]
+"""
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from error_rate import SlidingWindowErrorRate
+
+
+def legacy_error_rate(access_history):
+    # Copie de l'ancienne implémentation de count_server_error_rate_in_chat_cache
+    count_200, count_error = 0, 0
+    server_error_list = [404, 403, 410, 500, 503]
+    chat_cache = dict(access_history.items()).get('/chat', [])
+    for access in chat_cache:
+        if access['status_code'] == 200:
+            count_200 += 1
+        elif access['status_code'] in server_error_list:
+            count_error += 1
+    return 100*(count_error)/(count_200+count_error) if count_200+count_error > 0 else 0
+
+
+def per_call_us(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main(total=2_000_000, checkpoints=5, requests_per_second=500):
+    tracker = SlidingWindowErrorRate(window_seconds=60, bucket_seconds=1)
+    history = defaultdict(list)
+    start_ts = time.time() - total / requests_per_second
+    step = total // checkpoints
+    logged = 0
+
+    print(f"{'accès':>10} | {'record (µs)':>11} | {'fenêtre (µs)':>12} | {'scan complet (µs)':>17}")
+    for _ in range(checkpoints):
+        t0 = time.perf_counter()
+        for i in range(logged, logged + step):
+            tracker.record(500 if i % 10 == 0 else 200, start_ts + i / requests_per_second)
+        record_us = (time.perf_counter() - t0) / step * 1e6
+        for i in range(logged, logged + step):
+            history['/chat'].append({'status_code': 500 if i % 10 == 0 else 200,
+                                     'timestamp': start_ts + i / requests_per_second})
+        logged += step
+
+        now = start_ts + logged / requests_per_second
+        window_us = per_call_us(lambda: tracker.error_rate(now), 1000)
+        legacy_us = per_call_us(lambda: legacy_error_rate(history), 3)
+        print(f"{logged:>10} | {record_us:>11.2f} | {window_us:>12.2f} | {legacy_us:>17.0f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000)
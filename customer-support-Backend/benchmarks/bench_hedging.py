@@ -0,0 +1,67 @@
+"""
+Latence de queue avec et sans couverture (hedging), avec un modèle principal
+qui injecte des lenteurs et un modèle secondaire stable.
+
+Usage : python benchmarks/bench_hedging.py [--requests 500] [--slow-rate 0.05] [--slow 0.3]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+import numpy as np
+
+import stub_models  # noqa: F401  (ajoute le dossier du backend au sys.path)
+from resilience import ResilientCaller, RetryBudget
+
+
+class FaultInjectingModel:
+    """Répond en `fast` secondes, sauf une fois sur 1/slow_rate où il met `slow` secondes."""
+
+    def __init__(self, fast, slow, slow_rate, seed):
+        self.fast, self.slow, self.slow_rate = fast, slow, slow_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def __call__(self, message):
+        with self.lock:
+            is_slow = self.rng.random() < self.slow_rate
+        time.sleep(self.slow if is_slow else self.fast)
+        return f'intent for {message}'
+
+
+def run(hedging, args):
+    caller = ResilientCaller(deadline=5.0, retry_budget=RetryBudget(ratio=0.1),
+                             hedge_percentile=args.percentile, hedge_min_samples=20)
+    primary = FaultInjectingModel(args.fast, args.slow, args.slow_rate, seed=args.seed)
+    secondary = FaultInjectingModel(args.fast, args.slow, 0.0, seed=args.seed + 1)
+    latencies = []
+    for i in range(args.requests):
+        start = time.perf_counter()
+        caller.call(primary, f'message {i}', secondary=secondary if hedging else None)
+        latencies.append(time.perf_counter() - start)
+    p50, p95, p99 = 1000 * np.percentile(latencies, [50, 95, 99])
+    stats = caller.stats()
+    return {'hedging': hedging, 'p50_ms': round(p50, 1), 'p95_ms': round(p95, 1), 'p99_ms': round(p99, 1),
+            'max_ms': round(1000 * max(latencies), 1), 'hedges': stats['hedges'],
+            'hedge_wins': stats['hedge_wins']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--fast', type=float, default=0.005)
+    parser.add_argument('--slow', type=float, default=0.3)
+    parser.add_argument('--slow-rate', type=float, default=0.05)
+    parser.add_argument('--percentile', type=float, default=90)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    results = [run(False, args), run(True, args)]
+    for result in results:
+        print(json.dumps(result))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Mesure le cache de similarité de chatbot_response sur un flux de messages
+reformulés (casse, ponctuation, fautes de frappe, mots de politesse) : taux de
+succès, taux d'accord avec le scoring complet et coût d'une recherche, selon
+le seuil de similarité.
+
+Le modèle est remplacé par l'intention d'origine du message (la « vérité »),
+ce qui permet de lancer le banc sans FlagEmbedding.
+
+Usage : python benchmarks/bench_semantic_cache.py [--messages 5000] [--capacity 2048]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from semantic_cache import HashingVectorizer, SemanticCache
+
+TEMPLATES = {
+    'refund': ['I want a refund for my order', 'how do I get my money back for order {n}',
+               'please refund the broken {item}'],
+    'complaint': ['the {item} I received is damaged', 'I am not happy with your delivery service',
+                  'nobody answered my last email about order {n}'],
+    'query': ['what are your opening hours', 'how can I change my password',
+              'can I pay my invoice by bank transfer'],
+    'inventory': ['do you have the {item} in stock', 'when will the {item} be available again',
+                  'is the {item} available in blue'],
+    'satisfaction': ['thanks a lot, the {item} works great', 'great service, thank you',
+                     'I love the {item} I bought'],
+}
+ITEMS = ['phone', 'laptop', 'charger', 'headset', 'keyboard', 'monitor']
+FILLERS = ['hello', 'hi', 'please', 'thanks', 'urgent']
+
+
+def paraphrase(text, rng):
+    words = text.split()
+    if rng.random() < 0.3:
+        words.insert(0, rng.choice(FILLERS))
+    if rng.random() < 0.3:
+        i = rng.randrange(len(words))
+        if len(words[i]) > 3:  # faute de frappe : une lettre supprimée
+            j = rng.randrange(len(words[i]))
+            words[i] = words[i][:j] + words[i][j + 1:]
+    message = ' '.join(words)
+    message = message.lower() if rng.random() < 0.5 else message.capitalize()
+    return message + rng.choice(['', '', '?', '!', ' !!', '.'])
+
+
+def make_messages(count, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        tag = rng.choice(list(TEMPLATES))
+        template = rng.choice(TEMPLATES[tag])
+        text = template.format(n=rng.randint(1000, 1200), item=rng.choice(ITEMS))
+        messages.append((paraphrase(text, rng), tag))
+    return messages
+
+
+def run(messages, capacity, threshold, vectorizer):
+    cache = SemanticCache(capacity=capacity, threshold=threshold)
+    agreed = 0
+    for message, tag in messages:
+        vector = vectorizer(message)
+        cached = cache.lookup(vector)
+        if cached is None:
+            cache.add(vector, tag)
+        else:
+            agreed += cached == tag
+    stats = cache.stats()
+    return {
+        'threshold': threshold,
+        'hit_rate': round(stats['hit_rate'], 3),
+        'agreement_rate': round(agreed / stats['hits'], 4) if stats['hits'] else None,
+        'lookup_p50_us': round(stats['lookup_latency']['p50_ms'] * 1000, 1),
+        'size': stats['size'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--capacity', type=int, default=2048)
+    args = parser.parse_args()
+    messages = make_messages(args.messages)
+    vectorizer = HashingVectorizer()
+    start = time.perf_counter()
+    for message, _ in messages:
+        vectorizer(message)
+    print(json.dumps({'vectorize_us': round((time.perf_counter() - start) / len(messages) * 1e6, 1)}))
+    for threshold in (0.8, 0.85, 0.9, 0.95):
+        print(json.dumps(run(messages, args.capacity, threshold, vectorizer)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare le débit de /chat entre le serveur de développement (App.run) et
+gunicorn (wsgi.py), avec un reranker factice au coût réglable.
+
+Usage : python benchmarks/bench_serving.py [--requests 400] [--concurrency 32] [--workers 4]
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from stub_models import install_stub_models
+
+
+def serve(mode, port, workers, call_cost, pair_cost):
+    backend = install_stub_models(call_cost, pair_cost)
+    if mode == 'dev':
+        backend.App1.port = port
+        backend.App1().run()
+    else:
+        import wsgi
+        wsgi.serve('App1', port=port, workers=workers)
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def post_chat(port, message):
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/chat',
+                                     data=json.dumps({'message': message}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return response.status
+
+
+def measure(mode, args, port):
+    server = subprocess.Popen([sys.executable, __file__, '--serve', mode, '--port', str(port),
+                               '--workers', str(args.workers), '--call-cost', str(args.call_cost),
+                               '--pair-cost', str(args.pair_cost)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        post_chat(port, 'warm up')
+        # Messages tous différents pour ne jamais tomber dans le cache d'intentions
+        messages = [f'{mode} message number {i}' for i in range(args.requests)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            statuses = list(pool.map(lambda m: post_chat(port, m), messages))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+    return {'mode': mode, 'requests': len(statuses), 'ok': statuses.count(200),
+            'seconds': round(elapsed, 3), 'rps': round(len(statuses) / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--serve', choices=['dev', 'gunicorn'])
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--call-cost', type=float, default=0.02)
+    parser.add_argument('--pair-cost', type=float, default=0.001)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.workers, args.call_cost, args.pair_cost)
+        return
+
+    for offset, mode in enumerate(['dev', 'gunicorn']):
+        print(json.dumps(measure(mode, args, args.port + offset)))
+
+
+if __name__ == '__main__':
+    main()
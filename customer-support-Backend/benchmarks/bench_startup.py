@@ -0,0 +1,103 @@
+"""
+Mesure le démarrage d'une application : durée de l'import du module, délai
+avant que le port réponde (/healthz), avant la première réponse de /chat et
+avant que /readyz déclare l'instance prête. Compare le préchargement des
+modèles avant l'ouverture du port et leur chargement en arrière-plan.
+
+Usage : python benchmarks/bench_startup.py [--load-cost 3]
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import CustomerSupportChatbotBackend
+print(time.perf_counter() - start, 'FlagEmbedding' in sys.modules)
+"""
+
+
+def serve(port, preload, load_cost):
+    from stub_models import install_stub_models
+    backend = install_stub_models(load_cost=load_cost)
+    backend.App1.port = port
+    if preload:
+        backend.App1.preload_models()
+    backend.App1().run()
+
+
+def import_seconds(repeat=5):
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, check=True).stdout.split()
+        timings.append(float(output[0]))
+    return min(timings), output[1] == 'True'
+
+
+def status(port, path, payload=None):
+    data = None if payload is None else json.dumps(payload).encode()
+    request = urllib.request.Request(f'http://127.0.0.1:{port}{path}', data=data,
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def measure(preload, port, load_cost, timeout=60):
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, __file__, '--serve', '--port', str(port),
+                               '--load-cost', str(load_cost)] + (['--preload'] if preload else []),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    timings = {}
+    try:
+        while 'first_chat' not in timings or 'ready' not in timings:
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"Server on port {port} did not become ready")
+            if 'healthz' not in timings and status(port, '/healthz') == 200:
+                timings['healthz'] = time.perf_counter() - start
+            if 'healthz' in timings and 'ready' not in timings and status(port, '/readyz') == 200:
+                timings['ready'] = time.perf_counter() - start
+            if 'healthz' in timings and 'first_chat' not in timings and \
+                    status(port, '/chat', {'message': 'where is my order'}) == 200:
+                timings['first_chat'] = time.perf_counter() - start
+            time.sleep(0.02)
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.wait(timeout=30)
+    return {'mode': 'preload' if preload else 'background', **{k: round(v, 3) for k, v in timings.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--serve', action='store_true')
+    parser.add_argument('--preload', action='store_true')
+    parser.add_argument('--port', type=int, default=18180)
+    parser.add_argument('--load-cost', type=float, default=3.0, help="durée simulée du chargement d'un modèle (s)")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.preload, args.load_cost)
+        return
+
+    seconds, imports_flag_embedding = import_seconds()
+    print(json.dumps({'import_seconds': round(seconds, 3), 'imports_FlagEmbedding': imports_flag_embedding}))
+    for offset, preload in enumerate([True, False]):
+        print(json.dumps(measure(preload, args.port + offset, args.load_cost)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Mesure l'effet du PairEncoder sur le volume de calcul du reranker, pour un
+mélange de messages courts (chat) et de longs emails collés par les clients :
+tokens traités (padding compris) avec et sans tri par longueur, avec et sans
+budget de tokens, et coût simulé par message selon sa longueur.
+
+Le tokenizer est remplacé par un découpage en mots et le modèle par un coût
+proportionnel au nombre de tokens du batch complété (padding inclus), ce qui
+permet de lancer le banc sans transformers ni torch.
+
+Usage : python benchmarks/bench_tokenization.py [--messages 2000] [--budget 256]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pair_encoding import LENGTH_BUCKETS, PairEncoder, length_bucket
+
+TAGS = ['complaint', 'refund', 'query', 'inventory', 'satisfaction']
+BUCKET_ORDER = [length_bucket(bound) for bound in LENGTH_BUCKETS] + [length_bucket(LENGTH_BUCKETS[-1] + 1)]
+WORDS = ['my', 'order', 'is', 'late', 'where', 'refund', 'the', 'product', 'broken', 'thanks',
+         'please', 'help', 'password', 'stock', 'delivery', 'account', 'invoice', 'again']
+
+
+class WordTokenizer:
+    pad_token_id = 1
+
+    def __init__(self):
+        self.vocab = {}
+        self.calls = 0
+        self.texts = 0
+
+    def __call__(self, texts, add_special_tokens=True):
+        self.calls += 1
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+        self.texts += len(texts)
+        ids = [[self.vocab.setdefault(word, len(self.vocab) + 3) for word in text.split()] for text in texts]
+        return {'input_ids': ids[0] if single else ids}
+
+    def build_inputs_with_special_tokens(self, ids_a, ids_b):
+        return [0] + ids_a + [2, 2] + ids_b + [2]
+
+
+def make_messages(count, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        # 90 % de messages de chat, 10 % d'emails de plusieurs centaines de mots
+        length = rng.randint(3, 30) if rng.random() < 0.9 else rng.randint(200, 1200)
+        messages.append(' '.join(rng.choices(WORDS, k=length)))
+    return messages
+
+
+def run(messages, budget, sort, max_pairs, batch_size=32):
+    tokenizer = WordTokenizer()
+    encoder = PairEncoder(tokenizer, TAGS, max_length=100_000 if budget is None else 512,
+                          message_token_budget=budget or 100_000)
+    real_tokens = padded_tokens = 0
+    per_message = {}
+    for start in range(0, len(messages), batch_size):
+        chunk = messages[start:start + batch_size]
+        pairs, lengths = encoder.encode(chunk)
+        if not sort:
+            # Ordre d'origine : même regroupement que compute_score sur la liste des paires
+            batches = [pairs[i:i + max_pairs] for i in range(0, len(pairs), max_pairs)]
+        else:
+            batches = [batch for batch, _, _ in encoder.batches(pairs, max_pairs)]
+        seconds = np.zeros(len(chunk))
+        for batch in batches:
+            width = max(len(ids) for _, _, ids in batch)
+            real_tokens += sum(len(ids) for _, _, ids in batch)
+            padded_tokens += width * len(batch)
+            for row, _, _ in batch:
+                seconds[row] += width  # coût simulé : un « token-unité » par position du batch complété
+        for tokens, cost in zip(lengths, seconds):
+            bucket = per_message.setdefault(length_bucket(tokens), [0, 0.0])
+            bucket[0] += 1
+            bucket[1] += cost
+    return {
+        'budget': budget,
+        'sorted_by_length': sort,
+        'padded_tokens': padded_tokens,
+        'padding_overhead': round(padded_tokens / real_tokens - 1, 3),
+        'tokenizer_texts': tokenizer.texts,
+        'cost_per_message_by_length': {bucket: round(per_message[bucket][1] / per_message[bucket][0], 1)
+                                       for bucket in BUCKET_ORDER if bucket in per_message},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--budget', type=int, default=256)
+    parser.add_argument('--max-pairs', type=int, default=64)
+    args = parser.parse_args()
+    messages = make_messages(args.messages)
+    print(json.dumps({'pairs_tokenized_by_compute_score': len(messages) * len(TAGS)}))
+    for budget, sort in [(None, False), (None, True), (args.budget, False), (args.budget, True)]:
+        print(json.dumps(run(messages, budget, sort, args.max_pairs)))
+
+
+if __name__ == '__main__':
+    main()
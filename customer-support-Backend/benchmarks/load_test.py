@@ -0,0 +1,166 @@
+"""
+Banc de charge reproductible pour /chat, hors ligne : App1/App2 sont
+servies en processus via le client de test Flask, avec un reranker factice
+au coût réglable (voir stub_models.py).
+
+Rapporte le débit, les latences p50/p95/p99 et la durée de chaque étape du
+traitement (validation, cache, taux d'erreur, scoring), en JSON.
+
+Usage :
+    python benchmarks/load_test.py --app App1 App2 --requests 2000 --concurrency 32 \\
+        --mix unique=0.8,repeat=0.2 --output results.json
+    python benchmarks/load_test.py --baseline results.json   # échoue en cas de régression
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from stub_models import install_stub_models
+
+SUBJECTS = ['my order', 'the parcel', 'my refund', 'the blue jacket', 'my account', 'the invoice',
+            'the delivery', 'the warranty', 'my subscription', 'the size chart']
+PROBLEMS = ['never arrived', 'is broken', 'was charged twice', 'is out of stock', 'was great',
+            'needs to be returned', 'is missing a part', 'cannot be found']
+REPEATED = ['where is my refund', 'the product arrived broken', 'do you have it in stock',
+            'thanks for the great service', 'how can I change my address']
+INVALID = ['you are racist', '1234567', '   ']
+
+
+def parse_mix(text):
+    """'unique=0.7,repeat=0.2,invalid=0.1' -> {'unique': 0.7, 'repeat': 0.2, 'invalid': 0.1}"""
+    mix = {}
+    for part in text.split(','):
+        kind, weight = part.split('=')
+        if kind not in ('unique', 'repeat', 'invalid'):
+            raise ValueError(f"Unknown message kind: {kind!r}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def build_messages(count, mix, seed):
+    """
+    Génère la séquence de messages, identique pour une même graine.
+
+    unique : messages jamais vus (cache manqué), repeat : petit ensemble de messages
+    fréquents (cache touché), invalid : messages rejetés par check_user_message.
+    """
+    rng = random.Random(seed)
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    messages = []
+    for i, kind in enumerate(kinds):
+        if kind == 'unique':
+            messages.append(f'{rng.choice(SUBJECTS)} {rng.choice(PROBLEMS)} (ticket {seed}-{i})')
+        elif kind == 'repeat':
+            messages.append(rng.choice(REPEATED))
+        else:
+            messages.append(rng.choice(INVALID))
+    return messages
+
+
+def percentiles_ms(samples):
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {'p50': 1000 * p50, 'p95': 1000 * p95, 'p99': 1000 * p99,
+            'mean': 1000 * float(np.mean(samples)), 'max': 1000 * float(np.max(samples))}
+
+
+def run(backend, app_name, messages, concurrency):
+    from latency import LatencyRecorder
+    instance = getattr(backend, app_name)()
+    instance.setup_routes()
+    # Fenêtre assez grande pour calculer les percentiles des étapes sur tout le run
+    instance.stage_latency = defaultdict(lambda: LatencyRecorder(window=len(messages)))
+    local = threading.local()
+    latencies = [0.0] * len(messages)
+    statuses = [0] * len(messages)
+
+    def send(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = instance.app.test_client()
+        start = time.perf_counter()
+        response = client.post('/chat', json={'message': messages[i]})
+        latencies[i] = time.perf_counter() - start
+        statuses[i] = response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, range(len(messages))))
+    elapsed = time.perf_counter() - start
+    instance.shutdown()
+
+    return {
+        'requests': len(messages),
+        'seconds': elapsed,
+        'rps': len(messages) / elapsed,
+        'status_counts': {str(code): n for code, n in sorted(Counter(statuses).items())},
+        'latency_ms': percentiles_ms(latencies),
+        'stages_ms': {stage: recorder.snapshot() for stage, recorder in instance.stage_latency.items()},
+        'batching': instance.primary_llm.scheduler.stats() if instance.primary_llm.scheduler else None,
+    }
+
+
+def compare(results, baseline, max_regression):
+    """
+    :return: La liste des régressions (débit ou p95) au-delà de max_regression.
+    """
+    regressions = []
+    for app_name, current in results['apps'].items():
+        previous = baseline['apps'].get(app_name)
+        if previous is None:
+            continue
+        if current['rps'] < previous['rps'] * (1 - max_regression):
+            regressions.append(f"{app_name}: rps {previous['rps']:.1f} -> {current['rps']:.1f}")
+        if current['latency_ms']['p95'] > previous['latency_ms']['p95'] * (1 + max_regression):
+            regressions.append(f"{app_name}: p95 {previous['latency_ms']['p95']:.1f} ms "
+                               f"-> {current['latency_ms']['p95']:.1f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc de charge reproductible pour /chat.")
+    parser.add_argument('--app', nargs='+', default=['App1'], choices=['App1', 'App2'])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('unique=0.7,repeat=0.2,invalid=0.1'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--call-cost', type=float, default=0.01, help="coût fixe d'un appel au reranker (s)")
+    parser.add_argument('--pair-cost', type=float, default=0.0005, help="coût par paire (tag, message) (s)")
+    parser.add_argument('--output', help="fichier JSON des résultats")
+    parser.add_argument('--baseline', help="résultats JSON d'une version précédente à comparer")
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    backend = install_stub_models(args.call_cost, args.pair_cost)
+    messages = build_messages(args.requests, args.mix, args.seed)
+    results = {
+        'config': {'requests': args.requests, 'concurrency': args.concurrency, 'mix': args.mix,
+                   'seed': args.seed, 'call_cost': args.call_cost, 'pair_cost': args.pair_cost},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+        'apps': {app_name: run(backend, app_name, messages, args.concurrency) for app_name in args.app},
+    }
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
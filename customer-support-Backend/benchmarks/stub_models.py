@@ -0,0 +1,43 @@
+"""
+Modèles factices pour les benchmarks hors ligne : même interface que
+FlagReranker, avec un coût par appel réglable.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubReranker:
+    """
+    Reranker déterministe dont chaque appel à compute_score coûte
+    call_cost + pair_cost * nombre de paires (en secondes).
+
+    Le coût est simulé par une attente qui relâche le GIL, comme le fait
+    l'inférence torch.
+    """
+
+    def __init__(self, model_name='stub', use_fp16=True, call_cost=0.02, pair_cost=0.001, load_cost=0.0):
+        # load_cost simule le chargement des poids (en secondes)
+        time.sleep(load_cost)
+        self.model_name = model_name
+        self.call_cost = call_cost
+        self.pair_cost = pair_cost
+
+    def compute_score(self, pairs, normalize=False):
+        time.sleep(self.call_cost + self.pair_cost * len(pairs))
+        scores = [(sum(map(ord, tag)) * 31 + sum(map(ord, message))) % 97 / 97 for tag, message in pairs]
+        return scores[0] if len(scores) == 1 else scores
+
+
+def install_stub_models(call_cost=0.02, pair_cost=0.001, load_cost=0.0):
+    """
+    Remplace le chargeur du registre de modèles par StubReranker.
+
+    :return: Le module CustomerSupportChatbotBackend.
+    """
+    import CustomerSupportChatbotBackend as backend
+    backend.model_registry.loader = lambda model_name, use_fp16: StubReranker(
+        model_name, use_fp16, call_cost=call_cost, pair_cost=pair_cost, load_cost=load_cost)
+    return backend
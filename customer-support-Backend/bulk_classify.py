@@ -0,0 +1,141 @@
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+
+from model_registry import fork_context
+
+
+def read_messages(path):
+    """
+    Lit les messages à classer dans un fichier JSONL ({"message": ..., "id": ...}
+    par ligne) ou CSV (colonne "message", colonne "id" facultative).
+
+    :param path: Le chemin du fichier ; le format est déduit de l'extension.
+    :return: Un générateur de couples (id, message), id valant None s'il est absent.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield row.get('id'), row['message']
+        else:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record.get('id'), record['message']
+
+
+def completed_records(output_path):
+    """
+    Compte les résultats déjà écrits lors d'une exécution précédente. Une
+    dernière ligne incomplète (exécution interrompue pendant l'écriture) est
+    retirée du fichier, elle sera recalculée.
+
+    :param output_path: Le fichier de résultats JSONL.
+    :return: Le nombre de lignes complètes.
+    """
+    if not os.path.exists(output_path):
+        return 0
+    count, valid_bytes = 0, 0
+    with open(output_path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                json.loads(line)
+            except ValueError:
+                break
+            count += 1
+            valid_bytes += len(line)
+    with open(output_path, 'rb+') as f:
+        f.truncate(valid_bytes)
+    return count
+
+
+def iter_chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def classify_file(input_path, output_path, classify_chunk, initializer=None, workers=1, chunk_size=256,
+                  resume=True, progress_every=10, log=None):
+    """
+    Classe tous les messages d'un fichier et écrit une ligne JSON par message,
+    dans l'ordre du fichier d'entrée. Les paquets de chunk_size messages sont
+    répartis sur `workers` processus ; chaque paquet est écrit (et vidé sur
+    disque) dès que lui et ses prédécesseurs sont terminés, si bien qu'une
+    exécution interrompue reprend au premier message non écrit.
+
+    :param input_path: Le fichier JSONL ou CSV des messages.
+    :param output_path: Le fichier JSONL des résultats.
+    :param classify_chunk: Fonction (picklable) qui reçoit une liste de messages et
+                           renvoie un dictionnaire de résultat par message.
+    :param initializer: Fonction appelée une fois dans chaque processus avant classify_chunk.
+    :param workers: Nombre de processus ; 1 pour classer dans le processus courant.
+    :param chunk_size: Nombre de messages par paquet.
+    :param resume: Reprend après les résultats déjà présents dans output_path.
+    :param progress_every: Affiche le débit tous les progress_every paquets.
+    :param log: Fonction d'affichage (sys.stderr par défaut).
+    :return: Un dictionnaire : messages classés, messages repris, durée et débit (messages/s).
+    """
+    log = log or (lambda text: print(text, file=sys.stderr))
+    skipped = completed_records(output_path) if resume else 0
+    records = enumerate(read_messages(input_path))
+    for _ in range(skipped):
+        next(records, None)
+    # Identifiants (index, id) de chaque paquet, dans l'ordre de soumission : imap
+    # renvoie les résultats dans ce même ordre
+    submitted = deque()
+
+    def jobs():
+        for chunk in iter_chunks(records, chunk_size):
+            submitted.append([(index, record_id) for index, (record_id, _) in chunk])
+            yield [message for _, (_, message) in chunk]
+
+    pool = None
+    if workers > 1:
+        pool = fork_context().Pool(workers, initializer=initializer)
+        outcomes = pool.imap(classify_chunk, jobs())
+    else:
+        if initializer is not None:
+            initializer()
+        outcomes = map(classify_chunk, jobs())
+
+    start = time.perf_counter()
+    classified = 0
+    try:
+        with open(output_path, 'a' if resume else 'w', encoding='utf-8') as out:
+            for chunk_number, results in enumerate(outcomes, 1):
+                for (index, record_id), result in zip(submitted.popleft(), results):
+                    out.write(json.dumps({'index': index, 'id': record_id, **result}) + '\n')
+                out.flush()
+                classified += len(results)
+                if progress_every and chunk_number % progress_every == 0:
+                    elapsed = time.perf_counter() - start
+                    log(f"{skipped + classified} messages ({classified / elapsed:.1f} msg/s)")
+    except BaseException:
+        # Interruption : les paquets déjà écrits seront repris à la prochaine exécution
+        if pool is not None:
+            pool.terminate()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'messages': classified,
+        'resumed_after': skipped,
+        'seconds': elapsed,
+        'messages_per_second': classified / elapsed if elapsed else 0,
+    }
+    log(f"{classified} messages classés en {elapsed:.1f} s ({summary['messages_per_second']:.1f} msg/s)")
+    return summary
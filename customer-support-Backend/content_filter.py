@@ -0,0 +1,217 @@
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+# Règle déclenchée par un message : le terme de la liste et sa position dans le texte
+# (position dans le texte replié si casefold est activé)
+FilterMatch = namedtuple('FilterMatch', ['rule', 'start', 'end'])
+
+
+def is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+class ContentFilter:
+    """
+    Filtre multi-termes compilé en automate d'Aho-Corasick : un message est
+    parcouru une seule fois, quel que soit le nombre de termes de la liste.
+
+    Par défaut, un terme correspond partout où il apparaît dans le message, comme
+    l'ancienne vérification par sous-chaîne. Avec whole_words (optionnel), un terme ne
+    correspond qu'à un mot entier ; un terme terminé par '*' correspond alors à tout
+    mot qui commence par ce terme ('racist*' bloque « racist » et « racists »).
+    """
+
+    def __init__(self, terms, casefold=True, whole_words=False):
+        """
+        :param terms: Les termes interdits (les termes vides sont ignorés).
+        :param casefold: Compare les termes et les messages sans tenir compte de la casse.
+        :param whole_words: N'accepte que des correspondances délimitées par des frontières de mot.
+        """
+        self.casefold = casefold
+        self.whole_words = whole_words
+        # Pour chaque terme : (règle telle qu'écrite, longueur du motif, préfixe autorisé)
+        self.rules = []
+        # États de l'automate : transitions, lien d'échec, règles qui se terminent sur l'état
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        for rule in dict.fromkeys(term.strip() for term in terms):
+            pattern, prefix = (rule[:-1], True) if rule.endswith('*') else (rule, False)
+            if casefold:
+                pattern = pattern.casefold()
+            if pattern:
+                self._add(pattern, len(self.rules))
+                self.rules.append((rule, len(pattern), prefix))
+        self._build_failure_links()
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _add(self, pattern, rule_id):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = next_state
+        self._output[state] += (rule_id,)
+
+    def _build_failure_links(self):
+        # Parcours en largeur : le lien d'échec d'un état est le plus long suffixe
+        # de son chemin qui soit aussi un préfixe d'un terme
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fail = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = fail if fail != next_state else 0
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def _accepts(self, text, start, end, prefix):
+        if not self.whole_words:
+            return True
+        if start > 0 and is_word_char(text[start - 1]):
+            return False
+        return prefix or end == len(text) or not is_word_char(text[end])
+
+    def find(self, message):
+        """
+        Cherche la première règle déclenchée par le message.
+
+        :param message: Le message à filtrer.
+        :return: Un FilterMatch, ou None si aucun terme ne correspond.
+        """
+        text = message.casefold() if self.casefold else message
+        goto, fail, output, rules = self._goto, self._fail, self._output, self.rules
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for rule_id in output[state]:
+                rule, length, prefix = rules[rule_id]
+                start = position + 1 - length
+                if self._accepts(text, start, position + 1, prefix):
+                    return FilterMatch(rule, start, position + 1)
+        return None
+
+
+def read_terms(path):
+    """
+    Lit une liste de termes : un terme par ligne, lignes vides et commentaires (#) ignorés.
+
+    :param path: Le chemin du fichier.
+    :return: La liste des termes.
+    """
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+class ContentFilterLoader:
+    """
+    Charge un ContentFilter depuis un fichier et le recompile lorsque le fichier
+    change, sans redémarrage. La date de modification n'est consultée qu'une fois
+    toutes les reload_interval secondes ; pendant la recompilation, les autres
+    threads continuent d'utiliser l'ancien filtre.
+    """
+
+    def __init__(self, path, reload_interval=5.0, casefold=True, whole_words=False):
+        """
+        :param path: Le fichier de termes (voir read_terms).
+        :param reload_interval: Intervalle minimal (en secondes) entre deux vérifications
+                                du fichier ; None pour désactiver le rechargement automatique.
+        :param casefold: Voir ContentFilter.
+        :param whole_words: Voir ContentFilter.
+        """
+        self.path = path
+        self.reload_interval = reload_interval
+        self.casefold = casefold
+        self.whole_words = whole_words
+        self._reload_lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self.version = 0
+        self.loaded_at = None
+        self.build_seconds = None
+        self._mtime = None
+        self.last_error = None
+        self.filter = ContentFilter(())
+        # Au démarrage, une liste illisible est une erreur de configuration : on la remonte
+        with self._reload_lock:
+            self._load()
+
+    def _load(self):
+        # À appeler avec le verrou
+        mtime = os.stat(self.path).st_mtime_ns
+        start = time.perf_counter()
+        content_filter = ContentFilter(read_terms(self.path), casefold=self.casefold,
+                                       whole_words=self.whole_words)
+        self.build_seconds = time.perf_counter() - start
+        self.filter, self._mtime = content_filter, mtime
+        self.version += 1
+        self.loaded_at = time.time()
+        self.last_error = None
+
+    def reload(self):
+        """
+        Recompile le filtre depuis le fichier. En cas d'échec (fichier absent ou
+        illisible), l'ancien filtre reste en place et l'erreur est rapportée par
+        stats() ; le fichier n'est relu qu'après une nouvelle modification.
+
+        :return: True si le filtre a été remplacé, False en cas d'échec.
+        """
+        with self._reload_lock:
+            try:
+                self._load()
+            except (OSError, ValueError) as e:
+                self.last_error = f'{type(e).__name__}: {e}'
+                try:
+                    self._mtime = os.stat(self.path).st_mtime_ns
+                except OSError:
+                    self._mtime = None
+                return False
+            return True
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self.reload_interval is None or now - self._checked_at < self.reload_interval:
+            return
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = now
+            try:
+                changed = os.stat(self.path).st_mtime_ns != self._mtime
+            except OSError:
+                # Fichier momentanément absent (remplacement en cours) : on garde l'ancien filtre
+                return
+        finally:
+            self._reload_lock.release()
+        if changed:
+            self.reload()
+
+    def find(self, message):
+        """:return: Le FilterMatch de la première règle déclenchée, ou None."""
+        self._maybe_reload()
+        return self.filter.find(message)
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'terms': len(self.filter),
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'build_ms': None if self.build_seconds is None else self.build_seconds * 1000,
+            'last_error': self.last_error,
+            'casefold': self.casefold,
+            'whole_words': self.whole_words,
+        }
@@ -0,0 +1,82 @@
+import math
+import threading
+import time
+
+
+class SlidingWindowErrorRate:
+    """
+    Compteur d'erreurs sur une fenêtre glissante, découpée en buckets de temps
+    stockés dans un buffer circulaire.
+
+    L'enregistrement d'une réponse est en O(1) et le calcul du taux d'erreur
+    sur les window_seconds dernières secondes est en O(nombre de buckets),
+    quel que soit le nombre de requêtes déjà reçues.
+    """
+
+    # Les 403 (message refusé par check_user_message) sont des erreurs du client :
+    # ils ne doivent pas faire basculer le serveur en mode dégradé. Les 404 (redirection
+    # vers l'autre instance) et les 503 (délestage par le contrôle d'admission) sont
+    # produits par l'application elle-même : les compter entretiendrait la redirection
+    # indéfiniment, la fenêtre ne se vidant jamais tant que le trafic continue
+    server_error_list = (410, 500)
+
+    def __init__(self, window_seconds=60, bucket_seconds=1):
+        """
+        :param window_seconds: Durée de la fenêtre sur laquelle le taux est calculé.
+        :param bucket_seconds: Granularité des buckets (précision de la fenêtre).
+        """
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.num_buckets = max(1, math.ceil(window_seconds / bucket_seconds))
+        self._bucket_ids = [-1] * self.num_buckets
+        self._successes = [0] * self.num_buckets
+        self._errors = [0] * self.num_buckets
+        self._lock = threading.Lock()
+
+    def record(self, status_code, timestamp=None):
+        """
+        Enregistre le code de statut d'une réponse.
+
+        :param status_code: Le code HTTP renvoyé.
+        :param timestamp: L'heure de la réponse (time.time() par défaut).
+        """
+        is_success = status_code == 200
+        if not is_success and status_code not in self.server_error_list:
+            return
+        bucket_id = int((time.time() if timestamp is None else timestamp) // self.bucket_seconds)
+        slot = bucket_id % self.num_buckets
+        with self._lock:
+            if self._bucket_ids[slot] != bucket_id:
+                if self._bucket_ids[slot] > bucket_id:
+                    return  # entrée plus ancienne que la fenêtre
+                # Le slot contenait un bucket périmé : on le recycle
+                self._bucket_ids[slot] = bucket_id
+                self._successes[slot] = 0
+                self._errors[slot] = 0
+            if is_success:
+                self._successes[slot] += 1
+            else:
+                self._errors[slot] += 1
+
+    def counts(self, now=None):
+        """
+        :return: Un tuple (succès, erreurs) sur la fenêtre courante.
+        """
+        current = int((time.time() if now is None else now) // self.bucket_seconds)
+        oldest = current - self.num_buckets + 1
+        successes, errors = 0, 0
+        with self._lock:
+            for slot, bucket_id in enumerate(self._bucket_ids):
+                if oldest <= bucket_id <= current:
+                    successes += self._successes[slot]
+                    errors += self._errors[slot]
+        return successes, errors
+
+    def error_rate(self, now=None):
+        """
+        :return: Le taux d'erreur en pourcentage sur la fenêtre courante,
+                 0 si aucune donnée n'est disponible.
+        """
+        successes, errors = self.counts(now)
+        total = successes + errors
+        return 100 * errors / total if total > 0 else 0
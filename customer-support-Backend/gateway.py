@@ -0,0 +1,273 @@
+"""
+Passerelle de bascule côté serveur, placée devant App1 et App2.
+
+Chaque requête est routée vers l'instance saine la plus rapide (latence
+moyenne exponentielle pondérée par le nombre de requêtes en cours) ou la
+moins chargée. En cas de 500/503, de redirection 404 de /chat ou d'erreur
+réseau, une requête idempotente ou de classification est rejouée sur une autre
+instance tant que l'échéance n'est pas atteinte : l'utilisateur
+n'attend plus les 15 s de bascule du frontend.
+
+Usage :
+    python gateway.py --backend http://localhost:8080 --backend http://localhost:8090 --port 8000
+"""
+import argparse
+import threading
+import time
+
+import requests
+from flask import Flask, Response, jsonify, request
+from flask_cors import CORS
+from requests.adapters import HTTPAdapter
+
+
+class Backend:
+    """État d'une instance derrière la passerelle."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.healthy = True
+        self.outstanding = 0
+        self.ewma = None
+        self.failures = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.outstanding += 1
+            self.requests += 1
+
+    def end(self, elapsed, ok, alpha, failure_threshold, failure_penalty=1.0):
+        """
+        Met à jour l'état après une réponse (ou une erreur réseau).
+
+        :param elapsed: Durée de l'appel, en secondes.
+        :param ok: True si l'appel a réussi, False s'il a échoué (erreur réseau, 500, 503),
+                   None si l'instance a seulement redirigé la requête (404 de /chat) :
+                   elle est évitée mais ce n'est pas compté comme un échec.
+        :param alpha: Poids de la dernière mesure dans la moyenne exponentielle.
+        :param failure_threshold: Échecs consécutifs avant de marquer l'instance hors service.
+        :param failure_penalty: Durée (en secondes) comptée au minimum pour un appel non servi :
+                                une instance qui échoue vite ne doit pas paraître la plus rapide.
+        """
+        if not ok:
+            elapsed = max(elapsed, failure_penalty)
+        with self._lock:
+            self.outstanding -= 1
+            self.ewma = elapsed if self.ewma is None else alpha * elapsed + (1 - alpha) * self.ewma
+            if ok is not None:
+                self._record_outcome(ok, failure_threshold)
+
+    def _record_outcome(self, ok, failure_threshold):
+        # À appeler avec le verrou
+        if ok:
+            self.failures = 0
+            self.healthy = True
+        else:
+            self.failures += 1
+            if self.failures >= failure_threshold:
+                self.healthy = False
+
+    def record_health(self, ok, failure_threshold):
+        with self._lock:
+            self._record_outcome(ok, failure_threshold)
+
+    def load(self, strategy):
+        """Coût estimé d'une requête supplémentaire : plus il est bas, plus l'instance est choisie."""
+        if strategy == 'least_outstanding':
+            return self.outstanding
+        # Une instance jamais mesurée est essayée en priorité
+        return (self.ewma or 0.0) * (self.outstanding + 1)
+
+    def snapshot(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'ewma_ms': None if self.ewma is None else 1000 * self.ewma,
+            'consecutive_failures': self.failures,
+            'requests': self.requests,
+        }
+
+
+class Gateway:
+    retry_statuses = (500, 503)
+    # Routes sur lesquelles un 404 est la redirection « taux d'erreur dépassé » de
+    # l'application : rejouée ailleurs, sans compter comme un échec de l'instance.
+    # Ailleurs, un 404 est une vraie route inconnue, renvoyée telle quelle
+    redirect_paths = ('/chat', '/chat/batch')
+    # Seules ces routes sont exposées : les routes d'administration (/stop, /reload-*,
+    # /add-*-entries...) restent accessibles uniquement sur les instances
+    public_paths = ('/', '/chat', '/chat/batch', '/consulter-status-cache')
+    # Méthodes rejouables sans risque ; les autres ne le sont que sur redirect_paths
+    idempotent_methods = ('GET', 'HEAD')
+    # En-têtes propres à une connexion, ou invalidés par le décodage du contenu en flux
+    hop_by_hop_headers = ('connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+                          'trailers', 'transfer-encoding', 'upgrade', 'content-length', 'content-encoding')
+    strategies = ('ewma', 'least_outstanding')
+
+    def __init__(self, backend_urls, strategy='ewma', deadline=5.0, health_path='/readyz',
+                 health_interval=2.0, failure_threshold=3, ewma_alpha=0.3, pool_size=32,
+                 failure_penalty=1.0):
+        """
+        :param backend_urls: Les URL des instances (App1, App2...).
+        :param strategy: 'ewma' (latence pondérée par la charge) ou 'least_outstanding'.
+        :param deadline: Temps maximal (en secondes) pour servir une requête, rejeux compris.
+        :param health_path: La route interrogée par les health checks actifs.
+        :param health_interval: Intervalle (en secondes) entre deux health checks.
+        :param failure_threshold: Échecs consécutifs avant de retirer une instance.
+        :param ewma_alpha: Poids de la dernière latence mesurée dans la moyenne.
+        :param pool_size: Connexions keep-alive conservées par instance.
+        :param failure_penalty: Latence (en secondes) comptée au minimum pour un appel non servi.
+        """
+        if strategy not in self.strategies:
+            raise ValueError(f"Unknown routing strategy: {strategy!r}")
+        self.backends = [Backend(url) for url in backend_urls]
+        self.strategy = strategy
+        self.deadline = deadline
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.failure_threshold = failure_threshold
+        self.ewma_alpha = ewma_alpha
+        self.failure_penalty = failure_penalty
+        self._pick_lock = threading.Lock()
+        # Connexions keep-alive réutilisées entre les requêtes
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.backends), pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.app = Flask(__name__)
+        CORS(self.app)
+
+    def pick(self, exclude=()):
+        """
+        Choisit l'instance qui servira la prochaine tentative.
+
+        :param exclude: Les instances déjà essayées pour cette requête.
+        :return: Une instance saine si possible, sinon une instance hors service
+                 (mieux vaut essayer que refuser), None si toutes ont été essayées.
+        """
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        healthy = [backend for backend in candidates if backend.healthy]
+        return min(healthy or candidates, key=lambda backend: backend.load(self.strategy), default=None)
+
+    def forward(self, method, path, body=None, headers=None):
+        """
+        Transmet une requête, en la rejouant sur une autre instance si besoin (requêtes
+        idempotentes et routes de classification seulement). La réponse retenue n'est
+        pas lue : son contenu est transmis au client au fil de l'eau (flux NDJSON).
+
+        :return: Un tuple (code de statut, contenu (bytes ou itérateur), en-têtes,
+                 URL de l'instance ou None).
+        """
+        deadline = time.monotonic() + self.deadline
+        retryable = method in self.idempotent_methods or path.split('?', 1)[0] in self.redirect_paths
+        tried = []
+        json_headers = {'Content-Type': 'application/json'}
+        last = (503, b'{"error": "No backend available"}', json_headers, None)
+        while True:
+            remaining = deadline - time.monotonic()
+            # Choix et réservation sous verrou, pour que deux requêtes simultanées
+            # voient chacune la charge ajoutée par l'autre
+            with self._pick_lock:
+                backend = self.pick(tried) if remaining > 0 and (retryable or not tried) else None
+                if backend is not None:
+                    backend.begin()
+            if backend is None:
+                if remaining <= 0 and last[3] is None:
+                    last = (504, b'{"error": "Gateway deadline exceeded"}', json_headers, None)
+                return last
+            tried.append(backend)
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, backend.url + path, data=body,
+                                                headers=headers, timeout=remaining, stream=True)
+            except requests.RequestException:
+                backend.end(time.perf_counter() - start, False, self.ewma_alpha, self.failure_threshold,
+                            self.failure_penalty)
+                continue
+            if response.status_code in self.retry_statuses:
+                ok = False
+            elif response.status_code == 404 and path.split('?', 1)[0] in self.redirect_paths:
+                ok = None
+            else:
+                ok = True
+            backend.end(time.perf_counter() - start, ok, self.ewma_alpha, self.failure_threshold,
+                        self.failure_penalty)
+            response_headers = {name: value for name, value in response.headers.items()
+                                if name.lower() not in self.hop_by_hop_headers}
+            if ok:
+                return response.status_code, self._stream(response), response_headers, backend.url
+            # Réponse d'erreur, courte : lue entièrement pour libérer la connexion
+            last = (response.status_code, response.content, response_headers, backend.url)
+            response.close()
+
+    @staticmethod
+    def _stream(response):
+        try:
+            yield from response.iter_content(chunk_size=None)
+        finally:
+            response.close()
+
+    def check_health(self):
+        """Interroge chaque instance sur health_path et met à jour son état."""
+        for backend in self.backends:
+            try:
+                response = self.session.get(backend.url + self.health_path, timeout=self.health_interval)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            backend.record_health(ok, self.failure_threshold)
+
+    def background_health_checks(self):
+        while True:
+            self.check_health()
+            time.sleep(self.health_interval)
+
+    def start_background_tasks(self):
+        """Démarre les health checks actifs."""
+        health_thread = threading.Thread(target=self.background_health_checks)
+        health_thread.daemon = True
+        health_thread.start()
+
+    def setup_routes(self):
+        @self.app.route('/gateway-status')
+        def gateway_status():
+            return jsonify({'strategy': self.strategy, 'backends': [b.snapshot() for b in self.backends]})
+
+        @self.app.route('/', defaults={'path': ''}, methods=['GET', 'POST'])
+        @self.app.route('/<path:path>', methods=['GET', 'POST'])
+        def proxy(path):
+            full_path = '/' + path
+            if full_path not in self.public_paths:
+                return jsonify({'error': 'Not found'}), 404
+            if request.query_string:
+                full_path += '?' + request.query_string.decode()
+            headers = {name: value for name, value in request.headers.items()
+                       if name.lower() in ('content-type', 'accept')}
+            status_code, content, response_headers, backend_url = self.forward(
+                request.method, full_path, request.get_data(), headers)
+            # Retry-After (délestage), Content-Type... sont transmis tels quels
+            response = Response(content, status=status_code, headers=response_headers)
+            if backend_url:
+                response.headers['X-Backend'] = backend_url
+            return response
+
+    def run(self, port=8000):
+        """Démarre la passerelle et les health checks."""
+        self.setup_routes()
+        self.start_background_tasks()
+        self.app.run(host='0.0.0.0', port=port, threaded=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Passerelle de bascule devant App1/App2.")
+    parser.add_argument('--backend', action='append', dest='backends')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--strategy', choices=Gateway.strategies, default='ewma')
+    parser.add_argument('--deadline', type=float, default=5.0)
+    args = parser.parse_args()
+    gateway = Gateway(args.backends or ['http://localhost:8080', 'http://localhost:8090'],
+                      strategy=args.strategy, deadline=args.deadline)
+    gateway.run(port=args.port)
@@ -0,0 +1,13 @@
+# Configuration gunicorn pour : APP=App2 gunicorn -c gunicorn.conf.py "wsgi:create_app()"
+# (APP vaut App1 par défaut ; le port est celui de la classe d'application, sauf si PORT est défini)
+import os
+
+import CustomerSupportChatbotBackend as backend
+from wsgi import default_app_name, post_fork, worker_exit  # noqa: F401  (hooks gunicorn)
+
+bind = f"0.0.0.0:{os.environ.get('PORT') or getattr(backend, default_app_name()).port}"
+workers = int(os.environ.get('WORKERS', '2'))
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', '8'))
+preload_app = True
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', '30'))
@@ -0,0 +1,92 @@
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class HealthBoard:
+    """
+    Tableau d'état partagé entre les processus des applications, en mémoire
+    partagée (multiprocessing.shared_memory), sans verrou inter-processus.
+
+    Chaque instance écrit uniquement sa propre ligne (slot) ; les autres la
+    lisent directement en mémoire. La cohérence d'une ligne est assurée par un
+    compteur de séquence (seqlock) : impair pendant une écriture, le lecteur
+    recommence sa lecture si le compteur a changé entre le début et la fin.
+    """
+
+    fields = ('pid', 'heartbeat', 'ready', 'in_flight', 'limit', 'error_rate', 'latency_ms', 'admitted', 'shed')
+    # Lectures tentées (une relecture) avant de tenir pour indisponible une ligne en cours
+    # d'écriture : écrivain mort en pleine écriture, ou publication concurrente
+    max_read_attempts = 2
+
+    def __init__(self, slots=2, name=None, create=True):
+        """
+        :param slots: Nombre d'instances (une ligne par instance).
+        :param name: Nom du segment partagé (généré si None à la création).
+        :param create: Crée le segment ; sinon s'attache au segment `name` existant.
+        """
+        width = len(self.fields) + 1
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=slots * width * 8)
+        self.name = self._shm.name
+        self.slots = slots
+        self._rows = np.ndarray((slots, width), dtype=np.float64, buffer=self._shm.buf)
+        if create:
+            self._rows[:] = 0
+        # Plusieurs threads d'un même processus peuvent publier : on les sérialise localement
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def attach(cls, name, slots=2):
+        return cls(slots=slots, name=name, create=False)
+
+    def __reduce__(self):
+        # Transmis à un processus démarré sans fork : il s'attache au même segment
+        return HealthBoard.attach, (self.name, self.slots)
+
+    def publish(self, slot, **values):
+        """
+        Remplace l'état d'une instance.
+
+        :param slot: La ligne de l'instance.
+        :param values: Valeur de chaque champ de `fields` (0 pour un champ absent).
+        """
+        row = self._rows[slot]
+        state = [float(values.get(field, 0)) for field in self.fields]
+        with self._write_lock:
+            row[0] += 1
+            row[1:] = state
+            row[0] += 1
+
+    def read(self, slot):
+        """
+        :param slot: La ligne de l'instance.
+        :return: Un dictionnaire {champ: valeur}, ou None si l'instance n'a jamais publié
+                 ou si sa ligne reste en cours d'écriture (processus mort pendant un publish).
+        """
+        row = self._rows[slot]
+        for _ in range(self.max_read_attempts):
+            seq = row[0]
+            if seq % 2 == 0:
+                values = row[1:].tolist()
+                if row[0] == seq:
+                    break
+            time.sleep(0)
+        else:
+            return None
+        if seq == 0:
+            return None
+        return dict(zip(self.fields, values))
+
+    def snapshot(self):
+        """:return: L'état de chaque instance, dans l'ordre des lignes."""
+        return [self.read(slot) for slot in range(self.slots)]
+
+    def close(self):
+        # La vue numpy doit être libérée avant la fermeture du segment
+        self._rows = None
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
@@ -0,0 +1,158 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+class InferenceScheduler:
+    """
+    Regroupe les messages de plusieurs requêtes /chat concurrentes en un seul
+    passage du reranker (micro-batching dynamique).
+
+    Chaque thread worker attend le premier message de la file, puis continue de
+    collecter jusqu'à max_batch_size messages ou jusqu'à ce que max_wait
+    secondes se soient écoulées. Chaque appelant récupère son propre résultat
+    via un Future. Le nombre de workers borne le nombre d'inférences
+    simultanées : les threads qui servent les requêtes ne font qu'attendre.
+    """
+
+    def __init__(self, api, max_batch_size=32, max_wait=0.005, num_workers=1):
+        """
+        :param api: Le ChatbotAPI qui fournit classify_batch.
+        :param max_batch_size: Nombre maximal de messages par passage du reranker.
+        :param max_wait: Attente maximale (en secondes) pour compléter un batch.
+        :param num_workers: Nombre de threads d'inférence.
+        """
+        self.api = api
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.num_workers = num_workers
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._started_pid = None
+        self._batch_sizes = Counter()
+        self._batches = 0
+        self._requests = 0
+        self._failed_batches = 0
+
+    def start(self):
+        """
+        Démarre les threads workers s'ils ne tournent pas dans ce processus
+        (les threads ne survivent pas à un fork, par exemple sous gunicorn --preload).
+        """
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._workers = []
+            for _ in range(self.num_workers):
+                worker = threading.Thread(target=self._run, daemon=True, name='inference-worker')
+                worker.start()
+                self._workers.append(worker)
+            self._started_pid = os.getpid()
+
+    def stop(self, timeout=None):
+        """Arrête les workers une fois les messages déjà en file traités."""
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._started_pid = None
+        for _ in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join(timeout)
+
+    def submit(self, message):
+        """
+        Place un message dans la file d'inférence.
+
+        :param message: Le message à classer.
+        :return: Un Future dont le résultat est l'IntentResult du message.
+        """
+        self.start()
+        future = Future()
+        self._queue.put((message, future))
+        return future
+
+    def classify(self, message, timeout=None):
+        """Variante bloquante de submit, même contrat que ChatbotAPI.classify."""
+        return self.submit(message).result(timeout)
+
+    def stats(self):
+        """
+        Statistiques du scheduler : profondeur de file et taille des batches.
+
+        :return: Un dictionnaire sérialisable en JSON.
+        """
+        with self._lock:
+            batches, requests, failed_batches = self._batches, self._requests, self._failed_batches
+            histogram = dict(sorted(self._batch_sizes.items()))
+        return {
+            'queue_depth': self._queue.qsize(),
+            'batches': batches,
+            'requests': requests,
+            'mean_batch_size': requests / batches if batches else 0,
+            'max_batch_size_seen': max(histogram, default=0),
+            'batch_size_histogram': histogram,
+            'failed_batches': failed_batches,
+            'max_batch_size': self.max_batch_size,
+            'max_wait': self.max_wait,
+            'num_workers': self.num_workers,
+        }
+
+    def _collect(self):
+        # Bloque jusqu'au premier message, puis complète le batch jusqu'à l'échéance
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # On remet la sentinelle pour sortir après ce batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            messages = [message for message, _ in batch]
+            try:
+                results = self.api.classify_batch(messages)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self._run_one_by_one(batch)
+                continue
+
+            with self._lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _run_one_by_one(self, batch):
+        # Un batch a échoué : chaque message est rejoué seul, pour que seul l'appelant
+        # du message fautif reçoive l'erreur, et non toutes les requêtes regroupées avec lui
+        with self._lock:
+            self._failed_batches += 1
+        for message, future in batch:
+            try:
+                future.set_result(self.api.classify_batch([message])[0])
+            except Exception as e:
+                future.set_exception(e)
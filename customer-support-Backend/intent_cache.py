@@ -0,0 +1,132 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask_caching.backends.base import BaseCache
+
+
+def normalize_message(message):
+    """
+    Normalise un message pour qu'il serve de clé de cache : casse repliée
+    et espaces consécutifs ramenés à un seul.
+
+    :param message: Le message brut envoyé par l'utilisateur.
+    :return: Le message normalisé.
+    """
+    return ' '.join(message.casefold().split())
+
+
+def intent_cache_key(model_name, message):
+    """
+    Construit la clé de cache d'un résultat d'intention.
+
+    :param model_name: Le nom du modèle qui a produit le résultat.
+    :param message: Le message brut envoyé par l'utilisateur.
+    :return: Une clé de taille bornée, quelle que soit la longueur du message.
+    """
+    digest = hashlib.sha1(normalize_message(message).encode('utf-8')).hexdigest()
+    return f'intent:{model_name}:{digest}'
+
+
+class LRUCache(BaseCache):
+    """
+    Backend flask_caching en mémoire avec expiration (TTL) et éviction LRU.
+
+    Contrairement au SimpleCache, qui supprime les entrées par date d'expiration
+    lorsqu'il dépasse son seuil, ce backend évince l'entrée la moins récemment
+    lue et compte les hits, misses et évictions.
+
+    S'utilise via CACHE_TYPE='intent_cache.LRUCache' ; la taille maximale est
+    lue dans CACHE_THRESHOLD et le TTL dans CACHE_DEFAULT_TIMEOUT.
+    """
+
+    def __init__(self, threshold=500, default_timeout=300):
+        super().__init__(default_timeout=default_timeout)
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(threshold=config['CACHE_THRESHOLD'])
+        return cls(*args, **kwargs)
+
+    def _expires_at(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        # Un timeout de 0 signifie que l'entrée n'expire jamais
+        return time.monotonic() + timeout if timeout > 0 else None
+
+    def _lookup(self, key):
+        # À appeler avec le verrou ; renvoie l'entrée si elle est encore valide
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, _ = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._entries[key] = (self._expires_at(timeout), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.threshold:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if self._lookup(key) is not None:
+                return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def has(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return True
+
+    def stats(self):
+        """
+        Compteurs du cache, exposés sur la route /intent-cache-stats.
+
+        :return: Un dictionnaire sérialisable en JSON.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.threshold,
+                'ttl': self.default_timeout,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0,
+            }
@@ -0,0 +1,47 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class LatencyRecorder:
+    """
+    Enregistre des durées (en secondes) : compteur et total depuis le
+    démarrage, et percentiles calculés sur les dernières mesures.
+    """
+
+    def __init__(self, window=1024):
+        """
+        :param window: Nombre de mesures récentes conservées pour les percentiles.
+        """
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, q):
+        """
+        :param q: Le percentile voulu, entre 0 et 100.
+        :return: La durée correspondante sur les mesures récentes, None si aucune mesure.
+        """
+        with self._lock:
+            samples = list(self._samples)
+        return float(np.percentile(samples, q)) if samples else None
+
+    def snapshot(self):
+        """:return: Un dictionnaire sérialisable en JSON (durées en millisecondes)."""
+        with self._lock:
+            samples = list(self._samples)
+            count, total = self.count, self.total
+        summary = {'count': count, 'mean_ms': 1000 * total / count if count else 0}
+        if samples:
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            summary.update(p50_ms=1000 * p50, p95_ms=1000 * p95, p99_ms=1000 * p99,
+                           max_ms=1000 * max(samples))
+        return summary
@@ -0,0 +1,147 @@
+import math
+import threading
+from bisect import bisect_left
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Compteur monotone, une valeur par combinaison d'étiquettes."""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        """Incrémente le compteur des étiquettes données (dans l'ordre de labelnames)."""
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            yield self.name, list(zip(self.labelnames, labelvalues)), value
+
+
+class Histogram:
+    """
+    Histogramme à buckets fixes : observe() ne fait qu'une dichotomie et deux
+    incréments, les cumuls du format Prometheus sont calculés à l'export.
+    """
+
+    type = 'histogram'
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        """Enregistre une durée (en secondes) pour les étiquettes données."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self._values.items()]
+        for labelvalues, counts, total in values:
+            labels = list(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield self.name + '_bucket', labels + [('le', _format_value(bound))], cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class Callback:
+    """
+    Métrique lue au moment de l'export, à partir d'une fonction renvoyant un
+    nombre ou un dictionnaire {tuple d'étiquettes: nombre}.
+    """
+
+    def __init__(self, name, documentation, function, type='gauge', labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.type = type
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        value = self.function()
+        if isinstance(value, dict):
+            for labelvalues, v in value.items():
+                yield self.name, list(zip(self.labelnames, labelvalues)), v
+        elif value is not None:
+            yield self.name, [], value
+
+
+class MetricsRegistry:
+    """
+    Registre de métriques exporté au format texte de Prometheus.
+
+    La création est idempotente : demander deux fois la même métrique renvoie
+    la même instance, ce qui permet à plusieurs ChatbotAPI de partager le
+    registre de leur application.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def callback(self, name, documentation, function, type='gauge', labelnames=()):
+        return self._register(Callback, name, documentation, function, type, labelnames)
+
+    def render(self):
+        """:return: Toutes les métriques au format d'exposition texte de Prometheus."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,88 @@
+import gc
+import sys
+import threading
+
+
+class ModelRegistry:
+    """
+    Registre des modèles d'un processus : chaque modèle est chargé une seule
+    fois, au premier besoin, puis partagé par tous les ChatbotAPI qui le
+    demandent.
+
+    Préchargé dans le processus parent avant un fork, il transmet aux
+    processus enfants des poids déjà en mémoire, partagés en copy-on-write.
+    """
+
+    def __init__(self, loader):
+        """
+        :param loader: Fonction (model_name, use_fp16) -> modèle, appelée au premier accès.
+        """
+        self.loader = loader
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name, use_fp16=True):
+        """
+        Renvoie le modèle demandé, en le chargeant s'il ne l'est pas encore.
+
+        :param model_name: Le nom du modèle.
+        :param use_fp16: Booléen indiquant si le modèle doit utiliser la précision flottante 16.
+        """
+        key = (model_name, use_fp16)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = self._models[key] = self.loader(model_name, use_fp16)
+        return model
+
+    def is_loaded(self, model_name, use_fp16=True):
+        return (model_name, use_fp16) in self._models
+
+    def loaded_models(self):
+        """:return: La liste des noms des modèles déjà chargés."""
+        return [model_name for model_name, _ in self._models]
+
+    def preload(self, *model_names, use_fp16=True):
+        """
+        Charge les modèles indiqués puis gèle les objets existants pour le
+        ramasse-miettes, afin qu'un fork ultérieur ne recopie pas leurs pages
+        (gc.freeze évite que le GC des enfants ne touche ces objets).
+        """
+        for model_name in dict.fromkeys(model_names):
+            self.get(model_name, use_fp16=use_fp16)
+        gc.freeze()
+
+
+def memory_usage_mb():
+    """
+    Mémoire du processus courant, en Mo.
+
+    :return: Un dictionnaire avec 'rss' (mémoire résidente) et, sous Linux,
+             'private' (pages non partagées avec d'autres processus).
+    """
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        kb = {name: int(value.split()[0]) for name, value in fields.items() if value.strip().endswith('kB')}
+        usage['rss'] = kb['Rss'] / 1024
+        usage['private'] = (kb.get('Private_Clean', 0) + kb.get('Private_Dirty', 0)) / 1024
+    except (OSError, KeyError, ValueError):
+        import resource
+        # ru_maxrss est en octets sous macOS et en kilo-octets ailleurs
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage['rss'] = maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return usage
+
+
+def fork_context():
+    """
+    Contexte multiprocessing utilisé par le lanceur : 'fork' lorsqu'il est
+    disponible, pour que les enfants héritent des modèles préchargés.
+    """
+    import multiprocessing
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
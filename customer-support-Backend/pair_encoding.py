@@ -0,0 +1,139 @@
+import weakref
+
+import numpy as np
+
+# Bornes (en tokens) des tranches de longueur utilisées pour rapporter le coût d'inférence
+LENGTH_BUCKETS = (16, 32, 64, 128, 256, 512)
+
+
+def length_bucket(tokens):
+    """:return: L'étiquette de la tranche de longueur d'un message ('<=64', '>512', ...)."""
+    for bound in LENGTH_BUCKETS:
+        if tokens <= bound:
+            return f'<={bound}'
+    return f'>{LENGTH_BUCKETS[-1]}'
+
+
+class PairEncoder:
+    """
+    Prépare les entrées du cross-encoder sans repasser par le tokenizer pour
+    chaque paire : les ids des tags sont calculés une seule fois, chaque message
+    est tokenisé une seule fois (et non une fois par tag), puis tronqué ou
+    découpé en fenêtres selon un budget de tokens.
+
+    Les paires sont triées par longueur avant d'être regroupées en batchs, pour
+    que chaque batch ne soit complété (padding) que jusqu'à la plus longue de
+    paires de longueurs voisines.
+    """
+
+    def __init__(self, tokenizer, tags, max_length=512, message_token_budget=256, window_stride=None):
+        """
+        :param tokenizer: Le tokenizer Hugging Face du reranker.
+        :param tags: Les tags (préfixes des paires), tokenisés une seule fois.
+        :param max_length: Longueur maximale d'une paire, tokens spéciaux compris.
+        :param message_token_budget: Nombre maximal de tokens du message dans une paire.
+        :param window_stride: Si renseigné, un message trop long est découpé en fenêtres
+                              décalées de window_stride tokens (le score d'un tag est le
+                              maximum sur les fenêtres) ; sinon il est tronqué.
+        """
+        self.tokenizer = tokenizer
+        self.tags = tuple(tags)
+        self.tag_ids = [tokenizer(tag, add_special_tokens=False)['input_ids'] for tag in self.tags]
+        special_tokens = len(tokenizer.build_inputs_with_special_tokens([], []))
+        longest_tag = max(map(len, self.tag_ids), default=0)
+        self.budget = max(1, min(message_token_budget, max_length - special_tokens - longest_tag))
+        # Longueur maximale d'une paire (tokens spéciaux compris) qui laisse budget tokens au message
+        self.max_pair_length = special_tokens + longest_tag + self.budget
+        self.window_stride = window_stride
+        self.pad_token_id = tokenizer.pad_token_id or 0
+
+    def windows(self, message_ids):
+        """:return: Les fenêtres (listes d'ids) du message qui tiennent dans le budget."""
+        if len(message_ids) <= self.budget or self.window_stride is None:
+            return [message_ids[:self.budget]]
+        last_start = len(message_ids) - self.budget
+        starts = list(range(0, last_start, self.window_stride)) + [last_start]
+        return [message_ids[start:start + self.budget] for start in starts]
+
+    def message_lengths(self, messages):
+        """:return: Le nombre de tokens de chaque message, sans troncature."""
+        return [len(ids) for ids in self.tokenizer(list(messages), add_special_tokens=False)['input_ids']]
+
+    def encode(self, messages):
+        """
+        Tokenise les messages (un seul appel au tokenizer) et construit les paires.
+
+        :param messages: La liste des messages.
+        :return: (paires, longueurs) : paires est une liste de (ligne, colonne, ids),
+                 longueurs le nombre de tokens de chaque message avant troncature.
+        """
+        message_ids = self.tokenizer(list(messages), add_special_tokens=False)['input_ids']
+        pairs = []
+        for row, ids in enumerate(message_ids):
+            for window in self.windows(ids):
+                for column, tag_ids in enumerate(self.tag_ids):
+                    pairs.append((row, column, self.tokenizer.build_inputs_with_special_tokens(tag_ids, window)))
+        return pairs, [len(ids) for ids in message_ids]
+
+    def batches(self, pairs, max_pairs=64):
+        """
+        Regroupe les paires par longueur voisine.
+
+        :param pairs: Les paires renvoyées par encode.
+        :param max_pairs: Nombre maximal de paires par batch.
+        :return: Un générateur de (paires du batch, input_ids, attention_mask), les deux
+                 derniers étant des tableaux numpy complétés à la plus longue paire du batch.
+        """
+        ordered = sorted(pairs, key=lambda pair: len(pair[2]))
+        for start in range(0, len(ordered), max_pairs):
+            batch = ordered[start:start + max_pairs]
+            width = len(batch[-1][2])
+            input_ids = np.full((len(batch), width), self.pad_token_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            for i, (_, _, ids) in enumerate(batch):
+                input_ids[i, :len(ids)] = ids
+                attention_mask[i, :len(ids)] = 1
+            yield batch, input_ids, attention_mask
+
+
+# Device résolu (et modèle placé) une seule fois par reranker, pas à chaque batch
+_reranker_devices = weakref.WeakKeyDictionary()
+
+
+def reranker_device(reranker):
+    """
+    Place le modèle d'un FlagReranker comme le fait compute_score : FlagEmbedding < 1.3
+    le fait à la construction (attribut device), les versions suivantes seulement au
+    premier compute_score, sur le premier de target_devices et en fp16 hors CPU.
+
+    :return: Le device (torch) sur lequel envoyer les entrées.
+    """
+    import torch
+    model = reranker.model
+    device = getattr(reranker, 'device', None)
+    if device is None:
+        device = (getattr(reranker, 'target_devices', None) or ['cpu'])[0]
+    device = torch.device(device)
+    parameter = next(model.parameters())
+    if parameter.device != device:
+        model.to(device)
+    if getattr(reranker, 'use_fp16', False) and device.type != 'cpu' and parameter.dtype != torch.float16:
+        model.half()
+    model.eval()
+    return device
+
+
+def run_reranker(reranker, input_ids, attention_mask):
+    """
+    Passe un batch déjà tokenisé dans le modèle d'un FlagReranker.
+
+    :return: Les logits (un par paire), en tableau numpy.
+    """
+    import torch
+    device = _reranker_devices.get(reranker)
+    if device is None:
+        device = _reranker_devices[reranker] = reranker_device(reranker)
+    with torch.no_grad():
+        logits = reranker.model(input_ids=torch.as_tensor(input_ids, device=device),
+                                attention_mask=torch.as_tensor(attention_mask, device=device)).logits
+    return logits.view(-1).float().cpu().numpy()
@@ -0,0 +1,218 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from latency import LatencyRecorder
+
+
+class InferenceTimeout(Exception):
+    """L'inférence n'a pas abouti avant l'échéance de la requête."""
+
+
+class RetryBudget:
+    """
+    Budget de rejeux commun au processus : chaque requête crédite `ratio`
+    jeton, chaque rejeu (ou requête de couverture) en consomme un. Les rejeux
+    restent ainsi limités à une fraction du trafic, même quand le modèle
+    échoue pour tout le monde.
+    """
+
+    def __init__(self, ratio=0.1, initial_tokens=10, max_tokens=100):
+        """
+        :param ratio: Fraction du trafic qui peut être rejouée.
+        :param initial_tokens: Jetons disponibles au démarrage (rejeux à faible trafic).
+        :param max_tokens: Nombre maximal de jetons accumulés.
+        """
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = float(initial_tokens)
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.rejected = 0
+
+    def record_request(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_acquire(self):
+        """:return: True si un rejeu est autorisé (et consomme un jeton)."""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.granted += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {'tokens': self._tokens, 'ratio': self.ratio,
+                    'granted': self.granted, 'rejected': self.rejected}
+
+
+class ResilientCaller:
+    """
+    Appelle le modèle avec une échéance par requête, des rejeux bornés par un
+    RetryBudget et, en option, une requête de couverture (hedging) : si le
+    modèle principal n'a pas répondu après le percentile `hedge_percentile`
+    de ses latences récentes, la même requête part vers le modèle secondaire
+    et la première réponse réussie est gardée.
+    """
+
+    def __init__(self, deadline=5.0, max_attempts=3, backoff=0.05, retry_budget=None,
+                 hedge_percentile=95, hedge_min_samples=20, pool_size=64, hedge_refresh=32):
+        """
+        :param deadline: Temps maximal (en secondes) accordé à une requête, rejeux compris.
+        :param max_attempts: Nombre maximal de tentatives par requête.
+        :param backoff: Attente avant le premier rejeu, doublée à chaque rejeu.
+        :param retry_budget: Le RetryBudget partagé (un budget par défaut sinon).
+        :param hedge_percentile: Percentile de latence du principal qui déclenche la couverture.
+        :param hedge_min_samples: Mesures nécessaires avant d'autoriser la couverture.
+        :param pool_size: Nombre de threads qui exécutent les appels au modèle : au moins le
+                          nombre de requêtes admises simultanément (le double avec couverture),
+                          sinon les requêtes admises consomment leur échéance en file.
+        :param hedge_refresh: Nouvelles mesures entre deux recalculs du délai de couverture.
+        """
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.retry_budget = RetryBudget() if retry_budget is None else retry_budget
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.primary_latency = LatencyRecorder()
+        self.hedge_refresh = hedge_refresh
+        self._hedge_delay = None
+        self._hedge_delay_count = 0
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='inference-call')
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+
+    def hedge_delay(self):
+        """:return: Le délai avant couverture, None tant qu'il y a trop peu de mesures."""
+        count = self.primary_latency.count
+        if count < self.hedge_min_samples:
+            return None
+        # Le percentile n'est recalculé que toutes les hedge_refresh mesures, pas à chaque requête
+        if self._hedge_delay is None or count - self._hedge_delay_count >= self.hedge_refresh:
+            self._hedge_delay = self.primary_latency.percentile(self.hedge_percentile)
+            self._hedge_delay_count = count
+        return self._hedge_delay
+
+    def call(self, primary, message, secondary=None, on_settled=None):
+        """
+        :param primary: Fonction message -> réponse du modèle principal.
+        :param message: Le message à classer.
+        :param secondary: Fonction de couverture, None pour désactiver le hedging.
+        :param on_settled: Fonction sans argument appelée une fois tous les appels au modèle
+                           de la requête terminés, y compris ceux encore en cours après une
+                           échéance ou une couverture gagnante.
+        :return: La réponse de la première tentative réussie.
+        :raises InferenceTimeout: Si l'échéance est atteinte.
+        :raises Exception: La dernière erreur du modèle si aucun rejeu n'est possible.
+        """
+        deadline = time.monotonic() + self.deadline
+        self.retry_budget.record_request()
+        futures = []
+        try:
+            return self._call(primary, secondary, message, deadline, futures)
+        finally:
+            if on_settled is not None:
+                self._when_settled(futures, on_settled)
+
+    @staticmethod
+    def _when_settled(futures, callback):
+        # Appelle callback quand le dernier des futures se termine (tout de suite s'ils le sont tous)
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def settle(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                callback()
+        if not futures:
+            callback()
+        for future in futures:
+            future.add_done_callback(settle)
+
+    def _call(self, primary, secondary, message, deadline, futures):
+        attempt = 1
+        while True:
+            try:
+                return self._attempt(primary, secondary, message, deadline, futures)
+            except InferenceTimeout:
+                with self._lock:
+                    self.timeouts += 1
+                raise
+            except Exception:
+                delay = self.backoff * 2 ** (attempt - 1)
+                if (attempt >= self.max_attempts or time.monotonic() + delay >= deadline
+                        or not self.retry_budget.try_acquire()):
+                    raise
+                with self._lock:
+                    self.retries += 1
+                attempt += 1
+                time.sleep(delay)
+
+    def _timed_primary(self, primary, message):
+        start = time.perf_counter()
+        result = primary(message)
+        self.primary_latency.record(time.perf_counter() - start)
+        return result
+
+    def _attempt(self, primary, secondary, message, deadline, futures):
+        future = self._pool.submit(self._timed_primary, primary, message)
+        futures.append(future)
+        pending = {future: 'primary'}
+        hedge_delay = self.hedge_delay() if secondary is not None else None
+        try:
+            return self._wait_first(pending, secondary, message, deadline, futures, hedge_delay)
+        finally:
+            # Échéance ou couverture gagnante : les appels encore en file ne partent pas
+            for future in pending:
+                future.cancel()
+
+    def _wait_first(self, pending, secondary, message, deadline, futures, hedge_delay):
+        last_error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise InferenceTimeout(f"No answer within {self.deadline}s")
+            hedge_pending = hedge_delay is not None and 'secondary' not in pending.values()
+            timeout = min(remaining, hedge_delay) if hedge_pending else remaining
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                source = pending.pop(future)
+                if future.exception() is None:
+                    if source == 'secondary':
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                last_error = future.exception()
+            if not done and hedge_pending:
+                # Le principal tarde : requête de couverture, si le budget le permet
+                hedge_delay = None
+                if self.retry_budget.try_acquire():
+                    with self._lock:
+                        self.hedges += 1
+                    future = self._pool.submit(secondary, message)
+                    futures.append(future)
+                    pending[future] = 'secondary'
+        raise last_error
+
+    def stats(self):
+        """:return: Les compteurs de rejeux, de couverture et d'échéances, sérialisables en JSON."""
+        with self._lock:
+            counters = {'retries': self.retries, 'hedges': self.hedges,
+                        'hedge_wins': self.hedge_wins, 'timeouts': self.timeouts}
+        return {
+            **counters,
+            'deadline': self.deadline,
+            'hedge_delay_ms': None if self.hedge_delay() is None else 1000 * self.hedge_delay(),
+            'retry_budget': self.retry_budget.stats(),
+            'primary_latency': self.primary_latency.snapshot(),
+        }
@@ -0,0 +1,168 @@
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from intent_cache import normalize_message
+from latency import LatencyRecorder
+
+
+class HashingVectorizer:
+    """
+    Vecteur bon marché d'un message, sans modèle : mots et trigrammes de
+    caractères hachés (crc32, stable d'un processus à l'autre) dans un vecteur
+    de taille fixe, normalisé. Deux reformulations proches (mots ajoutés,
+    fautes de frappe, ponctuation) ont une similarité cosinus élevée.
+    """
+
+    def __init__(self, dim=512, ngram=3):
+        """
+        :param dim: Taille du vecteur.
+        :param ngram: Taille des n-grammes de caractères.
+        """
+        self.dim = dim
+        self.ngram = ngram
+
+    def features(self, message):
+        words = ''.join(char if char.isalnum() else ' ' for char in normalize_message(message)).split()
+        for word in words:
+            yield word
+            padded = f'<{word}>'
+            for start in range(len(padded) - self.ngram + 1):
+                yield '#' + padded[start:start + self.ngram]
+
+    def __call__(self, message):
+        """:return: Le vecteur normalisé (float32) du message."""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self.features(message):
+            digest = zlib.crc32(feature.encode('utf-8'))
+            # Le bit de poids fort donne le signe : les collisions se compensent en moyenne
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """
+    Cache des intentions par similarité : les vecteurs des derniers messages
+    classés sont rangés dans une matrice de taille fixe ; un nouveau message
+    dont le vecteur est assez proche (similarité cosinus >= threshold) de l'un
+    d'eux reprend son intention sans passer par le modèle. Une fois plein, le
+    cache remplace l'entrée utilisée le moins récemment.
+    """
+
+    def __init__(self, capacity=2048, threshold=0.9):
+        """
+        :param capacity: Nombre maximal de messages indexés.
+        :param threshold: Similarité cosinus minimale pour réutiliser une intention.
+        """
+        self.capacity = capacity
+        self.threshold = threshold
+        self._vectors = None
+        self._values = [None] * capacity
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+        self._size = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+        self.lookup_latency = LatencyRecorder()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.audits = 0
+        self.agreements = 0
+
+    def lookup(self, vector):
+        """
+        :param vector: Le vecteur normalisé du message.
+        :return: La valeur associée au message indexé le plus proche, ou None si
+                 aucun n'atteint le seuil de similarité.
+        """
+        start = time.perf_counter()
+        value = None
+        with self._lock:
+            self.lookups += 1
+            best = self._nearest(vector)
+            if best is not None:
+                self._clock += 1
+                self._last_used[best] = self._clock
+                self.hits += 1
+                value = self._values[best]
+        self.lookup_latency.record(time.perf_counter() - start)
+        return value
+
+    def _nearest(self, vector):
+        # À appeler avec le verrou : l'entrée la plus proche au-dessus du seuil, ou None
+        if not self._size:
+            return None
+        similarities = self._vectors[:self._size] @ vector
+        best = int(np.argmax(similarities))
+        return best if similarities[best] >= self.threshold else None
+
+    def add(self, vector, value):
+        """
+        Indexe un message classé, en évinçant l'entrée la moins récemment utilisée si besoin.
+
+        :param vector: Le vecteur normalisé du message.
+        :param value: La valeur à réutiliser pour les messages proches (l'intention).
+        """
+        with self._lock:
+            self._store(None, vector, value)
+
+    def correct(self, vector, value):
+        """
+        Remplace l'entrée qu'aurait renvoyée lookup(vector) par ce message et sa valeur
+        corrigée (après un audit en désaccord), ou l'indexe si elle a disparu entre-temps.
+
+        :param vector: Le vecteur normalisé du message audité.
+        :param value: La valeur donnée par le scoring complet.
+        """
+        with self._lock:
+            self._store(self._nearest(vector), vector, value)
+
+    def _store(self, slot, vector, value):
+        # À appeler avec le verrou ; slot None : nouvelle entrée
+        if slot is None:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, len(vector)), dtype=np.float32)
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+        self._clock += 1
+        self._vectors[slot] = vector
+        self._values[slot] = value
+        self._last_used[slot] = self._clock
+
+    def record_audit(self, agreed):
+        """
+        Enregistre la comparaison d'un succès du cache avec le scoring complet.
+
+        :param agreed: True si le modèle aurait donné la même intention.
+        """
+        with self._lock:
+            self.audits += 1
+            self.agreements += bool(agreed)
+
+    def __len__(self):
+        return self._size
+
+    def stats(self):
+        with self._lock:
+            lookups, hits, audits, agreements = self.lookups, self.hits, self.audits, self.agreements
+            size, evictions = self._size, self.evictions
+        return {
+            'size': size,
+            'capacity': self.capacity,
+            'threshold': self.threshold,
+            'lookups': lookups,
+            'hits': hits,
+            'hit_rate': hits / lookups if lookups else 0,
+            'evictions': evictions,
+            'audits': audits,
+            'agreement_rate': agreements / audits if audits else None,
+            'corrections': audits - agreements,
+            'lookup_latency': self.lookup_latency.snapshot(),
+        }
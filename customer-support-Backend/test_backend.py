@@ -1,9 +1,23 @@
+import os
 import pytest
 from flask import json
+import threading
 import time
 import signal
+import numpy as np
 from CustomerSupportChatbotBackend import App1 
 
+@pytest.fixture(autouse=True)
+def fresh_model_registry(monkeypatch):
+    # Chaque test part d'un registre vide pour ne pas réutiliser les stubs d'un autre test
+    import CustomerSupportChatbotBackend
+    registry = CustomerSupportChatbotBackend.ModelRegistry(loader=CustomerSupportChatbotBackend.model_registry.loader)
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'model_registry', registry)
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'embedding_registry',
+                        CustomerSupportChatbotBackend.ModelRegistry(
+                            loader=CustomerSupportChatbotBackend.embedding_registry.loader))
+    return registry
+
 @pytest.fixture
 def app():
     app = App1()
@@ -106,3 +120,1196 @@ def test_stop_route(client, monkeypatch):
     # Vérifier le code de statut et le contenu
     assert response.status_code == 200
     assert response.data == b"L'application s'arr\xc3\xaate..."  # "L'application s'arrête..." en bytes
+
+
+class StubReranker:
+    """Reranker déterministe : le score dépend uniquement du couple (tag, message)."""
+    def __init__(self, *args, **kwargs):
+        self.calls = []
+
+    def _score(self, tag, message):
+        return (sum(map(ord, tag)) * 31 + sum(map(ord, message))) % 97 / 97
+
+    def compute_score(self, pairs, normalize=False):
+        self.calls.append(len(pairs))
+        scores = [self._score(tag, message) for tag, message in pairs]
+        return scores[0] if len(scores) == 1 else scores
+
+
+@pytest.fixture
+def stub_api(monkeypatch):
+    import CustomerSupportChatbotBackend
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', StubReranker)
+    return App1.ChatbotAPI(model_name='stub')
+
+
+def legacy_winner(api, message):
+    # Reproduit l'ancienne boucle : un appel par tag puis tri
+    scores = [[tag, [api.reranker._score(tag, message)]] for tag in api.tag_list]
+    return sorted(scores, key=lambda x: x[1][0])[-1][0]
+
+
+def test_batched_scoring_matches_legacy_winner(stub_api):
+    messages = ['where is my refund', 'the product is broken', 'do you have it in stock',
+                'great service, thanks', 'how do I reset my password']
+    for message in messages:
+        stub_api.reranker.calls.clear()
+        result = stub_api.classify(message)
+        assert result.tag == legacy_winner(stub_api, message)
+        assert set(result.scores) == set(stub_api.tag_list)
+        assert stub_api.reranker.calls == [len(stub_api.tag_list)]  # un seul passage batché
+
+
+def test_batched_scoring_keeps_last_tag_on_tie(stub_api):
+    stub_api.reranker._score = lambda tag, message: 0.5
+    assert stub_api.classify('Hello').tag == stub_api.tag_list[-1]
+    assert stub_api.chatbot_response('Hello') == f'intent: "{stub_api.tag_list[-1]}"'
+
+
+def test_scheduler_isolates_the_message_that_fails_a_batch():
+    from inference_scheduler import InferenceScheduler
+
+    class FragileApi:
+        def __init__(self):
+            self.batches = []
+
+        def classify_batch(self, messages):
+            self.batches.append(list(messages))
+            if 'malformed' in messages:
+                raise ValueError('malformed message')
+            return [message.upper() for message in messages]
+
+    api = FragileApi()
+    scheduler = InferenceScheduler(api, max_batch_size=8, max_wait=0.2)
+    futures = [scheduler.submit(message) for message in ('hello', 'malformed', 'refund')]
+    assert futures[0].result(5) == 'HELLO' and futures[2].result(5) == 'REFUND'
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    scheduler.stop()
+    assert api.batches == [['hello', 'malformed', 'refund'], ['hello'], ['malformed'], ['refund']]
+    assert scheduler.stats()['failed_batches'] == 1
+
+
+def test_scheduler_forms_batches_across_concurrent_requests(monkeypatch):
+    import threading
+    import CustomerSupportChatbotBackend
+
+    class SlowStubReranker(StubReranker):
+        def compute_score(self, pairs, normalize=False):
+            time.sleep(0.02)  # laisse la file se remplir pendant l'inférence
+            return super().compute_score(pairs, normalize)
+
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', SlowStubReranker)
+    api = App1.ChatbotAPI(model_name='stub', max_batch_size=8, max_batch_wait=0.01)
+    messages = [f'message numero {i}' for i in range(24)]
+    results = {}
+
+    def worker(message):
+        results[message] = api.classify(message)
+
+    threads = [threading.Thread(target=worker, args=(m,)) for m in messages]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    api.scheduler.stop()
+
+    for message in messages:
+        assert results[message][0] == legacy_winner(api, message)
+    stats = api.scheduler.stats()
+    assert stats['requests'] == len(messages)
+    assert stats['batches'] < len(messages)
+    assert 1 < stats['max_batch_size_seen'] <= 8
+    assert max(api.reranker.calls) <= 8 * len(api.tag_list)
+
+
+def test_inference_stats_route(client):
+    response = client.get('/inference-stats')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['queue_depth'] == 0
+    assert data['max_batch_size'] == App1.max_batch_size
+
+
+def test_chat_route_serves_normalized_repeat_from_cache(client, monkeypatch):
+    monkeypatch.setattr(App1, 'check_user_message', lambda self, msg: True)
+    calls = []
+
+    def mock_chatbot_response(self, msg):
+        calls.append(msg)
+        return "Bot response"
+    monkeypatch.setattr(App1.ChatbotAPI, 'chatbot_response', mock_chatbot_response)
+
+    for message in ['Where is my refund', '  where IS my   refund ']:
+        response = client.post('/chat', json={'message': message})
+        assert json.loads(response.data) == {'response': 'Bot response'}
+    assert calls == ['Where is my refund']  # le second message est un hit
+
+    stats = json.loads(client.get('/intent-cache-stats').data)
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['size'] == 1
+
+
+def test_intent_cache_skips_hedged_and_escalated_responses(monkeypatch):
+    monkeypatch.setattr(App1, 'check_user_message', lambda self, msg: True)
+    monkeypatch.setattr(App1, 'cascade_enabled', True)
+    monkeypatch.setattr(App1, 'hedging_enabled', True)
+    calls = []
+
+    def mock_chatbot_response(self, msg):
+        calls.append((self.model_name, msg))
+        if self.cascade_model_name is None:
+            return 'intent: "refund"'  # couverture par le modèle secondaire
+        if msg == 'slow':
+            time.sleep(0.3)
+        tier = self.model_name if msg == 'doubt' else self.cascade_model_name
+        return f'intent: "refund" (tier: "{tier}")'
+    monkeypatch.setattr(App1.ChatbotAPI, 'chatbot_response', mock_chatbot_response)
+    app = App1()
+    app.setup_routes()
+    app.inference.hedge_delay = lambda: 0.05
+    client = app.app.test_client()
+
+    for message in ['clear', 'doubt', 'slow'] * 2:
+        assert client.post('/chat', json={'message': message}).status_code == 200
+    # Seule la réponse du modèle léger sans escalade est servie depuis le cache
+    assert sum(msg == 'clear' for _, msg in calls) == 1
+    assert sum(msg == 'doubt' for _, msg in calls) == 2
+    assert sum(model == app.primary_model_name and msg == 'slow' for model, msg in calls) == 2
+    assert app.inference.hedge_wins == 2
+
+
+def test_intent_cache_lru_eviction_and_ttl(monkeypatch):
+    from intent_cache import LRUCache
+    cache = LRUCache(threshold=2, default_timeout=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # 'a' devient la plus récente
+    cache.set('c', 3)
+    assert cache.get('b') is None  # 'b' était la moins récemment lue
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+    now = time.monotonic()
+    monkeypatch.setattr('intent_cache.time.monotonic', lambda: now + 11)
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_error_rate_only_counts_recent_window():
+    from error_rate import SlidingWindowErrorRate
+    tracker = SlidingWindowErrorRate(window_seconds=10, bucket_seconds=1)
+    now = 1_000_000.0
+    for i in range(100):
+        tracker.record(500, now - 60 + i * 0.1)  # erreurs anciennes, hors fenêtre
+    for i in range(3):
+        tracker.record(200, now - i)
+    tracker.record(500, now)
+    tracker.record(403, now)  # erreur du client : ignorée
+    tracker.record(302, now)  # ni succès ni erreur serveur : ignoré
+    assert tracker.counts(now) == (3, 1)
+    assert tracker.error_rate(now) == 25.0
+    assert tracker.error_rate(now + 11) == 0
+
+
+def test_error_entries_routes_feed_error_rate(client, app):
+    client.get('/add-success-entries')
+    client.get('/add-error-entries')
+    client.get('/add-error-entries')
+    assert round(app.count_server_error_rate_in_chat_cache(), 2) == 66.67
+
+
+def test_access_history_retention_by_count_and_age(monkeypatch):
+    from access_history import AccessHistory
+    history = AccessHistory(max_entries_per_route=100)
+    for i in range(1000):
+        history.record('/chat', 200 if i % 2 else 500, 1000.0 + i)
+    entries = list(history['/chat'])
+    assert len(history['/chat']) == len(entries) == 100
+    assert entries[0] == {'status_code': 500, 'timestamp': 1900.0}
+    assert len(history['/chat'].timestamps) <= 125  # purge par blocs, mémoire bornée
+
+    aged = AccessHistory(max_entries_per_route=100, max_age=10)
+    monkeypatch.setattr('access_history.time.time', lambda: 1000.0)
+    for i in range(20):
+        aged.record('/', 200, 980.0 + i)
+    assert [e['timestamp'] for e in aged['/']] == [990.0 + i for i in range(10)]
+
+
+def test_access_history_keeps_timestamps_sorted_for_range_queries():
+    from access_history import AccessHistory
+    history = AccessHistory()
+    # Une entrée datée avant la dernière est insérée à sa place, avec son code de statut
+    for timestamp, status_code in ((100.0, 200), (100.09, 200), (100.05, 404), (101.0, 200), (99.0, 500)):
+        history.record('/chat', status_code, timestamp)
+    route = history['/chat']
+    assert list(route.timestamps) == [99.0, 100.0, 100.05, 100.09, 101.0]
+    assert list(route.status_codes) == [500, 200, 404, 200, 200]
+    assert [(seq, code) for seq, code, _ in route.query(since=100.05, until=100.5)] == [(2, 404), (3, 200)]
+
+
+def test_access_history_memory_per_million_entries():
+    from access_history import AccessHistory
+    history = AccessHistory(max_entries_per_route=1_000_000)
+    now = time.time()
+    for i in range(1_000_000):
+        history.record('/chat', 200, now + i)
+    # ~10 octets par entrée (+ marge de croissance des arrays) contre plusieurs centaines
+    # d'octets pour un dict {'status_code', 'timestamp'} par requête
+    bytes_per_million = history.nbytes()
+    assert bytes_per_million < 12_000_000
+
+
+def test_add_entries_routes_use_history_store(client, app):
+    response = client.get('/add-success-entries')
+    assert json.loads(response.data)['total_entries'] == 10
+    response = client.get('/add-error-entries')
+    assert response.status_code == 403
+    assert json.loads(response.data)['total_entries'] == 20
+    data = json.loads(client.get('/consulter-status-cache').data)
+    # Les entrées sont datées dans le futur : les erreurs s'intercalent dans l'ordre chronologique
+    assert sorted(e['status_code'] for e in data['/chat']) == [200] * 10 + [500] * 10
+    timestamps = [e['timestamp'] for e in data['/chat']]
+    assert timestamps == sorted(timestamps)
+    assert len(data['/add-success-entries']) == 1
+
+
+@pytest.fixture
+def filled_history(app):
+    from access_history import AccessHistory
+    app.access_history = AccessHistory()
+    for i in range(25):
+        app.access_history.record('/chat', 500 if i % 5 == 0 else 200, 1000.0 + i)
+    app.access_history.record('/', 200, 1010.0)
+    return app.access_history
+
+
+def test_consulter_status_cache_filters(client, filled_history):
+    response = client.get('/consulter-status-cache?route=/chat&status=500&since=1005&until=1020&timestamps=epoch')
+    data = json.loads(response.data)
+    assert list(data) == ['/chat']
+    assert [e['timestamp'] for e in data['/chat']] == [1005.0, 1010.0, 1015.0, 1020.0]
+    assert all(e['status_code'] == 500 for e in data['/chat'])
+
+
+def test_consulter_status_cache_cursor_pagination(client, filled_history):
+    seen, cursor = [], None
+    while True:
+        url = '/consulter-status-cache?limit=10&timestamps=epoch'
+        if cursor:
+            url += f'&cursor={cursor}'
+        page = json.loads(client.get(url).data)
+        for path, entries in page['history'].items():
+            seen.extend((path, e['timestamp']) for e in entries)
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    # jsonify trie les clés : on compare sans tenir compte de l'ordre des routes
+    assert sorted(seen) == sorted([('/chat', 1000.0 + i) for i in range(25)] + [('/', 1010.0)])
+    assert len(seen) == 26
+    assert client.get('/consulter-status-cache?cursor=garbage').status_code == 400
+
+
+def test_consulter_status_cache_ndjson_stream(client, filled_history):
+    response = client.get('/consulter-status-cache?format=ndjson&route=/chat&limit=3')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [line['status_code'] for line in lines[:3]] == [500, 200, 200]
+    assert time.strptime(lines[0]['timestamp'], '%Y-%m-%d %H:%M:%S')
+    assert 'next_cursor' in lines[3]
+
+
+def test_models_load_lazily_and_once(monkeypatch, fresh_model_registry):
+    import CustomerSupportChatbotBackend
+    loads = []
+
+    class CountingStubReranker(StubReranker):
+        def __init__(self, model_name, use_fp16=True):
+            super().__init__()
+            loads.append(model_name)
+
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', CountingStubReranker)
+    app1, app2 = App1(), CustomerSupportChatbotBackend.App2()
+    assert loads == []  # aucun modèle chargé à la construction
+    app1.primary_llm.classify('hello')
+    app2.primary_llm.classify('hello')
+    assert loads == [App1.primary_model_name]  # secondary_llm jamais chargé, primaire partagé
+    assert app1.primary_llm.reranker is app2.primary_llm.reranker
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/smaps_rollup'), reason="Linux uniquement")
+def test_preloaded_model_is_shared_with_forked_children():
+    import numpy as np
+    from model_registry import ModelRegistry, fork_context, memory_usage_mb
+    loads = []
+
+    def stand_in_loader(model_name, use_fp16):
+        loads.append(model_name)
+        return np.ones(64 * 1024 * 1024 // 8)  # modèle factice de 64 Mo
+
+    registry = ModelRegistry(loader=stand_in_loader)
+    before = memory_usage_mb()['rss']
+    registry.preload('stand-in')
+    after = memory_usage_mb()['rss']
+    assert after - before > 48
+
+    context = fork_context()
+    results = context.Queue()
+
+    def child():
+        weights = registry.get('stand-in')
+        weights.sum()  # lecture seule : les pages restent partagées
+        results.put((len(loads), memory_usage_mb()['private']))
+
+    process = context.Process(target=child)
+    process.start()
+    child_loads, child_private = results.get(timeout=30)
+    process.join()
+    assert child_loads == 1  # l'enfant n'a pas rechargé le modèle
+    assert child_private < 32
+
+
+def test_cascade_escalates_only_uncertain_messages(monkeypatch):
+    import CustomerSupportChatbotBackend
+
+    class TierStubReranker(StubReranker):
+        def __init__(self, model_name, use_fp16=True):
+            super().__init__()
+            self.model_name = model_name
+
+        def _score(self, tag, message):
+            if self.model_name == 'base' and message.startswith('doubt'):
+                return 0.5  # le modèle léger hésite entre tous les tags
+            return 0.9 if tag in message else 0.1
+
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', TierStubReranker)
+    api = App1.ChatbotAPI(model_name='large', cascade_model_name='base', cascade_margin=0.2)
+    results = api.classify_batch(['clear refund', 'doubt about my refund', 'clear complaint'])
+
+    assert [r.tag for r in results] == ['refund', 'refund', 'complaint']
+    assert [r.tier for r in results] == ['base', 'large', 'base']
+    assert api.reranker.calls == [len(api.tag_list)]  # un seul message rescoré
+    assert api.chatbot_response('doubt: refund') == 'intent: "refund" (tier: "large")'
+
+    stats = api.cascade_stats()
+    assert stats['messages'] == 4 and stats['escalations'] == 2
+    assert stats['escalation_rate'] == 0.5
+    assert stats['tiers']['base']['count'] == 2 and stats['tiers']['large']['count'] == 2
+
+
+class StubEmbedder:
+    """Embedding déterministe : histogramme des mots, haché sur 64 dimensions."""
+    def __init__(self, *args, **kwargs):
+        self.calls = []
+
+    def encode(self, sentences):
+        import numpy as np
+        self.calls.append(len(sentences))
+        vectors = np.zeros((len(sentences), 64))
+        for i, sentence in enumerate(sentences):
+            for word in sentence.lower().split():
+                vectors[i, sum(map(ord, word)) % 64] += 1
+        return vectors
+
+
+def test_embedding_backend_scores_many_intents_with_one_encode(monkeypatch):
+    import CustomerSupportChatbotBackend
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_embedder', StubEmbedder)
+    api = App1.ChatbotAPI(model_name='stub', backend='embedding', embedding_model_name='stub-embedder')
+    api.tag_list = [f'intent{i}' for i in range(48)] + ['refund']
+    api.tag_descriptions = {'refund': 'give my money back please'}
+
+    assert api.classify('please give my money back').tag == 'refund'
+    assert api.classify('intent7').tag == 'intent7'
+    # une passe pour les tags (mise en cache), puis une seule par message
+    assert api.embedder.calls == [len(api.tag_list), 1, 1]
+    assert api.scoring_model_name == 'stub-embedder'
+
+    with pytest.raises(ValueError):
+        App1.ChatbotAPI(model_name='stub', backend='unknown')
+
+
+def test_wsgi_factory_preloads_model_and_shuts_down_cleanly(monkeypatch, fresh_model_registry):
+    import CustomerSupportChatbotBackend
+    import wsgi
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', StubReranker)
+    monkeypatch.setattr(wsgi, 'instances', [])
+
+    flask_app = wsgi.create_app('App2')
+    assert fresh_model_registry.is_loaded(CustomerSupportChatbotBackend.App2.primary_model_name)
+    response = flask_app.test_client().post('/chat', json={'message': 'where is my refund'})
+    assert response.status_code == 200
+    assert json.loads(response.data)['response'].startswith('Intent of the message')
+
+    instance = wsgi.instances[0]
+    wsgi.worker_exit(server=type('Server', (), {'cfg': type('Cfg', (), {'graceful_timeout': 5})})(),
+                     worker=None)
+    assert instance.primary_llm.scheduler._workers == []
+
+
+def test_wsgi_preloads_embedding_model_and_starts_tasks_without_preload_app(monkeypatch, fresh_model_registry):
+    import CustomerSupportChatbotBackend
+    import wsgi
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', StubReranker)
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_embedder', StubEmbedder)
+    monkeypatch.setattr(App1, 'classifier_backend', 'embedding')
+    monkeypatch.setattr(wsgi, 'instances', [])
+    monkeypatch.setattr(wsgi, 'in_worker', False)
+
+    # Sans preload_app, gunicorn forke le worker (post_fork) avant de charger l'application
+    wsgi.post_fork(server=None, worker=None)
+    wsgi.create_app('App1')
+    instance = wsgi.instances[0]
+    assert CustomerSupportChatbotBackend.embedding_registry.is_loaded(App1.embedding_model_name)
+    assert not fresh_model_registry.is_loaded(App1.primary_model_name)  # reranker inutilisé
+    assert instance.primary_llm.scheduler._workers
+    assert instance.ready.wait(5)
+    instance.shutdown(timeout=5)
+
+
+def test_stop_route_in_production_terminates_master_gracefully(client, app, monkeypatch):
+    kills = []
+    monkeypatch.setattr('os.kill', lambda pid, sig: kills.append((pid, sig)))
+    monkeypatch.setattr('os.getppid', lambda: 4242)
+    app.production = True
+    response = client.get('/stop')
+    assert response.status_code == 200
+    assert kills == [(4242, signal.SIGTERM)]
+
+
+def test_load_test_harness_reports_stages_and_is_reproducible(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(os.path.join(os.path.dirname(__file__), 'benchmarks'))
+    import load_test
+
+    mix = load_test.parse_mix('unique=0.5,repeat=0.5')
+    assert load_test.build_messages(50, mix, seed=3) == load_test.build_messages(50, mix, seed=3)
+
+    output = tmp_path / 'results.json'
+    exit_code = load_test.main(['--app', 'App1', '--requests', '40', '--concurrency', '4',
+                                '--call-cost', '0', '--pair-cost', '0', '--output', str(output)])
+    assert exit_code == 0
+    results = json.loads(output.read_text())['apps']['App1']
+    # Les messages invalides (403) du mélange par défaut ne font plus basculer l'application en 404
+    assert set(results['status_counts']) == {'200', '403'}
+    assert sum(results['status_counts'].values()) == 40
+    assert {'p50', 'p95', 'p99'} <= set(results['latency_ms'])
+    assert {'validation', 'cache_lookup', 'error_rate_check', 'admission', 'scoring'} <= set(results['stages_ms'])
+
+
+def test_metrics_route_exports_prometheus_text(client, stub_api, monkeypatch):
+    monkeypatch.setattr(App1, 'check_user_message', lambda self, msg: True)
+    client.post('/chat', json={'message': 'where is my refund'})
+    client.post('/chat', json={'message': 'where is my refund'})
+    client.post('/chat', json={})
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.data.decode()
+    assert '# TYPE chatbot_http_request_duration_seconds histogram' in text
+    assert 'chatbot_http_requests_total{route="/chat",status="200"} 2' in text
+    assert 'chatbot_http_requests_total{route="/chat",status="400"} 1' in text
+    assert 'chatbot_http_request_duration_seconds_count{route="/chat"} 3' in text
+    assert 'chatbot_intent_cache_hits_total 1' in text
+    assert 'chatbot_reranker_tag_seconds_total{model="BAAI/bge-reranker-large",tag="refund"}' in text
+    assert 'chatbot_reranker_pairs_total{model="BAAI/bge-reranker-large",tag="query"} 1' in text
+
+
+def test_metrics_overhead_stays_in_microseconds():
+    from metrics import MetricsRegistry
+    registry = MetricsRegistry()
+    requests = registry.counter('requests_total', 'doc', ('route', 'status'))
+    duration = registry.histogram('duration_seconds', 'doc', ('route',))
+    n = 100_000
+    start = time.perf_counter()
+    for i in range(n):
+        requests.inc('/chat', 200)
+        duration.observe(i * 1e-6, '/chat')
+    per_request_us = (time.perf_counter() - start) / n * 1e6
+    assert per_request_us < 20
+    assert 'duration_seconds_count{route="/chat"} 100000' in registry.render()
+
+
+@pytest.fixture
+def stub_backends():
+    """Démarre des instances factices dont le statut et la latence sont réglables."""
+    from flask import Flask, Response, jsonify
+    from werkzeug.serving import make_server
+    servers = []
+
+    def start(status=200, delay=0.0):
+        stub = Flask('stub-backend')
+        state = {'status': status, 'delay': delay, 'calls': 0}
+
+        @stub.route('/chat', methods=['POST'])
+        def chat():
+            state['calls'] += 1
+            time.sleep(state['delay'])
+            return (jsonify({'response': f"served by {state['port']}"}), state['status'],
+                    {'Retry-After': '2'} if state['status'] == 503 else {})
+
+        @stub.route('/chat/batch', methods=['POST'])
+        def chat_batch():
+            state['calls'] += 1
+            lines = (json.dumps({'index': i, 'status': 200}) + '\n' for i in range(3))
+            return Response(lines, mimetype='application/x-ndjson'), state['status']
+
+        @stub.route('/consulter-status-cache', methods=['POST'])
+        def post_only():
+            state['calls'] += 1
+            return jsonify({}), state['status']
+
+        @stub.route('/readyz')
+        def health():
+            return jsonify({}), 200 if state['status'] == 200 else 503
+
+        server = make_server('127.0.0.1', 0, stub, threaded=True)
+        state['port'] = server.server_port
+        state['url'] = f'http://127.0.0.1:{server.server_port}'
+        import threading
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return state
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def make_gateway(urls, **kwargs):
+    from gateway import Gateway
+    gateway = Gateway(urls, **kwargs)
+    gateway.setup_routes()
+    return gateway, gateway.app.test_client()
+
+
+def test_gateway_retries_failed_backend_on_the_other_one(stub_backends):
+    failing, healthy = stub_backends(status=500), stub_backends()
+    gateway, client = make_gateway([failing['url'], healthy['url']], strategy='least_outstanding')
+    for _ in range(5):
+        response = client.post('/chat', json={'message': 'hello'})
+        assert response.status_code == 200
+        assert response.headers['X-Backend'] == healthy['url']
+    # l'instance en échec est retirée après failure_threshold erreurs consécutives
+    assert failing['calls'] == gateway.failure_threshold
+    assert not gateway.backends[0].healthy
+
+
+def test_gateway_only_retries_chat_redirects_and_penalises_fast_errors(stub_backends):
+    redirecting, healthy = stub_backends(status=404), stub_backends(delay=0.02)
+    gateway, client = make_gateway([redirecting['url'], healthy['url']], failure_penalty=0.5)
+    for _ in range(3):
+        assert client.post('/chat', json={'message': 'hello'}).status_code == 200
+        # Route non exposée : refusée par la passerelle, sans rejouer ni pénaliser d'instance
+        assert client.get('/favicon.ico').status_code == 404
+    assert [(b.healthy, b.failures) for b in gateway.backends] == [(True, 0), (True, 0)]
+    # La redirection rapide ne fait pas passer l'instance pour la plus rapide
+    assert redirecting['calls'] == 1 and healthy['calls'] == 3
+
+    failing = stub_backends(status=500)
+    gateway, client = make_gateway([failing['url'], healthy['url']], failure_penalty=0.5)
+    for _ in range(5):
+        assert client.post('/chat', json={'message': 'hello'}).status_code == 200
+    assert failing['calls'] == 1
+    assert gateway.backends[0].ewma >= 0.5
+
+
+def test_gateway_streams_passes_headers_and_only_proxies_public_routes(stub_backends):
+    shedding, healthy = stub_backends(status=503), stub_backends()
+    gateway, client = make_gateway([shedding['url']])
+    response = client.post('/chat', json={'message': 'hello'})
+    assert response.status_code == 503 and response.headers['Retry-After'] == '2'
+
+    gateway, client = make_gateway([healthy['url'], shedding['url']], strategy='least_outstanding')
+    response = client.post('/chat/batch', json={'messages': ['a', 'b', 'c']})
+    assert response.is_streamed and response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['index'] for line in response.data.splitlines()] == [0, 1, 2]
+
+    # Routes d'administration non transmises
+    calls = healthy['calls'] + shedding['calls']
+    assert client.post('/stop').status_code == 404
+    assert client.get('/add-error-entries').status_code == 404
+    assert healthy['calls'] + shedding['calls'] == calls
+
+    # POST hors classification : une seule tentative, même en cas de 503
+    gateway, client = make_gateway([shedding['url'], healthy['url']], strategy='least_outstanding')
+    assert client.post('/consulter-status-cache').status_code == 503
+    assert gateway.backends[1].requests == 0
+
+
+def test_gateway_prefers_lower_latency_backend(stub_backends):
+    slow, fast = stub_backends(delay=0.05), stub_backends(delay=0.0)
+    gateway, client = make_gateway([slow['url'], fast['url']], strategy='ewma')
+    for _ in range(20):
+        assert client.post('/chat', json={'message': 'hello'}).status_code == 200
+    assert fast['calls'] > 15 and slow['calls'] <= 2
+
+
+def test_gateway_health_checks_and_deadline(stub_backends):
+    slow = stub_backends(delay=2.0)
+    gateway, client = make_gateway([slow['url'], 'http://127.0.0.1:9'], deadline=0.2, failure_threshold=1)
+    gateway.check_health()
+    assert [b.healthy for b in gateway.backends] == [True, False]
+
+    # Le 504 vient de l'échéance : l'instance aurait répondu 200 au bout de 2 s
+    start = time.monotonic()
+    response = client.post('/chat', json={'message': 'hello'})
+    assert response.status_code == 504
+    assert time.monotonic() - start < slow['delay']
+
+    status = json.loads(client.get('/gateway-status').data)
+    assert status['backends'][1]['healthy'] is False
+
+
+def test_hedging_cuts_tail_latency_with_fault_injecting_stub(monkeypatch):
+    monkeypatch.syspath_prepend(os.path.join(os.path.dirname(__file__), 'benchmarks'))
+    import bench_hedging
+    without, with_hedging = bench_hedging.main(['--requests', '120', '--slow', '0.15', '--slow-rate', '0.1'])
+    assert without['p99_ms'] >= 140 and without['hedges'] == 0
+    # La couverture part sur les appels lents et l'emporte : la queue de latence est
+    # comparée à celle de la même charge sans couverture, pas à un seuil absolu
+    assert 0 < with_hedging['hedge_wins'] <= with_hedging['hedges']
+    assert with_hedging['p99_ms'] < without['p99_ms'] / 2
+
+
+def test_retry_budget_caps_retries_and_deadline_is_enforced():
+    from resilience import InferenceTimeout, ResilientCaller, RetryBudget
+    calls = []
+
+    def always_failing(message):
+        calls.append(message)
+        raise RuntimeError("model down")
+
+    caller = ResilientCaller(backoff=0, retry_budget=RetryBudget(ratio=0.1, initial_tokens=2))
+    for i in range(50):
+        with pytest.raises(RuntimeError):
+            caller.call(always_failing, f'message {i}')
+    # 50 requêtes + au plus 2 jetons initiaux + 10 % du trafic
+    assert len(calls) - 50 == caller.retries <= 2 + 5
+
+    caller = ResilientCaller(deadline=0.1)
+    start = time.monotonic()
+    with pytest.raises(InferenceTimeout):
+        caller.call(lambda message: time.sleep(1), 'slow')
+    assert time.monotonic() - start < 0.5
+
+
+def test_timed_out_call_still_queued_is_cancelled():
+    from resilience import InferenceTimeout, ResilientCaller
+    caller = ResilientCaller(deadline=0.05, pool_size=1)
+    unblock, started, settled = threading.Event(), [], []
+    caller._pool.submit(unblock.wait, 5)  # le seul thread est occupé
+    with pytest.raises(InferenceTimeout):
+        caller.call(started.append, 'queued', on_settled=lambda: settled.append(True))
+    unblock.set()
+    caller._pool.shutdown(wait=True)
+    # L'appel annulé en file ne part jamais vers le modèle, et sa place est rendue
+    assert started == [] and settled == [True]
+
+
+def test_hedge_delay_is_refreshed_periodically():
+    from resilience import ResilientCaller
+    caller = ResilientCaller(hedge_min_samples=2, hedge_refresh=10)
+    for _ in range(2):
+        caller.primary_latency.record(0.1)
+    assert caller.hedge_delay() == pytest.approx(0.1)
+    for _ in range(9):
+        caller.primary_latency.record(1.0)
+    assert caller.hedge_delay() == pytest.approx(0.1)  # valeur en cache
+    caller.primary_latency.record(1.0)
+    assert caller.hedge_delay() > 0.5
+
+
+def test_timed_out_inference_keeps_its_admission_slot_until_it_finishes(monkeypatch):
+    monkeypatch.setattr(App1, 'inference_deadline', 0.05)
+    monkeypatch.setattr(App1, 'check_user_message', lambda self, msg: True)
+    unblock = threading.Event()
+    monkeypatch.setattr(App1.ChatbotAPI, 'chatbot_response', lambda self, msg: unblock.wait(5) and 'ok')
+    app = App1()
+    app.setup_routes()
+    response = app.app.test_client().post('/chat', json={'message': 'Hello'})
+    assert response.status_code == 500
+    # Le modèle bloqué tourne toujours : sa place d'inférence n'est pas rendue
+    assert app.admission.stats()['in_flight'] == 1
+    unblock.set()
+    deadline = time.monotonic() + 1
+    while app.admission.stats()['in_flight'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert app.admission.stats()['in_flight'] == 0
+
+
+def test_chat_route_returns_500_quickly_when_llm_keeps_failing(client, monkeypatch):
+    monkeypatch.setattr(App1, 'check_user_message', lambda self, msg: True)
+    def mock_chatbot_response(self, msg):
+        raise Exception("LLM failed")
+    monkeypatch.setattr(App1.ChatbotAPI, 'chatbot_response', mock_chatbot_response)
+    start = time.monotonic()
+    response = client.post('/chat', json={'message': 'Hello'})
+    assert response.status_code == 500
+    assert time.monotonic() - start < 1  # l'ancien retry tenacity bloquait plus de 15 s
+
+
+def test_admission_controller_queues_then_sheds_and_adapts_limit():
+    from admission import AdmissionController
+    controller = AdmissionController(initial_limit=2, queue_size=1, queue_timeout=0.5, window=4)
+    assert controller.acquire() and controller.acquire()
+    # File pleine : refus immédiat, sans attendre queue_timeout
+    waiter = threading.Thread(target=controller.acquire)
+    waiter.start()
+    while controller.stats()['waiting'] == 0:
+        time.sleep(0.001)
+    assert not controller.acquire()
+    assert controller.stats()['rejected'] == 1 and controller.stats()['timeouts'] == 0
+    waiter.join()
+    # Seule la requête en file a attendu queue_timeout
+    assert controller.stats()['rejected'] == 2 and controller.stats()['timeouts'] == 1
+
+    # Latence stable à pleine charge : la limite monte ; latence dégradée : elle baisse
+    for _ in range(4):
+        controller.release(0.01)
+        controller.acquire()
+    assert controller.limit == 3
+    for _ in range(4):
+        controller.release(0.1)
+        controller.acquire()
+    assert controller.limit == 2
+    assert controller.retry_after() >= 1
+
+
+def test_chat_route_sheds_load_with_retry_after(client, app, monkeypatch):
+    monkeypatch.setattr(App1, 'check_user_message', lambda self, msg: True)
+    monkeypatch.setattr(App1.ChatbotAPI, 'chatbot_response', lambda self, msg: 'ok')
+    for _ in range(app.admission.limit):
+        app.admission.acquire()
+    app.admission.queue_size = 0
+    response = client.post('/chat', json={'message': 'Hello'})
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    assert json.loads(client.get('/admission-stats').data)['rejected'] == 1
+    # Une rafale délestée ne compte pas dans le taux d'erreur : une fois la limite libérée,
+    # les messages suivants sont traités au lieu d'être redirigés (404)
+    assert [client.post('/chat', json={'message': f'Burst {i}'}).status_code for i in range(3)] == [503] * 3
+    assert app.count_server_error_rate_in_chat_cache() == 0
+    for _ in range(app.admission.limit):
+        app.admission.release(0.01)
+    assert [client.post('/chat', json={'message': f'Hello {i}'}).status_code for i in range(3)] == [200] * 3
+
+
+def test_chat_batch_streams_ndjson_in_order(client, app, monkeypatch):
+    import CustomerSupportChatbotBackend
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', StubReranker)
+    messages = ['where is my refund', 'racist', 'the product is broken', '1234', 42]
+    response = client.post('/chat/batch', json={'messages': messages})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [line['index'] for line in lines] == list(range(5))
+    assert [line['status'] for line in lines] == [200, 403, 200, 403, 403]
+    assert [line.get('rule') for line in lines[1::2]] == ['racist*', 'digits_only']
+    api = App1.ChatbotAPI(model_name='stub')
+    assert lines[0]['intent'] == legacy_winner(api, messages[0])
+    assert lines[0]['response'] == api.response_template.format(tag=lines[0]['intent'])
+
+    assert client.post('/chat/batch', json={'messages': []}).status_code == 400
+
+
+def test_chat_batch_reports_failed_and_shed_chunks_in_stream(client, app, monkeypatch):
+    import CustomerSupportChatbotBackend
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', StubReranker)
+    monkeypatch.setattr(app, 'max_batch_size', 2)
+    calls = []
+
+    def classify_many(self, messages):
+        calls.append(messages)
+        if len(calls) == 1:
+            raise RuntimeError('model down')
+        return [CustomerSupportChatbotBackend.IntentResult('refund', {}, 'stub') for _ in messages]
+    monkeypatch.setattr(App1.ChatbotAPI, 'classify_many', classify_many)
+
+    messages = ['where is my refund', 'racist', 'my refund', 'refund again']
+    lines = [json.loads(line) for line in client.post('/chat/batch', json={'messages': messages}).data.splitlines()]
+    # Le premier paquet échoue : ses messages valides sont en erreur, le second est classé
+    assert [line['status'] for line in lines] == [500, 403, 200, 200]
+    assert lines[0]['error'] == 'LLM failed'
+    assert app.admission.stats()['in_flight'] == 0 and app.admission.admitted == 2
+
+    # Limite atteinte : les paquets attendent puis sont délestés (503) sans casser le flux
+    for _ in range(app.admission.limit):
+        app.admission.acquire()
+    monkeypatch.setattr(app, 'inference_deadline', 0.01)
+    lines = [json.loads(line) for line in client.post('/chat/batch', json={'messages': messages}).data.splitlines()]
+    assert [line['status'] for line in lines] == [503, 403, 503, 503]
+    app.batch_max_messages = 2
+    assert client.post('/chat/batch', json={'messages': messages}).status_code == 413
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_offline_classification_is_ordered_and_resumable(tmp_path, monkeypatch, workers):
+    import CustomerSupportChatbotBackend
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', StubReranker)
+    source = tmp_path / 'tickets.csv'
+    messages = [f'ticket number {i} about my order' for i in range(50)] + ['racist']
+    source.write_text('id,message\n' + ''.join(f't{i},{m}\n' for i, m in enumerate(messages)))
+    output = tmp_path / 'results.jsonl'
+
+    summary = CustomerSupportChatbotBackend.classify_messages_file(
+        str(source), str(output), workers=workers, chunk_size=8)
+    assert summary['messages'] == 51 and summary['messages_per_second'] > 0
+    expected = output.read_text().splitlines()
+    assert [json.loads(line)['id'] for line in expected] == [f't{i}' for i in range(51)]
+    assert json.loads(expected[-1])['status'] == 403
+
+    # Exécution interrompue au milieu d'une ligne : seule la suite est recalculée
+    output.write_text('\n'.join(expected[:20]) + '\n' + expected[20][:10])
+    summary = CustomerSupportChatbotBackend.classify_messages_file(
+        str(source), str(output), workers=workers, chunk_size=8)
+    assert summary['resumed_after'] == 20 and summary['messages'] == 31
+    assert output.read_text().splitlines() == expected
+
+
+def test_content_filter_matches_in_one_pass():
+    from content_filter import ContentFilter
+    # Par défaut, sous-chaînes comme l'ancienne vérification
+    substrings = ContentFilter(['he', 'she', 'hers', 'Scam', 'racist*'])
+    assert substrings.find('ushers') == ('she', 1, 4)  # lien d'échec she -> he
+    assert substrings.find('this is a SCAM!') == ('Scam', 10, 14)
+    assert substrings.find('antiracist').rule == 'racist*'
+    words = ContentFilter(['he', 'she', 'hers', 'Scam', 'racist*'], whole_words=True)
+    assert words.find('ushers') is None  # mots entiers uniquement
+    assert words.find('so racists here').rule == 'racist*'
+    assert words.find('antiracist') is None
+    assert ContentFilter(['Scam'], casefold=False).find('scam') is None
+
+
+def test_check_user_message_reports_rule_and_reloads_list(tmp_path, monkeypatch):
+    terms = tmp_path / 'terms.txt'
+    terms.write_text('# commentaire\nracist*\n')
+    monkeypatch.setattr(App1, 'content_filter_path', str(terms))
+    monkeypatch.setattr(App1, 'content_filter_reload_interval', 0)
+    app = App1()
+    assert not app.check_user_message('You are RACIST')
+    assert not app.check_user_message('  42 ')
+    assert app.check_user_message('my refund is late')
+    assert app.moderate_message('') == 'empty'
+
+    terms.write_text('racist*\nrefund\n')
+    os.utime(terms, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert app.moderate_message('my refund is late') == 'refund'
+    assert app.content_filter.stats()['version'] == 2
+    assert 'chatbot_content_filter_matches_total{rule="refund"} 1' in app.metrics.render()
+
+
+def test_failed_content_filter_reload_keeps_previous_list(tmp_path, monkeypatch):
+    terms = tmp_path / 'terms.txt'
+    terms.write_text('racist*\n')
+    monkeypatch.setattr(App1, 'content_filter_path', str(terms))
+    monkeypatch.setattr(App1, 'content_filter_reload_interval', 0)
+    app = App1()
+    app.setup_routes()
+    client = app.app.test_client()
+    import content_filter
+    read_terms, reads = content_filter.read_terms, []
+
+    def counting_read_terms(path):
+        reads.append(path)
+        return read_terms(path)
+    monkeypatch.setattr(content_filter, 'read_terms', counting_read_terms)
+
+    terms.write_bytes(b'racist*\n\xff\xfe\n')
+    os.utime(terms, ns=(time.time_ns(), time.time_ns() + 10**9))
+    # L'ancienne liste reste en service, sans relire le fichier à chaque message
+    assert not app.check_user_message('You are racist')
+    assert app.check_user_message('my refund is late')
+    assert len(reads) == 1
+    stats = json.loads(client.get('/content-filter-stats').data)
+    assert stats['version'] == 1 and stats['last_error'].startswith('UnicodeDecodeError')
+
+    terms.unlink()
+    response = client.post('/reload-content-filter')
+    assert response.status_code == 500
+    assert json.loads(response.data)['last_error'].startswith('FileNotFoundError')
+    assert not app.check_user_message('You are racist')
+
+
+def test_import_does_not_load_flag_embedding():
+    import subprocess
+    import sys
+    script = "import sys, CustomerSupportChatbotBackend; print('FlagEmbedding' in sys.modules)"
+    output = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == 'False'
+
+
+def test_readyz_waits_for_background_warm_up(client, app, monkeypatch):
+    import CustomerSupportChatbotBackend
+    loaded = threading.Event()
+
+    def slow_loader(model_name, use_fp16=True):
+        loaded.wait(5)
+        return StubReranker()
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', slow_loader)
+
+    app.start_warm_up()
+    assert client.get('/healthz').status_code == 200
+    response = client.get('/readyz')
+    assert response.status_code == 503 and json.loads(response.data)['status'] == 'loading'
+
+    loaded.set()
+    assert app.ready.wait(5)
+    data = json.loads(client.get('/readyz').data)
+    assert data['status'] == 'ready' and data['models'] == [app.primary_model_name]
+
+
+def test_readyz_reports_failed_warm_up(client, app, monkeypatch):
+    import CustomerSupportChatbotBackend
+    def broken_loader(model_name, use_fp16=True):
+        raise OSError('model not found')
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', broken_loader)
+    app.warm_up()
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert json.loads(response.data) == {'status': 'failed', 'error': 'model not found'}
+
+
+@pytest.fixture
+def health_board():
+    from health_board import HealthBoard
+    board = HealthBoard(slots=2)
+    yield board
+    board.close()
+    board.unlink()
+
+
+def test_health_board_is_shared_with_forked_process(health_board):
+    from model_registry import fork_context
+
+    def publish():
+        health_board.publish(1, pid=os.getpid(), heartbeat=time.time(), in_flight=3, limit=8, error_rate=12.5)
+    child = fork_context().Process(target=publish)
+    child.start()
+    child.join()
+    assert health_board.read(0) is None
+    state = health_board.read(1)
+    assert state['pid'] == child.pid and state['in_flight'] == 3 and state['error_rate'] == 12.5
+
+    # Écrivain mort entre les deux incréments : la ligne reste impaire et est ignorée
+    health_board._rows[1][0] += 1
+    assert health_board.read(1) is None
+
+
+def test_chat_only_reads_health_board_when_saturated(client, app, monkeypatch):
+    monkeypatch.setattr(App1, 'check_user_message', lambda self, msg: True)
+    monkeypatch.setattr(App1.ChatbotAPI, 'chatbot_response', lambda self, msg: 'ok')
+    reads = []
+    monkeypatch.setattr(app, 'peer_available', lambda: reads.append(True) or True)
+    monkeypatch.setattr(app, 'publish_health', lambda: pytest.fail('publié sur le chemin de la requête'))
+    assert client.post('/chat', json={'message': 'Hello'}).status_code == 200
+    assert reads == []
+    for _ in range(app.admission.limit):
+        app.admission.acquire()
+    app.admission.queue_size = 0
+    assert client.post('/chat', json={'message': 'Hello again'}).status_code == 503
+    assert reads == [True]
+
+
+def test_request_admitted_after_waiting_is_not_counted_as_shed(health_board, monkeypatch):
+    monkeypatch.setattr(App1, 'check_user_message', lambda self, msg: True)
+    monkeypatch.setattr(App1.ChatbotAPI, 'chatbot_response', lambda self, msg: 'ok')
+    app = App1(health_board=health_board)
+    app.setup_routes()
+    for _ in range(app.admission.limit):
+        app.admission.acquire()
+    # Pas d'autre instance disponible : la requête attend une place au lieu d'être refusée
+    threading.Timer(2 * app.admission_queue_timeout, app.admission.release).start()
+    assert app.app.test_client().post('/chat', json={'message': 'Hello'}).status_code == 200
+    assert app.admission.rejected == 0
+    app.publish_health()
+    assert health_board.read(0)['shed'] == 0
+
+
+def test_saturated_instance_only_redirects_when_peer_has_capacity(health_board, monkeypatch):
+    from CustomerSupportChatbotBackend import App2
+    monkeypatch.setattr(App1, 'check_user_message', lambda self, msg: True)
+    monkeypatch.setattr(App1.ChatbotAPI, 'chatbot_response', lambda self, msg: 'ok')
+    app1, app2 = App1(health_board=health_board), App2(health_board=health_board)
+    app1.setup_routes()
+    client = app1.app.test_client()
+    for _ in range(10):
+        app1.error_rate_tracker.record(500)
+
+    assert not app1.peer_available()  # l'autre instance n'a encore rien publié
+    assert client.post('/chat', json={'message': 'Hello'}).status_code == 200
+
+    app2.ready.set()
+    app2.publish_health()
+    assert app1.peer_available()
+    assert client.post('/chat', json={'message': 'Hello again'}).status_code == 404
+
+    for _ in range(app2.admission.limit):
+        app2.admission.acquire()
+    app2.publish_health()
+    assert not app1.peer_available()
+
+    app1.publish_health()  # publié par le thread de fond en production
+    board = json.loads(client.get('/health-board').data)
+    assert board['slot'] == 0
+    assert [(i['slot'], i['in_flight'], i['stale']) for i in board['instances']] == \
+        [(0, 0, False), (1, app2.admission.limit, False)]
+
+
+class WhitespaceTokenizer:
+    """Tokenizer factice (un token par mot) avec les tokens spéciaux de XLM-RoBERTa."""
+    pad_token_id = 1
+
+    def __init__(self):
+        self.vocab = {}
+        self.calls = []
+
+    def __call__(self, texts, add_special_tokens=True):
+        self.calls.append(texts)
+        encode = lambda text: [self.vocab.setdefault(word, len(self.vocab) + 3) for word in text.lower().split()]
+        return {'input_ids': encode(texts) if isinstance(texts, str) else [encode(text) for text in texts]}
+
+    def build_inputs_with_special_tokens(self, ids_a, ids_b):
+        return [0] + ids_a + [2, 2] + ids_b + [2]
+
+
+@pytest.fixture
+def tokenized_api(monkeypatch):
+    import CustomerSupportChatbotBackend
+    reranker = type('TokenizedReranker', (), {'tokenizer': WhitespaceTokenizer(), 'model': object()})()
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', lambda *args, **kwargs: reranker)
+    forwards = []
+
+    def fake_run_reranker(reranker, input_ids, attention_mask):
+        # Logit élevé si le mot du tag apparaît dans la partie message de la paire
+        forwards.append(input_ids.shape)
+        logits = []
+        for ids, mask in zip(input_ids, attention_mask):
+            ids = list(ids[:mask.sum()])
+            separator = ids.index(2)
+            logits.append(5.0 if ids[separator - 1] in ids[separator + 2:] else -5.0)
+        return np.array(logits)
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'run_reranker', fake_run_reranker)
+    api = App1.ChatbotAPI(model_name='tokenized', message_token_budget=8, max_pairs_per_forward=10,
+                          tokenized_scoring=True)
+    return api, reranker.tokenizer, forwards
+
+
+def test_tokenized_scoring_caches_tags_and_truncates_long_messages(tokenized_api):
+    api, tokenizer, forwards = tokenized_api
+    long_email = 'hello ' * 50 + 'I want a refund'
+    messages = ['refund please', 'do you have inventory', long_email]
+
+    assert api.classify_batch(messages)[0].tag == 'refund'
+    assert api.classify_batch(messages)[1].tag == 'inventory'
+    # Tags tokenisés une seule fois, puis un appel au tokenizer par batch de messages
+    assert tokenizer.calls[:len(api.tag_list)] == api.tag_list
+    assert tokenizer.calls[len(api.tag_list):] == [messages, messages]
+    # Message tronqué à 8 tokens : "refund" en fin d'email n'est pas vu
+    assert api.classify_batch([long_email])[0].scores['refund'] < 0.5
+    # 15 paires triées par longueur : les paires des messages courts ne sont pas complétées à 13 tokens
+    assert forwards[:2] == [(10, 9), (5, 13)]
+
+    stats = api.length_stats()
+    assert list(stats) == ['<=16', '<=64']
+    assert stats['<=64']['over_budget'] == 3 and stats['<=16']['messages'] == 4
+
+
+def test_tokenized_scoring_is_opt_in(monkeypatch):
+    import CustomerSupportChatbotBackend
+
+    class TokenizedStubReranker(StubReranker):
+        tokenizer = WhitespaceTokenizer()
+        model = object()
+
+        def compute_score(self, pairs, normalize=False, max_length=512):
+            self.max_length = max_length
+            return super().compute_score(pairs, normalize)
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', TokenizedStubReranker)
+    api = App1.ChatbotAPI(model_name='stub', message_token_budget=8)
+    api.classify_batch(['where is my refund', 'hello ' * 50])
+    # Par défaut, les scores viennent de compute_score, sans appeler le modèle directement,
+    # avec le même budget de tokens : <s> tag </s></s> 8 tokens du message </s>
+    assert api.reranker.calls == [2 * len(api.tag_list)]
+    assert api.reranker.max_length == 4 + 1 + 8
+    stats = api.length_stats()
+    assert stats['<=16']['messages'] == 1 and stats['<=64']['over_budget'] == 1
+
+
+@pytest.mark.skipif(not os.environ.get('PARITY_RERANKER_MODEL'),
+                    reason="Nécessite FlagEmbedding et un reranker réel (PARITY_RERANKER_MODEL)")
+def test_tokenized_scoring_matches_compute_score():
+    # Ex. : PARITY_RERANKER_MODEL=BAAI/bge-reranker-base python -m pytest -k parity
+    model_name = os.environ['PARITY_RERANKER_MODEL']
+    messages = ['I want a refund for my order', 'Do you have this laptop in stock?',
+                'Thanks a lot, great service', 'My package arrived damaged and nobody answers']
+    reference = App1.ChatbotAPI(model_name=model_name)
+    tokenized = App1.ChatbotAPI(model_name=model_name, tokenized_scoring=True)
+    expected = reference.score_messages(messages)
+    assert np.allclose(tokenized.score_messages(messages), expected, atol=1e-2)
+
+
+def test_tokenized_scoring_windows_long_messages(tokenized_api):
+    api, _, _ = tokenized_api
+    api.window_stride = 4
+    long_email = 'hello ' * 50 + 'I want a refund'
+    assert api.classify_batch([long_email])[0].tag == 'refund'
+
+
+class KeywordStubReranker(StubReranker):
+    def _score(self, tag, message):
+        return 0.9 if tag in message.lower() else 0.1
+
+
+def test_semantic_cache_reuses_intent_of_paraphrased_messages(monkeypatch):
+    import CustomerSupportChatbotBackend
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', KeywordStubReranker)
+    api = App1.ChatbotAPI(model_name='stub', semantic_cache_size=2, semantic_cache_threshold=0.85,
+                          semantic_cache_audit_rate=0)
+
+    assert api.chatbot_response('I want a refund for my order please') == 'intent: "refund"'
+    calls = len(api.reranker.calls)
+    # Casse, ponctuation et faute de frappe : même intention, sans passer par le modèle
+    assert api.chatbot_response('i want a refnd for my order please!!') == 'intent: "refund"'
+    assert len(api.reranker.calls) == calls
+    api.chatbot_response('do you have this product in inventory')
+    assert len(api.reranker.calls) > calls
+
+    # Plein : le message le moins récemment utilisé (l'inventaire) est évincé
+    api.chatbot_response('I want a refund for my order please')
+    api.chatbot_response('I have a complaint about the delivery')
+    calls = len(api.reranker.calls)
+    api.chatbot_response('I want a refund for my order please')
+    assert len(api.reranker.calls) == calls
+    api.chatbot_response('do you have this product in inventory')
+    assert len(api.reranker.calls) > calls
+
+    stats = api.semantic_cache.stats()
+    assert (stats['size'], stats['lookups'], stats['hits'], stats['evictions']) == (2, 7, 3, 2)
+    assert stats['agreement_rate'] is None and stats['lookup_latency']['count'] == 7
+
+
+def test_semantic_cache_audits_hits_and_reports_stats(client, app, monkeypatch):
+    import CustomerSupportChatbotBackend
+    assert client.get('/semantic-cache-stats').status_code == 404
+
+    monkeypatch.setattr(CustomerSupportChatbotBackend, 'load_reranker', KeywordStubReranker)
+    api = App1.ChatbotAPI(model_name='stub', semantic_cache_size=8, semantic_cache_audit_rate=1)
+    monkeypatch.setattr(app, 'current_llm', api)
+    api.chatbot_response('where is my refund')
+    # Seuil volontairement bas : le dernier message reprend une intention que le modèle contredit
+    api.semantic_cache.threshold = 0.3
+    api.chatbot_response('where is my refund ?')
+    assert api.chatbot_response('where is my inventory') == 'intent: "inventory"'
+
+    stats = json.loads(client.get('/semantic-cache-stats').data)
+    assert (stats['hits'], stats['audits'], stats['agreement_rate'], stats['corrections']) == (2, 2, 0.5, 1)
+    assert stats['size'] == 1  # l'entrée « refund » a été remplacée, pas dupliquée
+
+    # Le désaccord a servi la réponse du modèle et corrigé l'entrée du cache
+    api.semantic_cache_audit_rate = 0
+    api.semantic_cache.threshold = 0.9
+    assert api.chatbot_response('where is my inventory') == 'intent: "inventory"'
+
+    with pytest.raises(ValueError):
+        App1.ChatbotAPI(model_name='stub', semantic_cache_vectorizer='unknown')
@@ -0,0 +1,107 @@
+"""
+Point d'entrée de production : les applications sont servies par gunicorn
+au lieu du serveur de développement de Flask (App.run).
+
+Usage :
+    python wsgi.py App1 --workers 4 --threads 8
+    APP=App2 gunicorn -c gunicorn.conf.py "wsgi:create_app()"
+
+Les modèles sont chargés dans le master avant le fork des workers
+(preload_app), qui partagent ainsi les poids en copy-on-write.
+"""
+import argparse
+import os
+
+import CustomerSupportChatbotBackend as backend
+
+# Instances créées par create_app dans ce processus, pour les hooks gunicorn
+instances = []
+# Passe à True dans un worker, une fois forké : sans preload_app, create_app y est
+# appelé après post_fork et démarre alors lui-même les tâches de fond
+in_worker = False
+
+
+def default_app_name():
+    """:return: La classe d'application choisie par la variable d'environnement APP (App1 par défaut)."""
+    return os.environ.get('APP', 'App1')
+
+
+def create_app(name=None, preload_models=True):
+    """
+    Fabrique d'application WSGI.
+
+    :param name: La classe d'application à servir ('App1' ou 'App2'), default_app_name() par défaut :
+                 gunicorn.conf.py en déduit aussi le port d'écoute.
+    :param preload_models: Charge les modèles de l'application immédiatement (dans le master
+                           gunicorn avec preload_app) plutôt qu'à la première requête
+                           (voir App1.preload_models).
+    :return: L'application Flask, prête à être servie.
+    """
+    instance = getattr(backend, name or default_app_name())()
+    instance.production = True
+    instance.setup_routes()
+    if preload_models:
+        type(instance).preload_models()
+    instances.append(instance)
+    if in_worker:
+        instance.start_background_tasks()
+        instance.start_warm_up()
+    return instance.app
+
+
+def post_fork(server, worker):
+    # Les threads ne survivent pas au fork : on démarre les tâches de fond dans chaque worker,
+    # puis la chauffe des modèles (déjà chargés par le master si preload_models)
+    global in_worker
+    in_worker = True
+    for instance in instances:
+        instance.start_background_tasks()
+        instance.start_warm_up()
+
+
+def worker_exit(server, worker):
+    # Arrêt gracieux : on vide la file d'inférence avant que le worker ne s'arrête
+    for instance in instances:
+        instance.shutdown(timeout=server.cfg.graceful_timeout)
+
+
+def serve(name='App1', port=None, workers=2, threads=8, graceful_timeout=30):
+    """
+    Lance gunicorn dans le processus courant.
+
+    :param name: La classe d'application à servir ('App1' ou 'App2').
+    :param port: Le port d'écoute, celui de la classe d'application par défaut.
+    :param workers: Nombre de processus workers.
+    :param threads: Nombre de threads par worker (worker gthread), pour les entrées/sorties.
+    :param graceful_timeout: Délai laissé aux requêtes en cours lors d'un arrêt (SIGTERM).
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class StandaloneApplication(BaseApplication):
+        def load_config(self):
+            port_ = port or getattr(backend, name).port
+            self.cfg.set('bind', f'0.0.0.0:{port_}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', threads)
+            self.cfg.set('preload_app', True)
+            self.cfg.set('graceful_timeout', graceful_timeout)
+            self.cfg.set('post_fork', post_fork)
+            self.cfg.set('worker_exit', worker_exit)
+
+        def load(self):
+            return create_app(name)
+
+    StandaloneApplication().run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sert App1 ou App2 avec gunicorn.")
+    parser.add_argument('app', nargs='?', default='App1', choices=['App1', 'App2'])
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--graceful-timeout', type=int, default=30)
+    args = parser.parse_args()
+    serve(args.app, port=args.port, workers=args.workers, threads=args.threads,
+          graceful_timeout=args.graceful_timeout)